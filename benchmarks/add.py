@@ -0,0 +1,54 @@
+"""Compare adding files to the index one by one with adding them in a single batch.
+
+Run with `python -m benchmarks.add`.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from fudge.index import add_file_to_index, add_files_to_index, read_index
+from fudge.repository import create_repository
+from fudge.working import expand_paths
+
+
+NUM_FILES = 2000
+
+
+def write_files():
+    """Write small files spread over a few directories."""
+    for i in range(NUM_FILES):
+        dirpath = os.path.join('src', 'module{}'.format(i % 50))
+        os.makedirs(dirpath, exist_ok=True)
+        with open(os.path.join(dirpath, 'file{}.py'.format(i)), 'w') as f:
+            f.write('file {}\n'.format(i))
+
+
+def main():
+    path = tempfile.mkdtemp()
+    cwd = os.getcwd()
+
+    try:
+        os.chdir(path)
+        write_files()
+
+        create_repository()
+        start = time.perf_counter()
+        for filepath in expand_paths(['src']):
+            add_file_to_index(filepath)
+        print('one by one: {} files in {:.2f} s'.format(NUM_FILES, time.perf_counter() - start))
+
+        shutil.rmtree('.fudge')
+        create_repository()
+        start = time.perf_counter()
+        add_files_to_index(expand_paths(['src']))
+        print('batch:      {} files in {:.2f} s'.format(NUM_FILES, time.perf_counter() - start))
+
+        assert len(list(read_index())) == NUM_FILES
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Compare listing reachable objects by walking the history with using a bitmap index.
+
+Run with `python -m benchmarks.bitmap`.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from fudge.object import Object, ObjectWriter, object_cache
+from fudge.packobjects import repack
+from fudge.parsing.builder import Builder
+from fudge.refs import write_ref
+from fudge.repository import create_repository
+from fudge.revlist import get_tips, iter_reachable_object_ids, iter_reachable_objects
+
+
+NUM_COMMITS = 2000
+NUM_DIRECTORIES = 20
+NUM_FILES = 10
+
+
+def build_tree(entries):
+    builder = Builder(padding=False)
+    for mode, name, object_id in sorted(entries, key=lambda entry: entry[1]):
+        builder.set_utf8('{} {}'.format(mode, name))
+        builder.set_sha1(object_id)
+    return Object('tree', len(builder.data), bytes(builder.data))
+
+
+def write_history():
+    """Store a history where each commit changes one file of a two-level tree."""
+    objects = []
+    files = [['initial\n'] * NUM_FILES for _ in range(NUM_DIRECTORIES)]
+    blobs = [[None] * NUM_FILES for _ in range(NUM_DIRECTORIES)]
+    parent = None
+
+    for i in range(NUM_COMMITS):
+        directory, filename = i % NUM_DIRECTORIES, i // NUM_DIRECTORIES % NUM_FILES
+        files[directory][filename] += 'changed in commit {}\n'.format(i)
+
+        for d in range(NUM_DIRECTORIES):
+            for f in range(NUM_FILES):
+                if blobs[d][f] is None or (d, f) == (directory, filename):
+                    contents = files[d][f]
+                    blobs[d][f] = Object('blob', len(contents), contents)
+                    objects.append(blobs[d][f])
+
+        subtrees = []
+        for d in range(NUM_DIRECTORIES):
+            subtree = build_tree(('100644', 'file{}'.format(f), blobs[d][f].id)
+                                 for f in range(NUM_FILES))
+            objects.append(subtree)
+            subtrees.append(('40000', 'dir{}'.format(d), subtree.id))
+
+        tree = build_tree(subtrees)
+        objects.append(tree)
+
+        contents = 'tree {}\n'.format(tree.id)
+        if parent:
+            contents += 'parent {}\n'.format(parent)
+        contents += 'author A U Thor <author@example.com> {} +0000\n'.format(i)
+        contents += 'committer A U Thor <author@example.com> {} +0000\n'.format(i)
+        contents += '\nCommit {}\n'.format(i)
+        commit = Object('commit', len(contents), contents)
+        objects.append(commit)
+        parent = commit.id
+
+    ObjectWriter().write(objects)
+    write_ref('refs/heads/master', parent)
+
+
+def measure(enumerate_objects):
+    """Return the number of listed objects and the elapsed time, with an empty object cache."""
+    object_cache.clear()
+
+    start = time.perf_counter()
+    count = sum(1 for _ in enumerate_objects(get_tips()))
+    return count, time.perf_counter() - start
+
+
+def main():
+    path = tempfile.mkdtemp()
+    cwd = os.getcwd()
+
+    try:
+        os.chdir(path)
+        create_repository()
+        write_history()
+
+        start = time.perf_counter()
+        repack(window=0, delete=True, write_bitmap=True)
+        print('repack with bitmaps: {:.2f} s'.format(time.perf_counter() - start))
+
+        count, elapsed = measure(iter_reachable_objects)
+        print('history walk: {} objects in {:.3f} s'.format(count, elapsed))
+
+        count, elapsed = measure(iter_reachable_object_ids)
+        print('bitmap index: {} objects in {:.3f} s'.format(count, elapsed))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
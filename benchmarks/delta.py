@@ -0,0 +1,83 @@
+"""Measure the throughput of fudge.delta.apply_delta on synthetic delta chains.
+
+Run with `python -m benchmarks.delta`.
+"""
+import os
+import random
+import time
+
+from fudge.delta import apply_delta, encode_copy, encode_size
+
+
+BASE_SIZE = 1024 * 1024
+CHAIN_LENGTH = 20
+ROUNDS = 3
+
+
+def make_delta(source, rng, max_copy):
+    """Build a delta copying `source` in hunks, replacing a few bytes between hunks."""
+    delta = bytearray()
+    result_length = 0
+    offset = 0
+
+    while offset < len(source):
+        length = min(rng.randint(max_copy // 2, max_copy), len(source) - offset)
+        delta += encode_copy(offset, length)
+        result_length += length
+
+        # Replace as many bytes as are inserted, so the chain keeps the same size.
+        insert = os.urandom(rng.randint(1, 16))
+        delta += bytes([len(insert)]) + insert
+        result_length += len(insert)
+
+        offset += length + len(insert)
+
+    return encode_size(len(source)) + encode_size(result_length) + bytes(delta)
+
+
+def make_chain(rng, max_copy):
+    base = os.urandom(BASE_SIZE)
+    deltas = []
+
+    source = base
+    for _ in range(CHAIN_LENGTH):
+        delta = make_delta(source, rng, max_copy)
+        deltas.append(delta)
+        source = apply_delta(source, delta)
+
+    return base, deltas
+
+
+def measure(base, deltas):
+    best = None
+    for _ in range(ROUNDS):
+        produced = 0
+        start = time.perf_counter()
+
+        contents = base
+        for delta in deltas:
+            contents = apply_delta(contents, delta)
+            produced += len(contents)
+
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return produced, best
+
+
+def main():
+    rng = random.Random(0)
+
+    print('apply_delta: chains of {} deltas over a {} KiB base'.format(
+        CHAIN_LENGTH, BASE_SIZE // 1024))
+
+    for max_copy in (0xffff, 1024, 64):
+        base, deltas = make_chain(rng, max_copy)
+        produced, elapsed = measure(base, deltas)
+
+        print('copy hunks of up to {:>5} bytes: {:8.1f} MB/s ({:.3f} s for {:.1f} MB)'.format(
+            max_copy, produced / elapsed / 1e6, elapsed, produced / 1e6))
+
+
+if __name__ == '__main__':
+    main()
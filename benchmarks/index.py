@@ -0,0 +1,68 @@
+"""Measure reading and writing a large index file.
+
+Run with `python -m benchmarks.index`.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from fudge.index import Index, IndexEntry, ObjectType, read_index, write_index
+from fudge.object import Object
+from fudge.repository import create_repository
+
+
+NUM_ENTRIES = 100000
+ROUNDS = 3
+
+
+def make_index():
+    """Build an index of files spread over a few levels of directories."""
+    index = Index()
+    for i in range(NUM_ENTRIES):
+        path = 'src/module{}/package{}/file{}.py'.format(i % 100, i // 100 % 10, i)
+        contents = 'file {}\n'.format(i)
+        object_id = Object('blob', len(contents), contents).id
+        index.add(IndexEntry(
+            ctime_s=1500000000 + i, ctime_n=i, mtime_s=1500000000 + i, mtime_n=i, dev=2049,
+            ino=i, object_type=ObjectType.REGULAR_FILE, perms='100644', uid=1000, gid=1000,
+            size=len(contents), object_id=object_id, path=path
+        ))
+    return index
+
+
+def measure(function):
+    """Return the best time of a few runs of `function`."""
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    path = tempfile.mkdtemp()
+    cwd = os.getcwd()
+
+    try:
+        os.chdir(path)
+        create_repository()
+
+        index = make_index()
+
+        elapsed = measure(lambda: write_index(index))
+        size = os.path.getsize(os.path.join('.fudge', 'index'))
+        print('index of {} entries, {} bytes'.format(NUM_ENTRIES, size))
+        print('write_index: {:6.3f} s'.format(elapsed))
+
+        elapsed = measure(read_index)
+        print('read_index:  {:6.3f} s'.format(elapsed))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Compare storing objects one at a time with fudge.object.ObjectWriter.
+
+Run with `python -m benchmarks.object_writer`.
+"""
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from fudge.object import Object, ObjectWriter, object_cache, store_object
+from fudge.repository import create_repository
+
+
+NUM_OBJECTS = 20000
+MIN_SIZE = 512
+MAX_SIZE = 8192
+
+
+def make_objects(rng):
+    """Build blobs of compressible text, like source files."""
+    words = [bytes('word{}'.format(i), 'utf-8') for i in range(1000)]
+    objects = []
+
+    for _ in range(NUM_OBJECTS):
+        size = rng.randint(MIN_SIZE, MAX_SIZE)
+        contents = bytearray()
+        while len(contents) < size:
+            contents += rng.choice(words) + b' '
+        objects.append(Object('blob', len(contents), bytes(contents)))
+
+    return objects
+
+
+def measure(store, objects):
+    """Store objects in a new repository. Return the elapsed time."""
+    path = tempfile.mkdtemp()
+    cwd = os.getcwd()
+
+    try:
+        os.chdir(path)
+        create_repository()
+        object_cache.clear()
+
+        start = time.perf_counter()
+        store(objects)
+        return time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(path)
+
+
+def store_objects(objects):
+    for obj in objects:
+        store_object(obj)
+
+
+def main():
+    objects = make_objects(random.Random(0))
+
+    print('storing {} blobs of {} to {} bytes'.format(NUM_OBJECTS, MIN_SIZE, MAX_SIZE))
+
+    elapsed = measure(store_objects, objects)
+    print('store_object loop:      {:8.0f} objects/s'.format(NUM_OBJECTS / elapsed))
+
+    for workers in sorted({1, os.cpu_count() or 1}):
+        elapsed = measure(lambda objects: ObjectWriter(workers).write(objects), objects)
+        print('ObjectWriter ({} thread{}): {:8.0f} objects/s'.format(
+            workers, 's' if workers > 1 else ' ', NUM_OBJECTS / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Measure the memory used by objects, tree nodes and authors, and the cost of object IDs.
+
+The objects come from parsing a pack of many small objects, as a clone does.
+Run with `python -m benchmarks.objects`.
+"""
+import binascii
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from fudge.commit import Author
+from fudge.object import Object
+from fudge.pack import PackWriter, parse_pack
+from fudge.packfile import ObjectType
+from fudge.tree import Node
+
+
+NUM_OBJECTS = 100000
+ID_ROUNDS = 3
+
+
+def make_objects(rng):
+    """Yield blobs, trees and commits of typical sizes."""
+    for i in range(NUM_OBJECTS):
+        if i % 3 == 0:
+            contents = bytes('line {}\n'.format(i), 'utf-8') * rng.randint(5, 30)
+            yield Object('blob', len(contents), contents)
+        elif i % 3 == 1:
+            contents = b''.join(
+                bytes('100644 file{}\0'.format(j), 'utf-8') + os.urandom(20)
+                for j in range(rng.randint(1, 10)))
+            yield Object('tree', len(contents), contents)
+        else:
+            contents = bytes(
+                'tree {}\nauthor A U Thor <author@example.com> {} +0000\n'
+                'committer A U Thor <author@example.com> {} +0000\n\nCommit {}\n'.format(
+                    str(binascii.hexlify(os.urandom(20)), 'utf-8'), i, i, i), 'utf-8')
+            yield Object('commit', len(contents), contents)
+
+
+def make_pack(path):
+    writer = PackWriter(path, NUM_OBJECTS)
+    for obj in make_objects(random.Random(0)):
+        writer.add(obj.id, ObjectType.from_name(obj.type), obj.contents)
+    writer.close()
+
+
+def measure_allocations(build):
+    """Return the number of bytes allocated per item by `build`, and the items."""
+    tracemalloc.start()
+    items = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / len(items), items
+
+
+def main():
+    with tempfile.TemporaryDirectory() as dirpath:
+        path = os.path.join(dirpath, 'objects.pack')
+        make_pack(path)
+
+        with open(path, 'rb') as f:
+            per_object, objects = measure_allocations(lambda: list(parse_pack(f)))
+
+    contents_size = sum(len(obj.contents) for obj in objects) / len(objects)
+    print('{} objects parsed from a pack'.format(len(objects)))
+    print('Object: {:6.0f} bytes each, {:6.0f} bytes besides contents'.format(
+        per_object, per_object - contents_size))
+
+    start = time.perf_counter()
+    for _ in range(ID_ROUNDS):
+        for obj in objects:
+            obj.id
+    elapsed = time.perf_counter() - start
+    print('Object.id: {:6.2f} us per access'.format(elapsed / ID_ROUNDS / len(objects) * 1e6))
+
+    names = ['file{}'.format(i) for i in range(NUM_OBJECTS)]
+    per_node, _ = measure_allocations(
+        lambda: [Node(name, '100644', objects[0].id) for name in names])
+    print('Node:   {:6.0f} bytes each'.format(per_node))
+
+    per_author, _ = measure_allocations(
+        lambda: [Author('A U Thor', 'author@example.com', '1500000000', '+0000')
+                 for _ in range(NUM_OBJECTS)])
+    print('Author: {:6.0f} bytes each'.format(per_author))
+
+
+if __name__ == '__main__':
+    main()
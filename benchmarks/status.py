@@ -0,0 +1,61 @@
+"""Compare the working tree status of a clean tree with one where every file was touched.
+
+Run with `python -m benchmarks.status`.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from fudge.index import add_files_to_index
+from fudge.repository import create_repository
+from fudge.working import compute_changed_and_untracked, walk_working_tree
+
+
+NUM_FILES = 20000
+
+
+def write_files():
+    """Write files spread over a few directories, last modified in the past."""
+    mtime = time.time() - 100
+    for i in range(NUM_FILES):
+        dirpath = os.path.join('src', 'module{}'.format(i % 100))
+        os.makedirs(dirpath, exist_ok=True)
+
+        path = os.path.join(dirpath, 'file{}.py'.format(i))
+        with open(path, 'w') as f:
+            f.write('file {}\n'.format(i) * 100)
+        os.utime(path, (mtime, mtime))
+
+
+def measure():
+    start = time.perf_counter()
+    changed, untracked = compute_changed_and_untracked()
+    assert not changed and not untracked
+    return time.perf_counter() - start
+
+
+def main():
+    path = tempfile.mkdtemp()
+    cwd = os.getcwd()
+
+    try:
+        os.chdir(path)
+        create_repository()
+        write_files()
+        add_files_to_index(list(walk_working_tree()))
+
+        print('clean tree:    {} files in {:.2f} s'.format(NUM_FILES, measure()))
+
+        # Every file is hashed, then its stat data is refreshed in the index.
+        for filepath in walk_working_tree():
+            os.utime(filepath, None)
+        print('touched files: {} files in {:.2f} s'.format(NUM_FILES, measure()))
+        print('refreshed:     {} files in {:.2f} s'.format(NUM_FILES, measure()))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Compare writing all the trees of a large index with writing them after a one-file change.
+
+Run with `python -m benchmarks.write_tree`.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.index import NUM_ENTRIES, make_index
+from fudge.index import read_index, write_index
+from fudge.repository import create_repository
+from fudge.tree import write_tree
+
+
+def measure():
+    start = time.perf_counter()
+    write_tree()
+    return time.perf_counter() - start
+
+
+def main():
+    path = tempfile.mkdtemp()
+    cwd = os.getcwd()
+
+    try:
+        os.chdir(path)
+        create_repository()
+        write_index(make_index())
+
+        print('all trees:        {} entries in {:.2f} s'.format(NUM_ENTRIES, measure()))
+
+        # Only the trees of the directories of the changed file are written.
+        index = read_index()
+        entry = next(iter(index))
+        index.add(entry._replace(object_id='0' * 40))
+        write_index(index)
+
+        print('one file changed: {} entries in {:.2f} s'.format(NUM_ENTRIES, measure()))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
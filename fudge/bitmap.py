@@ -0,0 +1,251 @@
+import binascii
+import os
+import struct
+
+from fudge.packfile import get_packs, map_file
+from fudge.utils import FudgeException
+
+
+BITMAP_MAGIC = b'BITM'
+BITMAP_HEADER_SIZE = 32
+
+# Bitmaps cover every object reachable from their commit, as Git requires.
+BITMAP_OPT_FULL_DAG = 0x1
+
+EWAH_WORD_BITS = 64
+EWAH_MAX_RUNNING_LENGTH = (1 << 32) - 1
+EWAH_MAX_LITERAL_WORDS = (1 << 31) - 1
+EWAH_ALL_ONES = (1 << 64) - 1
+
+TYPE_ORDER = ['commit', 'tree', 'blob', 'tag']
+
+
+class Bitmap(object):
+    """An uncompressed set of object positions."""
+
+    def __init__(self, data=b''):
+        self.data = bytearray(data)
+
+    def __contains__(self, position):
+        index = position >> 3
+        return index < len(self.data) and bool(self.data[index] >> (position & 7) & 1)
+
+    def __iter__(self):
+        for index, byte in enumerate(self.data):
+            if byte:
+                for bit in range(8):
+                    if byte >> bit & 1:
+                        yield index * 8 + bit
+
+    def __len__(self):
+        return bin(self.to_int()).count('1')
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __and__(self, other):
+        size = min(len(self.data), len(other.data))
+        return Bitmap((self.to_int() & other.to_int()).to_bytes(size, 'little'))
+
+    def __xor__(self, other):
+        size = max(len(self.data), len(other.data))
+        return Bitmap((self.to_int() ^ other.to_int()).to_bytes(size, 'little'))
+
+    def to_int(self):
+        return int.from_bytes(bytes(self.data), 'little')
+
+    def update(self, other):
+        """Add the positions of another bitmap."""
+        size = max(len(self.data), len(other.data))
+        self.data = bytearray((self.to_int() | other.to_int()).to_bytes(size, 'little'))
+
+    def add(self, position):
+        index = position >> 3
+        if index >= len(self.data):
+            self.data.extend(bytes(index + 1 - len(self.data)))
+        self.data[index] |= 1 << (position & 7)
+
+
+def encode_ewah(bitmap):
+    """Compress a bitmap with EWAH, in Git's serialization format.
+
+    Runs of empty or full 64-bit words are stored as a count in a marker
+    word, which also counts the literal words following it.
+    """
+    data = bytes(bitmap.data).rstrip(b'\0')
+    data += bytes(-len(data) % 8)
+    words = struct.unpack('<{}Q'.format(len(data) // 8), data)
+
+    # Bits past the last set bit are not part of the bitmap.
+    bit_size = len(data) * 8
+    if words:
+        bit_size -= EWAH_WORD_BITS - words[-1].bit_length()
+
+    buffer = []
+    marker = 0
+    i = 0
+    while i < len(words) or not buffer:
+        marker = len(buffer)
+        buffer.append(0)
+
+        running_bit, running_length = 0, 0
+        if i < len(words) and words[i] in (0, EWAH_ALL_ONES):
+            fill = words[i]
+            running_bit = 1 if fill else 0
+            while i < len(words) and words[i] == fill and running_length < EWAH_MAX_RUNNING_LENGTH:
+                running_length += 1
+                i += 1
+
+        start = i
+        while (i < len(words) and words[i] not in (0, EWAH_ALL_ONES) and
+               i - start < EWAH_MAX_LITERAL_WORDS):
+            i += 1
+
+        buffer[marker] = running_bit | (running_length << 1) | ((i - start) << 33)
+        buffer.extend(words[start:i])
+
+    return (struct.pack('!II', bit_size, len(buffer)) +
+            struct.pack('!{}Q'.format(len(buffer)), *buffer) +
+            struct.pack('!I', marker))
+
+
+def decode_ewah(data, offset):
+    """Decompress an EWAH bitmap found at `offset`.
+
+    Return the bitmap and the offset following it.
+    """
+    bit_size, num_words = struct.unpack_from('!II', data, offset)
+    offset += 8
+    buffer = struct.unpack_from('!{}Q'.format(num_words), data, offset)
+    offset += 8 * num_words + 4
+
+    words = []
+    i = 0
+    while i < len(buffer):
+        marker = buffer[i]
+        running_length = (marker >> 1) & EWAH_MAX_RUNNING_LENGTH
+        num_literals = marker >> 33
+
+        words.extend([EWAH_ALL_ONES if marker & 1 else 0] * running_length)
+        words.extend(buffer[i+1:i+1+num_literals])
+        i += 1 + num_literals
+
+    bitmap = Bitmap(struct.pack('<{}Q'.format(len(words)), *words)[:(bit_size + 7) // 8])
+    return bitmap, offset
+
+
+def skip_ewah(data, offset):
+    """Return the offset following the EWAH bitmap found at `offset`, without decoding it."""
+    _, num_words = struct.unpack_from('!II', data, offset)
+    return offset + 8 + 8 * num_words + 4
+
+
+def get_bitmap_path(pack):
+    return os.path.splitext(pack.path)[0] + '.bitmap'
+
+
+class PackBitmapIndex(object):
+    """A version 1 bitmap index (`.bitmap`) file.
+
+    It holds the bitmaps of the objects reachable from some commits of a
+    pack, and a bitmap of the objects of each type. Bit positions follow
+    the order of objects in the pack.
+    """
+
+    def __init__(self, pack):
+        self.pack = pack
+        self.path = get_bitmap_path(pack)
+        self.data = map_file(self.path)
+
+        if self.data[:4] != BITMAP_MAGIC:
+            raise FudgeException('invalid bitmap index file magic')
+
+        version, flags, num_entries = struct.unpack_from('!HHI', self.data, 4)
+        if version != 1:
+            raise FudgeException('unsupported bitmap index file version: {}'.format(version))
+        if not flags & BITMAP_OPT_FULL_DAG:
+            raise FudgeException('unsupported bitmap index file options')
+
+        checksum = str(binascii.hexlify(self.data[12:32]), 'utf-8')
+        if checksum != pack.checksum:
+            raise FudgeException('bitmap index file and pack file do not match')
+
+        offset = BITMAP_HEADER_SIZE
+        self.types = {}
+        for object_type in TYPE_ORDER:
+            self.types[object_type], offset = decode_ewah(self.data, offset)
+
+        # Bitmaps are decoded on demand. Each one may be XORed with a previous one.
+        self.entries = []
+        self.offsets = {}
+        for i in range(num_entries):
+            index_position, xor_offset, _ = struct.unpack_from('!IBB', self.data, offset)
+            commit_id = pack.index.get_id(index_position)
+            self.entries.append((offset + 6, i - xor_offset if xor_offset else None))
+            self.offsets[commit_id] = i
+            offset = skip_ewah(self.data, offset + 6)
+
+        self._pack_order = None
+        self._positions = None
+
+    def __contains__(self, commit_id):
+        return commit_id in self.offsets
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load_order(self):
+        if self._pack_order is None:
+            index = self.pack.index
+            self._pack_order = sorted(range(len(index)), key=index.get_offset)
+            self._positions = [0] * len(index)
+            for position, index_position in enumerate(self._pack_order):
+                self._positions[index_position] = position
+
+    def find_position(self, object_id):
+        """Return the bitmap position of an object, or None if it is not in the pack."""
+        index_position = self.pack.index.find(object_id)
+        if index_position is None:
+            return None
+
+        self.load_order()
+        return self._positions[index_position]
+
+    def get_id(self, position):
+        self.load_order()
+        return self.pack.index.get_id(self._pack_order[position])
+
+    def get_entry(self, i):
+        offset, base = self.entries[i]
+        bitmap, _ = decode_ewah(self.data, offset)
+        if base is not None:
+            bitmap = bitmap ^ self.get_entry(base)
+        return bitmap
+
+    def get(self, commit_id):
+        """Return the bitmap of the objects reachable from a commit, or None."""
+        i = self.offsets.get(commit_id)
+        if i is None:
+            return None
+        return self.get_entry(i)
+
+
+# Opened bitmap indexes, keyed by pack file path.
+_bitmap_indexes = {}
+
+
+def get_bitmap_index():
+    """Return the bitmap index of the first pack that has one, or None."""
+    for pack in get_packs():
+        if pack.path in _bitmap_indexes:
+            bitmap_index = _bitmap_indexes[pack.path]
+            if bitmap_index.pack is pack:
+                return bitmap_index
+
+        if os.path.exists(get_bitmap_path(pack)):
+            bitmap_index = PackBitmapIndex(pack)
+            _bitmap_indexes[pack.path] = bitmap_index
+            return bitmap_index
+
+    return None
@@ -2,9 +2,11 @@ import argparse
 import sys
 
 from fudge.commands import (cmd_add, cmd_cat_file, cmd_checkout_index, cmd_clone, cmd_commit,
-                            cmd_commit_tree, cmd_hash_object, cmd_init, cmd_ls_files, cmd_ls_tree,
-                            cmd_log, cmd_read_tree, cmd_rm, cmd_status, cmd_symbolic_ref,
-                            cmd_update_index, cmd_update_ref, cmd_write_tree)
+                            cmd_commit_tree, cmd_gc, cmd_hash_object, cmd_init, cmd_ls_files,
+                            cmd_ls_tree, cmd_log, cmd_multi_pack_index, cmd_pack_objects,
+                            cmd_read_tree, cmd_repack, cmd_rm, cmd_status, cmd_symbolic_ref,
+                            cmd_unpack_objects, cmd_update_index, cmd_update_ref, cmd_write_tree)
+from fudge.packobjects import DEFAULT_DEPTH, DEFAULT_WINDOW
 
 
 def cli():
@@ -14,7 +16,15 @@ def cli():
 
     add_subparser = subparsers.add_parser(
         'add', help='Add file contents to the index')
-    add_subparser.add_argument('path')
+    add_subparser.add_argument(
+        '--stdin', action='store_true', help='Read the list of paths from the standard input')
+    add_subparser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        help='The number of threads used to hash files (defaults to the number of CPUs)'
+    )
+    add_subparser.add_argument('paths', nargs='*', metavar='path')
 
     cat_file_subparser = subparsers.add_parser(
         'cat-file', help='Provide content, type or size information for repository objects')
@@ -26,6 +36,17 @@ def cli():
 
     clone_subparser = subparsers.add_parser(
         'clone', help='Clone a repository into a new directory')
+    clone_subparser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        help='The number of processes used to resolve deltas (defaults to the number of CPUs)'
+    )
+    clone_subparser.add_argument(
+        '--reference',
+        metavar='repository',
+        help='Borrow objects from a local repository instead of downloading them again'
+    )
     clone_subparser.add_argument('repository')
     clone_subparser.add_argument('path', nargs='?')
 
@@ -44,6 +65,11 @@ def cli():
         '-m', metavar='message', nargs='?', help='The commit log message')
     commit_tree_subparser.add_argument('tree')
 
+    gc_subparser = subparsers.add_parser(
+        'gc', help='Pack loose objects and remove them once they are packed')
+    gc_subparser.add_argument(
+        '--auto', action='store_true', help='Only run if there are too many loose objects')
+
     hash_object_subparser = subparsers.add_parser(
         'hash-object', help='Compute an object ID and optionally creates a blob from a file')
     hash_object_subparser.add_argument(
@@ -76,13 +102,55 @@ def cli():
     log_subparser = subparsers.add_parser('log', help='Show commit logs')
     log_subparser.add_argument('--oneline', action='store_true')
 
+    multi_pack_index_subparser = subparsers.add_parser(
+        'multi-pack-index', help='Write and verify a multi-pack-index')
+    multi_pack_index_subparser.add_argument('action', choices=['write', 'verify'])
+
+    pack_objects_subparser = subparsers.add_parser(
+        'pack-objects',
+        help='Create a packed archive of objects read from the standard input'
+    )
+    pack_objects_subparser.add_argument(
+        '--window',
+        type=int,
+        default=DEFAULT_WINDOW,
+        help='The number of objects to consider as delta bases'
+    )
+    pack_objects_subparser.add_argument(
+        '--depth', type=int, default=DEFAULT_DEPTH, help='The maximum delta chain length')
+    pack_objects_subparser.add_argument(
+        '--revs',
+        action='store_true',
+        help='Pack the objects reachable from the commits read from the standard input'
+    )
+    pack_objects_subparser.add_argument('base_name')
+
     read_tree_subparser = subparsers.add_parser(
         'read-tree', help='Read tree information into the index')
     read_tree_subparser.add_argument('tree')
 
+    repack_subparser = subparsers.add_parser(
+        'repack', help='Pack all objects of the repository into a single pack')
+    repack_subparser.add_argument(
+        '-d', action='store_true', help='Remove the packs that existed before')
+    repack_subparser.add_argument(
+        '-b',
+        '--write-bitmap-index',
+        action='store_true',
+        help='Write a bitmap index for the new pack'
+    )
+    repack_subparser.add_argument(
+        '--window',
+        type=int,
+        default=DEFAULT_WINDOW,
+        help='The number of objects to consider as delta bases'
+    )
+    repack_subparser.add_argument(
+        '--depth', type=int, default=DEFAULT_DEPTH, help='The maximum delta chain length')
+
     rm_subparser = subparsers.add_parser(
         'rm', help='Remove a file from the index')
-    rm_subparser.add_argument('path')
+    rm_subparser.add_argument('paths', nargs='+', metavar='path')
 
     subparsers.add_parser(
         'status', help='Show the working tree status')
@@ -93,18 +161,35 @@ def cli():
     symbolic_ref_subparser.add_argument(
         '--short', action='store_true', help='Shorten the ref output')
 
+    unpack_objects_subparser = subparsers.add_parser(
+        'unpack-objects', help='Unpack objects from a packed archive read from the standard input')
+    unpack_objects_subparser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        help='The number of threads used to write objects (defaults to the number of CPUs)'
+    )
+
     update_index_subparser = subparsers.add_parser(
         'update-index', help='Register file contents in the working tree to the index')
     update_index_subparser.add_argument(
-        '--add', action='store_true', help='Add the specified file to the index')
+        '--add', action='store_true', help='Add the specified files to the index')
     update_index_subparser.add_argument(
-        '--remove', action='store_true', help='Remove the specified file from the index')
+        '--remove', action='store_true', help='Remove the specified files from the index')
     update_index_subparser.add_argument(
         '--cacheinfo',
         metavar='<mode>,<object>,<path>',
         help='Directly insert the specified info into the index'
     )
-    update_index_subparser.add_argument('file', nargs='?')
+    update_index_subparser.add_argument(
+        '--stdin', action='store_true', help='Read the list of paths from the standard input')
+    update_index_subparser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        help='The number of threads used to hash files (defaults to the number of CPUs)'
+    )
+    update_index_subparser.add_argument('files', nargs='*', metavar='file')
 
     update_ref_subparser = subparsers.add_parser(
         'update-ref', help='Update the object name stored in a ref safely')
@@ -119,17 +204,19 @@ def cli():
         sys.exit(1)
 
     if args.command == 'add':
-        cmd_add(args.path)
+        cmd_add(args.paths, args.stdin, args.jobs)
     elif args.command == 'cat-file':
         cmd_cat_file(args.object, args.t, args.s, args.p)
     elif args.command == 'checkout-index':
         cmd_checkout_index()
     elif args.command == 'clone':
-        cmd_clone(args.repository, args.path)
+        cmd_clone(args.repository, args.path, args.jobs, args.reference)
     elif args.command == 'commit':
         cmd_commit(args.m)
     elif args.command == 'commit-tree':
         cmd_commit_tree(args.tree, args.p, args.m)
+    elif args.command == 'gc':
+        cmd_gc(args.auto)
     elif args.command == 'hash-object':
         cmd_hash_object(args.file, args.stdin, args.w)
     elif args.command == 'init':
@@ -140,16 +227,25 @@ def cli():
         cmd_ls_tree(args.tree, args.r)
     elif args.command == 'log':
         cmd_log(args.oneline)
+    elif args.command == 'multi-pack-index':
+        cmd_multi_pack_index(args.action)
+    elif args.command == 'pack-objects':
+        cmd_pack_objects(args.base_name, args.window, args.depth, args.revs)
     elif args.command == 'read-tree':
         cmd_read_tree(args.tree)
+    elif args.command == 'repack':
+        cmd_repack(args.d, args.window, args.depth, args.write_bitmap_index)
     elif args.command == 'rm':
-        cmd_rm(args.path)
+        cmd_rm(args.paths)
     elif args.command == 'status':
         cmd_status()
     elif args.command == 'symbolic-ref':
         cmd_symbolic_ref(args.ref, args.short)
+    elif args.command == 'unpack-objects':
+        cmd_unpack_objects(args.jobs)
     elif args.command == 'update-index':
-        cmd_update_index(args.file, args.add, args.remove, args.cacheinfo)
+        cmd_update_index(args.files, args.add, args.remove, args.cacheinfo, args.stdin,
+                         args.jobs)
     elif args.command == 'update-ref':
         cmd_update_ref(args.ref, args.object)
     elif args.command == 'write-tree':
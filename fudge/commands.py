@@ -2,43 +2,49 @@ import os
 import sys
 
 from fudge.commit import build_commit, iter_commits, read_commit, write_commit
-from fudge.index import (add_file_to_index, add_object_to_index, checkout_index, read_index,
-                         remove_from_index)
-from fudge.object import Object, load_object, store_object
-from fudge.pack import parse_pack
+from fudge.gc import auto_gc, gc
+from fudge.index import (add_files_to_index, add_object_to_index, checkout_index,
+                         get_index_entry_path, read_index, remove_files_from_index)
+from fudge.multipackindex import verify_multi_pack_index, write_multi_pack_index
+from fudge.object import (Object, ObjectWriter, abbreviate_object_id, hash_file,
+                          iter_object_contents, object_info, store_object)
+from fudge.pack import parse_pack, store_pack
+from fudge.packobjects import pack_objects, repack
 from fudge.protocol import get_repository_name, upload_pack
-from fudge.refs import write_ref, read_symbolic_ref, write_symbolic_ref
-from fudge.repository import create_repository
+from fudge.refs import iter_refs, write_ref, read_symbolic_ref, write_symbolic_ref
+from fudge.repository import add_alternate, create_repository, find_repository_path
+from fudge.revlist import iter_reachable_object_ids
 from fudge.tree import build_tree_from_object, print_tree, read_tree, write_tree
-from fudge.utils import read_file
-from fudge.working import compute_staged, status
+from fudge.utils import FudgeException
+from fudge.working import compute_staged, expand_paths, status
 
 
-def cmd_add(path=None):
-    cmd_update_index(path=path, add=True)
+def cmd_add(paths=(), stdin=False, jobs=None):
+    """Add file contents to the index."""
+    cmd_update_index(paths, add=True, stdin=stdin, jobs=jobs)
 
 
 def cmd_cat_file(object_id, show_type=False, show_size=False, show_contents=False):
     """Provide content, type or size information for repository objects."""
-    obj = load_object(object_id)
-
     if show_type:
-        print(obj.type)
+        print(object_info(object_id).type)
     elif show_size:
-        print(obj.size)
+        print(object_info(object_id).size)
     elif show_contents:
-        if obj.type == 'tree':
+        if object_info(object_id).type == 'tree':
             cmd_ls_tree(object_id)
         else:
-            contents = str(obj.contents, 'utf-8')
-            print(contents, end='')
+            sys.stdout.flush()
+            for chunk in iter_object_contents(object_id):
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
 
 
 def cmd_checkout_index():
     checkout_index()
 
 
-def cmd_clone(repo_url, repo_name=None):
+def cmd_clone(repo_url, repo_name=None, jobs=None, reference=None):
     if not repo_name:
         repo_name = get_repository_name(repo_url)
 
@@ -46,20 +52,27 @@ def cmd_clone(repo_url, repo_name=None):
         print("destination path '{}' already exists".format(repo_name))
         sys.exit(1)
 
+    if reference:
+        reference_path = find_repository_path(os.path.abspath(reference))
+        if not reference_path:
+            print("reference repository '{}' not found".format(reference))
+            sys.exit(1)
+
     print("Cloning into '{}'".format(repo_name))
     create_repository(repo_name)
     os.chdir(repo_name)
 
-    print('Discovering refs and downloading a pack file')
-    pack, head_object_id = upload_pack(repo_url)
-
-    print('Parsing the pack file')
-    objects = parse_pack(pack)
+    haves = []
+    if reference:
+        # Objects of the reference repository are borrowed instead of downloaded.
+        add_alternate(os.path.join(reference_path, 'objects'))
+        haves = sorted(set(object_id for _, object_id in iter_refs(reference_path)))
 
-    for i, obj in enumerate(objects):
-        print('\rWriting objects to disk ({}/{})'.format(i+1, len(objects)), end='')
-        store_object(obj)
-    print()
+    print('Discovering refs and downloading a pack file')
+    with upload_pack(repo_url, haves) as (pack, head_object_id):
+        print('Indexing the pack file')
+        path, num_objects = store_pack(pack, workers=jobs or os.cpu_count() or 1)
+    print('Stored {} objects in {}'.format(num_objects, os.path.basename(path)))
 
     print('Setting HEAD to {:.7}'.format(head_object_id))
     write_ref('HEAD', head_object_id)
@@ -84,7 +97,10 @@ def cmd_commit(message=None):
     ref = read_symbolic_ref(short=True)
 
     short_message = message.split('\n', 1)[0]
-    print('[{} {:.7}] {}'.format(ref, commit_id, short_message))
+    print('[{} {}] {}'.format(ref, abbreviate_object_id(commit_id), short_message))
+
+    if auto_gc():
+        print('Auto packing the repository for optimum performance')
 
 
 def cmd_commit_tree(tree, parent=None, message=None):
@@ -98,15 +114,32 @@ def cmd_commit_tree(tree, parent=None, message=None):
     print(commit.id)
 
 
+def cmd_gc(auto=False):
+    """Pack loose objects and remove them once they are packed."""
+    if auto:
+        if auto_gc():
+            print('Auto packing the repository for optimum performance')
+        return
+
+    path, num_objects, num_pruned = gc()
+    if not path:
+        print('Nothing to pack')
+        return
+
+    print('Packed {} objects into {}'.format(num_objects, os.path.basename(path)))
+    print('Removed {} loose objects'.format(num_pruned))
+
+
 def cmd_hash_object(path=None, stdin=False, write=False):
     """Compute an object ID and optionally creates a blob from a file."""
     if path:
-        data = read_file(path, mode='r')
-    elif stdin:
-        data = sys.stdin.read()
-    else:
+        print(hash_file(path, write=write))
+        return
+
+    if not stdin:
         sys.exit(0)
 
+    data = sys.stdin.read()
     obj = Object('blob', len(data), data)
     print(obj.id)
 
@@ -144,7 +177,7 @@ def cmd_log(oneline):
     for commit in iter_commits():
         if oneline:
             short_message = commit.message.split('\n')[0]
-            print('{:.7} {}'.format(commit.id, short_message))
+            print('{} {}'.format(abbreviate_object_id(commit.id), short_message))
         else:
             print('commit {}'.format(commit.id))
             print('Author: {} <{}>'.format(commit.author.name, commit.author.email))
@@ -152,14 +185,64 @@ def cmd_log(oneline):
             print('{}\n'.format(commit.message))
 
 
+def cmd_multi_pack_index(action):
+    """Write or verify the multi-pack-index of the repository."""
+    if action == 'write':
+        path, num_objects = write_multi_pack_index()
+        if not path:
+            print('No packs to index')
+            return
+
+        print('Indexed {} objects in {}'.format(num_objects, os.path.basename(path)))
+    elif action == 'verify':
+        num_objects = verify_multi_pack_index()
+        print('Verified {} objects'.format(num_objects))
+
+
+def cmd_pack_objects(base_name, window, depth, revs=False):
+    """Create a packed archive of objects read from the standard input.
+
+    With `revs`, the standard input lists commits, and every object
+    reachable from them is packed.
+    """
+    objects = []
+    for line in sys.stdin:
+        parts = line.rstrip('\n').split(' ', 1)
+        if not parts[0]:
+            continue
+
+        name = parts[1] if len(parts) > 1 else ''
+        objects.append((parts[0], name))
+
+    if revs:
+        commit_ids = [object_id for object_id, _ in objects]
+        objects = [(object_id, '') for object_id in iter_reachable_object_ids(commit_ids)]
+
+    path, _ = pack_objects(objects, base_name, window, depth)
+
+    checksum = os.path.splitext(path)[0].rsplit('-', 1)[1]
+    print(checksum)
+
+
 def cmd_read_tree(tree):
     read_tree(tree)
 
 
-def cmd_rm(path):
-    """Remove a file from the index."""
-    cmd_update_index(path, remove=True)
-    print("rm '{}'".format(path))
+def cmd_repack(delete, window, depth, write_bitmap=False):
+    """Pack all objects of the repository into a single pack."""
+    path, num_objects = repack(window, depth, delete, write_bitmap or None)
+    if not path:
+        print('Nothing to pack')
+        return
+
+    print('Packed {} objects into {}'.format(num_objects, os.path.basename(path)))
+
+
+def cmd_rm(paths):
+    """Remove files from the index."""
+    cmd_update_index(paths, remove=True)
+    for path in paths:
+        print("rm '{}'".format(path))
 
 
 def cmd_status():
@@ -200,13 +283,29 @@ def cmd_symbolic_ref(ref=None, short=False):
         print(ref)
 
 
-def cmd_update_index(path=None, add=False, remove=False, cacheinfo=None):
+def cmd_unpack_objects(jobs=None):
+    """Unpack the objects of a pack file read from the standard input into loose objects."""
+    objects = parse_pack(sys.stdin.buffer)
+    ids = ObjectWriter(jobs).write(objects)
+    print('Unpacked {} objects'.format(len(ids)))
+
+
+def cmd_update_index(paths=(), add=False, remove=False, cacheinfo=None, stdin=False, jobs=None):
     """Register file contents in the working tree to the index."""
-    if path:
+    paths = list(paths)
+    if stdin:
+        # One path per line, as printed by `find` or `ls-files`.
+        paths.extend(line.rstrip('\n') for line in sys.stdin if line.rstrip('\n'))
+
+    if paths:
+        # The index is read and written once, whatever the number of paths.
         if add:
-            add_file_to_index(path)
+            files = expand_paths(paths)
+            if not files and not stdin:
+                raise FudgeException('nothing specified, nothing added')
+            add_files_to_index(files, jobs)
         elif remove:
-            remove_from_index(path)
+            remove_files_from_index([get_index_entry_path(path) for path in paths])
     elif cacheinfo:
         info = cacheinfo.split(',')
         if len(info) != 3:
@@ -223,6 +322,9 @@ def cmd_update_index(path=None, add=False, remove=False, cacheinfo=None):
             sys.exit(1)
 
         add_object_to_index(mode, object_id, path)
+    elif add and not stdin:
+        # Like in Git, an empty list of paths read from the standard input is not an error.
+        raise FudgeException('nothing specified, nothing added')
 
 
 def cmd_update_ref(ref, object_id):
@@ -3,7 +3,7 @@ import time
 from collections import namedtuple
 
 from fudge.config import get_config_value
-from fudge.object import Object, load_object, store_object
+from fudge.object import Object, load_object, object_info, store_object
 from fudge.tree import write_tree
 from fudge.refs import read_ref, read_symbolic_ref, write_ref
 from fudge.utils import FudgeException
@@ -13,6 +13,8 @@ Commit = namedtuple('Commit', ['id', 'tree', 'parents', 'author', 'committer', '
 
 
 class Author(object):
+    __slots__ = ('name', 'email', 'timestamp', 'offset')
+
     def __init__(self, name, email, timestamp, offset):
         self.name = name
         self.email = email
@@ -32,18 +34,18 @@ class Author(object):
 
 
 def build_commit(tree, parents, message):
-    obj = load_object(tree)
-    if obj.type != 'tree':
+    info = object_info(tree)
+    if info.type != 'tree':
         raise FudgeException('the specified object is not a tree')
 
-    contents = 'tree {}\n'.format(obj.id)
+    contents = 'tree {}\n'.format(info.id)
 
     for parent in parents:
-        obj = load_object(parent)
-        if obj.type != 'commit':
+        info = object_info(parent)
+        if info.type != 'commit':
             raise FudgeException('one of the specified parents is not a commit')
 
-        contents += 'parent {}\n'.format(obj.id)
+        contents += 'parent {}\n'.format(info.id)
 
     name = get_config_value('user', 'name')
     email = get_config_value('user', 'email')
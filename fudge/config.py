@@ -20,7 +20,22 @@ def get_config_value(section, option, *, path=None):
     config.read(path)
 
     value = config.get(section, option, fallback=None)
-    if not issafe(value):
+    if value is not None and not issafe(value):
         raise FudgeException('invalid value')
 
     return value
+
+
+def parse_size(value):
+    """Parse a size with an optional `k`, `m` or `g` unit suffix, like Git."""
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+    value = value.strip().lower()
+    multiplier = units.get(value[-1:], 1)
+    if multiplier != 1:
+        value = value[:-1]
+
+    if not value.isdigit():
+        raise FudgeException('invalid size: {}'.format(value))
+
+    return int(value) * multiplier
@@ -0,0 +1,225 @@
+from fudge.utils import FudgeException
+
+
+# Length of the blocks of the source object indexed to find matches.
+BLOCK_SIZE = 16
+
+MAX_COPY_SIZE = 0x10000
+MAX_INSERT_SIZE = 0x7f
+
+# Number of argument bytes following a copy opcode, from the bits it sets.
+COPY_ARGUMENT_COUNTS = [bin(bits).count('1') for bits in range(0x80)]
+
+# Length of the chunks compared at once when extending a match.
+MATCH_CHUNK_SIZE = 64
+
+
+def encode_size(size):
+    """Encode a size as a little endian base 128 number."""
+    data = bytearray()
+    while True:
+        byte = size & 0x7f
+        size >>= 7
+        if not size:
+            data.append(byte)
+            return bytes(data)
+        data.append(byte | 0x80)
+
+
+def decode_size(data, offset):
+    """Decode a size encoded as a little endian base 128 number.
+
+    Return the size and the offset right after it.
+    """
+    size = 0
+    shift = 0
+
+    while True:
+        if offset >= len(data):
+            raise FudgeException('truncated delta')
+
+        byte = data[offset]
+        offset += 1
+        size |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return size, offset
+        shift += 7
+
+
+def apply_delta(source, delta):
+    """Apply delta hunks to the contents of a base object.
+
+    Hunks are collected as memoryview slices of the source and the delta,
+    then joined into the resulting bytes, so that data is copied only once.
+    """
+    base_length, offset = decode_size(delta, 0)
+    result_length, offset = decode_size(delta, offset)
+
+    if len(source) != base_length:
+        raise FudgeException('invalid base object length')
+
+    source = memoryview(source)
+    delta_view = memoryview(delta)
+    pieces = []
+    append = pieces.append
+    position = 0
+    end = len(delta)
+
+    while offset < end:
+        opcode = delta[offset]
+        offset += 1
+
+        if opcode & 0x80:
+            if offset + COPY_ARGUMENT_COUNTS[opcode & 0x7f] > end:
+                raise FudgeException('truncated delta')
+
+            copy_offset = 0
+            if opcode & 0x01:
+                copy_offset = delta[offset]
+                offset += 1
+            if opcode & 0x02:
+                copy_offset |= delta[offset] << 8
+                offset += 1
+            if opcode & 0x04:
+                copy_offset |= delta[offset] << 16
+                offset += 1
+            if opcode & 0x08:
+                copy_offset |= delta[offset] << 24
+                offset += 1
+
+            copy_length = 0
+            if opcode & 0x10:
+                copy_length = delta[offset]
+                offset += 1
+            if opcode & 0x20:
+                copy_length |= delta[offset] << 8
+                offset += 1
+            if opcode & 0x40:
+                copy_length |= delta[offset] << 16
+                offset += 1
+
+            if not copy_length:
+                copy_length = 0x10000
+
+            if copy_offset + copy_length > base_length:
+                raise FudgeException('delta copies data past the end of the base object')
+
+            next_position = position + copy_length
+            if next_position > result_length:
+                raise FudgeException('invalid result object length')
+
+            append(source[copy_offset:copy_offset+copy_length])
+            position = next_position
+        elif opcode:
+            next_position = position + opcode
+            if offset + opcode > end or next_position > result_length:
+                raise FudgeException('invalid delta insert hunk')
+
+            append(delta_view[offset:offset+opcode])
+            offset += opcode
+            position = next_position
+        else:
+            raise FudgeException('invalid delta opcode')
+
+    if position != result_length:
+        raise FudgeException('invalid result object length')
+
+    return b''.join(pieces)
+
+
+def encode_copy(offset, length):
+    """Encode a copy hunk, omitting the zero bytes of its offset and length."""
+    opcode = 0x80
+    args = bytearray()
+
+    for i in range(4):
+        byte = (offset >> (i * 8)) & 0xff
+        if byte:
+            opcode |= 1 << i
+            args.append(byte)
+
+    # A length of 0x10000 is encoded as zero.
+    for i in range(3):
+        byte = (length >> (i * 8)) & 0xff
+        if byte and length != MAX_COPY_SIZE:
+            opcode |= 1 << (4 + i)
+            args.append(byte)
+
+    return bytes([opcode]) + bytes(args)
+
+
+def encode_insert(data):
+    """Encode insert hunks, splitting data that does not fit in a single hunk."""
+    hunks = bytearray()
+    for offset in range(0, len(data), MAX_INSERT_SIZE):
+        chunk = data[offset:offset+MAX_INSERT_SIZE]
+        hunks.append(len(chunk))
+        hunks += chunk
+    return bytes(hunks)
+
+
+def match_length(source, source_offset, target, target_offset):
+    """Return the length of the common prefix of source[source_offset:] and target[target_offset:]."""
+    limit = min(len(source) - source_offset, len(target) - target_offset)
+    length = 0
+
+    while length + MATCH_CHUNK_SIZE <= limit:
+        start = source_offset + length
+        end = target_offset + length
+        if source[start:start+MATCH_CHUNK_SIZE] != target[end:end+MATCH_CHUNK_SIZE]:
+            break
+        length += MATCH_CHUNK_SIZE
+
+    while length < limit and source[source_offset+length] == target[target_offset+length]:
+        length += 1
+
+    return length
+
+
+def create_delta(source, target, max_size=None):
+    """Compute delta hunks turning the contents of a base object into `target`.
+
+    Blocks of the source are indexed by their contents, then the target is
+    scanned for blocks found in that index and matches are extended in both
+    directions. Return None if the delta would be larger than `max_size`.
+    """
+    index = {}
+    for offset in range(len(source) - BLOCK_SIZE, -1, -BLOCK_SIZE):
+        index[source[offset:offset+BLOCK_SIZE]] = offset
+
+    delta = bytearray(encode_size(len(source)) + encode_size(len(target)))
+    insert_start = 0
+    position = 0
+    end = len(target)
+
+    while position + BLOCK_SIZE <= end:
+        source_offset = index.get(target[position:position+BLOCK_SIZE])
+        if source_offset is None:
+            position += 1
+            if max_size is not None and len(delta) + position - insert_start > max_size:
+                return None
+            continue
+
+        # Extend the match backwards, over data that would otherwise be inserted.
+        while source_offset > 0 and position > insert_start \
+                and source[source_offset-1] == target[position-1]:
+            source_offset -= 1
+            position -= 1
+
+        length = match_length(source, source_offset, target, position)
+
+        delta += encode_insert(target[insert_start:position])
+        for offset in range(0, length, MAX_COPY_SIZE):
+            delta += encode_copy(source_offset + offset, min(MAX_COPY_SIZE, length - offset))
+
+        position += length
+        insert_start = position
+
+        if max_size is not None and len(delta) > max_size:
+            return None
+
+    delta += encode_insert(target[insert_start:])
+    if max_size is not None and len(delta) > max_size:
+        return None
+
+    return bytes(delta)
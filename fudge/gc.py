@@ -0,0 +1,93 @@
+import os
+
+from fudge.config import get_config_path, get_config_value
+from fudge.object import get_object_path, iter_loose_object_ids
+from fudge.packfile import find_packed_object
+from fudge.packobjects import repack
+from fudge.repository import get_repository
+from fudge.utils import FudgeException, ishex
+
+
+# Same default as Git's `gc.auto`.
+DEFAULT_AUTO_THRESHOLD = 6700
+
+# Loose objects are counted in a single fan-out directory, as in Git.
+SAMPLE_DIRECTORY = '17'
+
+
+def get_auto_threshold():
+    """Return the number of loose objects above which `gc` runs automatically."""
+    if not os.path.exists(get_config_path()):
+        return DEFAULT_AUTO_THRESHOLD
+
+    value = get_config_value('gc', 'auto')
+    if value is None:
+        return DEFAULT_AUTO_THRESHOLD
+
+    try:
+        return int(value)
+    except ValueError:
+        raise FudgeException('invalid gc.auto value: {}'.format(value))
+
+
+def too_many_loose_objects(threshold):
+    """Estimate whether there are more loose objects than `threshold`.
+
+    Object IDs are uniformly distributed, so the number of objects in one
+    fan-out directory is a good estimate of 1/256th of the total.
+    """
+    dirpath = os.path.join(get_repository().objects_path, SAMPLE_DIRECTORY)
+    if not os.path.exists(dirpath):
+        return False
+
+    count = sum(1 for filename in os.listdir(dirpath) if len(filename) == 38)
+    return count > (threshold + 255) // 256
+
+
+def prune_packed():
+    """Remove loose objects that are also stored in a pack.
+
+    Return the number of removed objects.
+    """
+    count = 0
+    for object_id in list(iter_loose_object_ids()):
+        if find_packed_object(object_id):
+            os.remove(get_object_path(object_id))
+            count += 1
+
+    basedir = get_repository().objects_path
+    for dirname in os.listdir(basedir):
+        dirpath = os.path.join(basedir, dirname)
+        if len(dirname) == 2 and ishex(dirname) and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+    return count
+
+
+def gc():
+    """Pack all objects into a single verified pack, then remove redundant packs and loose objects.
+
+    Return the path to the new pack file, the number of packed objects and
+    the number of removed loose objects.
+    """
+    path, num_objects = repack(delete=True)
+    if not path:
+        return None, 0, 0
+
+    return path, num_objects, prune_packed()
+
+
+def auto_gc(threshold=None):
+    """Run `gc` if there are too many loose objects.
+
+    A threshold of 0 disables automatic garbage collection.
+    Return True if `gc` was run.
+    """
+    if threshold is None:
+        threshold = get_auto_threshold()
+
+    if threshold <= 0 or not too_many_loose_objects(threshold):
+        return False
+
+    gc()
+    return True
@@ -1,18 +1,62 @@
+import binascii
+import hashlib
 import os
+import struct
+import tempfile
+import time
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from sortedcontainers import SortedDict
 
-from fudge.object import Object, get_object_path, load_object, store_object
-from fudge.parsing.builder import Builder
-from fudge.parsing.parser import Parser
-from fudge.repository import get_repository_path, get_working_tree_path
-from fudge.utils import FudgeException, get_hash, makedirs, read_file, stat, write_file
+from fudge.object import find_object_path, hash_file, iter_object_contents, sync_objects
+from fudge.repository import get_repository, get_working_tree_path
+from fudge.utils import FudgeException, get_stat_data, makedirs, read_file, stat
+
+
+class CacheTree(object):
+    """The tree object of an index directory, saved by the `TREE` index extension.
+
+    `entry_count` is the number of index entries in the directory and its
+    sub-directories. Changing one of them invalidates the tree: its object
+    ID is then None and `entry_count` is -1.
+    """
+
+    __slots__ = ('object_id', 'entry_count', 'subtrees')
+
+    def __init__(self, object_id=None, entry_count=-1):
+        self.object_id = object_id
+        self.entry_count = entry_count
+        self.subtrees = {}
+
+    def __repr__(self):
+        return 'CacheTree(object_id={!r}, entry_count={!r}, subtrees={!r})'.format(
+            self.object_id, self.entry_count, self.subtrees)
+
+    @property
+    def is_valid(self):
+        return self.object_id is not None
+
+    def invalidate(self, path):
+        """Invalidate the trees of the directories containing a path."""
+        node = self
+        for dirname in path.split('/'):
+            node.object_id = None
+            node.entry_count = -1
+
+            node = node.subtrees.get(dirname)
+            if node is None:
+                break
 
 
 class Index(object):
-    def __init__(self):
-        self.entries = SortedDict()
+    def __init__(self, entries=(), mtime=None, cache_tree=None):
+        self.entries = SortedDict((entry.path, entry) for entry in entries)
+
+        # The modification time of the index file when it was read, in nanoseconds.
+        self.mtime = mtime
+
+        self.cache_tree = cache_tree
 
     def __contains__(self, path):
         return path in self.entries
@@ -26,6 +70,13 @@ class Index(object):
 
     def add(self, entry):
         """Add or update an index entry."""
+        previous = self.entries.get(entry.path)
+
+        # Refreshing the stat data of an entry leaves its tree unchanged.
+        if (previous is None or (previous.object_type, previous.perms, previous.object_id) !=
+                (entry.object_type, entry.perms, entry.object_id)):
+            self.invalidate(entry.path)
+
         self.entries[entry.path] = entry
 
     def add_object(self, mode, object_id, path):
@@ -34,9 +85,13 @@ class Index(object):
             print('Skipping submodule {:.7} at {}'.format(object_id, path))
             return
 
-        object_path = get_object_path(object_id)
+        object_path = find_object_path(object_id)
+        if object_path:
+            status = stat(object_path)
+        else:
+            # Packed objects do not have a file of their own to take stat data from.
+            status = dict.fromkeys(STAT_FIELDS, 0)
 
-        status = stat(object_path)
         # TODO: check the validity of mode
         status['perms'] = mode
 
@@ -51,6 +106,21 @@ class Index(object):
     def remove(self, path):
         if path in self.entries:
             del self.entries[path]
+            self.invalidate(path)
+
+    def invalidate(self, path):
+        if self.cache_tree is not None:
+            self.cache_tree.invalidate(path)
+
+    def is_racily_clean(self, entry):
+        """Return whether a file may have changed after its entry was written.
+
+        With coarse file system timestamps, a file modified right after being
+        hashed may keep the modification time of its entry. This can only go
+        unnoticed if the file was not modified before the index was written.
+        """
+        return (self.mtime is not None and
+                entry.mtime_s * 10 ** 9 + entry.mtime_n >= self.mtime)
 
 
 IndexEntry = namedtuple('IndexEntry', [
@@ -59,15 +129,71 @@ IndexEntry = namedtuple('IndexEntry', [
 ])
 
 
+STAT_FIELDS = ['ctime_s', 'ctime_n', 'mtime_s', 'mtime_n', 'dev', 'ino', 'uid', 'gid', 'size']
+
+
 class ObjectType(object):
     REGULAR_FILE = 0b1000
     SYMBOLIC_LINK = 0b1010
     GITLINK = 0b1110
 
 
+OBJECT_TYPES = (ObjectType.REGULAR_FILE, ObjectType.SYMBOLIC_LINK, ObjectType.GITLINK)
+
+# Index permissions, as written in tree objects.
+PERMS = {perms: '100{:o}'.format(perms) for perms in (0o644, 0o755, 0)}
+
+EMPTY_BLOB_ID = 'e69de29bb2d1d6434b8b29ae775ad8c2e48c5391'
+
+INDEX_HEADER = struct.Struct('!4sII')
+
+# The fixed-size part of an index entry: stat data, mode, object ID and flags.
+INDEX_ENTRY = struct.Struct('!10I20sH')
+
+# Extensions start with a signature and the size of their data.
+INDEX_EXTENSION = struct.Struct('!4sI')
+
+
 def get_index_path():
-    basedir = get_repository_path()
-    return os.path.join(basedir, 'index')
+    return get_repository().index_path
+
+
+def parse_cache_tree(data, offset):
+    """Parse a cache tree and its sub-trees, in the format of the `TREE` extension.
+
+    Return the name of the directory, its cache tree and the offset following them.
+    """
+    name_end = data.index(b'\0', offset)
+    line_end = data.index(b'\n', name_end)
+
+    name = str(data[offset:name_end], 'utf-8')
+    entry_count, subtree_count = [int(count) for count in data[name_end+1:line_end].split(b' ')]
+    offset = line_end + 1
+
+    cache_tree = CacheTree(entry_count=entry_count)
+
+    # Invalid trees have no object ID.
+    if entry_count >= 0:
+        cache_tree.object_id = str(binascii.hexlify(data[offset:offset+20]), 'utf-8')
+        offset += 20
+
+    for _ in range(subtree_count):
+        subtree_name, subtree, offset = parse_cache_tree(data, offset)
+        cache_tree.subtrees[subtree_name] = subtree
+
+    return name, cache_tree, offset
+
+
+def serialize_cache_tree(cache_tree, name, chunks):
+    """Append a cache tree and its sub-trees to `chunks`, in the format of the `TREE` extension."""
+    chunks.append(bytes('{}\0{} {}\n'.format(
+        name, cache_tree.entry_count, len(cache_tree.subtrees)), 'utf-8'))
+    if cache_tree.is_valid:
+        chunks.append(binascii.unhexlify(cache_tree.object_id))
+
+    # Like Git, sub-trees are sorted by name length first.
+    for subtree_name in sorted(cache_tree.subtrees, key=lambda name: (len(name), name)):
+        serialize_cache_tree(cache_tree.subtrees[subtree_name], subtree_name, chunks)
 
 
 def read_index():
@@ -76,33 +202,28 @@ def read_index():
     if not os.path.exists(path):
         return Index()
 
+    mtime = os.stat(path).st_mtime_ns
     data = read_file(path)
 
-    header_parser = Parser(data[:12])
-    parser = Parser(data[12:])
-
-    if header_parser.get(4) != b'DIRC':
+    magic, version, num_index_entries = INDEX_HEADER.unpack_from(data)
+    if magic != b'DIRC':
         raise FudgeException('invalid index file magic')
 
-    version = header_parser.get_u4()
     if version != 2:
         raise FudgeException('unsupported index file version: {}'.format(version))
 
-    index = Index()
+    unpack_entry = INDEX_ENTRY.unpack_from
+    find_nul = data.index
 
-    num_index_entries = header_parser.get_u4()
+    entries = []
+    offset = INDEX_HEADER.size
 
     for _ in range(num_index_entries):
-        ctime_s = parser.get_u4()
-        ctime_n = parser.get_u4()
-        mtime_s = parser.get_u4()
-        mtime_n = parser.get_u4()
-        dev = parser.get_u4()
-        ino = parser.get_u4()
-
-        mode = parser.get_u4()
+        (ctime_s, ctime_n, mtime_s, mtime_n, dev, ino, mode, uid, gid, size, object_id,
+         flags) = unpack_entry(data, offset)
+
         object_type = (mode >> 12) & 0xf
-        if object_type not in (ObjectType.REGULAR_FILE, ObjectType.SYMBOLIC_LINK, ObjectType.GITLINK):
+        if object_type not in OBJECT_TYPES:
             raise FudgeException('invalid object type: 0b{:b}'.format(object_type))
 
         perms = mode & 0x1ff
@@ -111,118 +232,228 @@ def read_index():
         elif object_type in (ObjectType.SYMBOLIC_LINK, ObjectType.GITLINK) and perms != 0:
             raise FudgeException('invalid permissions')
 
-        perms = '100{:o}'.format(perms)
-
-        uid = parser.get_u4()
-        gid = parser.get_u4()
-        size = parser.get_u4()
-        object_id = parser.get_sha1()
-
-        flags = parser.get_u2()
-        assume_valid = (flags >> 15) & 0b1
         extended = (flags >> 14) & 0b1
         if extended != 0:
             raise FudgeException('invalid extended flag')
 
-        stage = (flags >> 12) & 0b11
-        name_length = flags & 0xfff
-
-        path = parser.get_utf8()
+        # Paths are NUL-terminated, and entries padded to a multiple of 8 bytes.
+        path_start = offset + INDEX_ENTRY.size
+        path_end = find_nul(b'\0', path_start)
+        path = str(data[path_start:path_end], 'utf-8')
+        offset += (path_end - offset + 8) & ~7
 
         entry = IndexEntry(
-            ctime_s, ctime_n, mtime_s, mtime_n, dev, ino, object_type, perms,
-            uid, gid, size, object_id, path
+            ctime_s, ctime_n, mtime_s, mtime_n, dev, ino, object_type, PERMS[perms],
+            uid, gid, size, str(binascii.hexlify(object_id), 'utf-8'), path
         )
-        index.add(entry)
+        entries.append(entry)
 
-    # Skip extensions
-    parser.offset = len(parser.data) - 20
-    index_checksum = parser.get_sha1()
-
-    data = header_parser.data + parser.data[:parser.offset-20]
-    data_checksum = get_hash(data)
-    if index_checksum != data_checksum:
+    view = memoryview(data)
+    if hashlib.sha1(view[:-20]).digest() != view[-20:]:
         raise FudgeException('bad index file checksum')
 
-    return index
+    cache_tree = None
 
+    while offset < len(data) - 20:
+        signature, extension_size = INDEX_EXTENSION.unpack_from(data, offset)
+        offset += INDEX_EXTENSION.size
 
-def write_index(index):
-    """Write an index file."""
-    header_builder = Builder()
-    header_builder.set(b'DIRC')
-    header_builder.set_u4(2)
-    header_builder.set_u4(len(index.entries))
+        if signature == b'TREE':
+            _, cache_tree, _ = parse_cache_tree(data, offset)
+        elif not b'A' <= signature[:1] <= b'Z':
+            # Extensions starting with an uppercase letter are optional.
+            raise FudgeException('unsupported index extension: {}'.format(
+                str(signature, 'utf-8', 'replace')))
 
-    builder = Builder()
+        offset += extension_size
 
-    for entry in index:
-        builder.set_u4(entry.ctime_s)
-        builder.set_u4(entry.ctime_n)
-        builder.set_u4(entry.mtime_s)
-        builder.set_u4(entry.mtime_n)
-        builder.set_u4(entry.dev)
-        builder.set_u4(entry.ino)
+    return Index(entries, mtime, cache_tree)
 
+
+def write_index(index, skip_if_locked=False):
+    """Write an index file.
+
+    Like Git, the index is written to `index.lock`, which is then renamed over
+    the index, so that concurrent commands and interruptions never leave a torn
+    index. If the lock is held by another command, raise FudgeException, or
+    return without writing when `skip_if_locked` is True, as for an
+    opportunistic refresh.
+    """
+    entries = list(index)
+    paths = [bytes(entry.path, 'utf-8') for entry in entries]
+
+    extensions = []
+    if index.cache_tree is not None:
+        chunks = []
+        serialize_cache_tree(index.cache_tree, '', chunks)
+        extension = b''.join(chunks)
+        extensions.append(INDEX_EXTENSION.pack(b'TREE', len(extension)) + extension)
+    extensions = b''.join(extensions)
+
+    size = INDEX_HEADER.size + len(extensions) + 20
+    for path in paths:
+        size += (INDEX_ENTRY.size + len(path) + 8) & ~7
+
+    # Padding bytes are left to zero.
+    data = bytearray(size)
+    INDEX_HEADER.pack_into(data, 0, b'DIRC', 2, len(entries))
+
+    pack_entry = INDEX_ENTRY.pack_into
+    offset = INDEX_HEADER.size
+
+    # The index file is modified in this second, or later.
+    now = int(time.time())
+
+    for entry, path in zip(entries, paths):
         perms = int(entry.perms[3:], 8)
         mode = (entry.object_type << 12) | perms
-        builder.set_u4(mode)
 
-        builder.set_u4(entry.uid)
-        builder.set_u4(entry.gid)
-        builder.set_u4(entry.size)
-        builder.set_sha1(entry.object_id)
+        # Like Git, the size of racily clean entries is zeroed, so that their
+        # files are hashed again rather than trusted on their stat data.
+        entry_size = 0 if entry.mtime_s >= now else entry.size
 
         # TODO: do not ignore the assume valid, extended and stage flags
-        flags = len(entry.path)
-        builder.set_u2(flags)
+        flags = min(len(path), 0xfff)
 
-        builder.set_utf8(entry.path)
+        pack_entry(
+            data, offset, entry.ctime_s, entry.ctime_n, entry.mtime_s, entry.mtime_n,
+            entry.dev, entry.ino, mode, entry.uid, entry.gid, entry_size,
+            binascii.unhexlify(entry.object_id), flags
+        )
 
-    data = header_builder.data + builder.data
+        path_start = offset + INDEX_ENTRY.size
+        data[path_start:path_start+len(path)] = path
+        offset += (INDEX_ENTRY.size + len(path) + 8) & ~7
 
-    checksum = get_hash(data)
-    builder.set_sha1(checksum)
+    data[offset:offset+len(extensions)] = extensions
+    offset += len(extensions)
 
-    data = header_builder.data + builder.data
+    data[offset:] = hashlib.sha1(memoryview(data)[:offset]).digest()
+
+    # Objects must be on disk before the index points to them.
+    sync_objects()
 
     path = get_index_path()
-    write_file(path, data)
+    lock_path = path + '.lock'
+    try:
+        fd = os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        if skip_if_locked:
+            return
+        raise FudgeException("unable to create '{}': another fudge process seems to be running"
+                             .format(lock_path))
 
+    try:
+        with open(fd, 'wb') as f:
+            f.write(data)
+        os.replace(lock_path, path)
+    except BaseException:
+        os.remove(lock_path)
+        raise
+
+
+def get_index_entry_path(path):
+    """Return the path of a file relative to the working tree, as stored in the index."""
+    basedir = get_working_tree_path()
+    relpath = os.path.relpath(os.path.abspath(path), basedir)
+    if relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+        raise FudgeException("path '{}' is outside the working tree".format(path))
+
+    return relpath.replace(os.sep, '/')
+
+
+def get_working_tree_stat(status):
+    """Return the stat data of a working tree file, as stored in its index entry.
+
+    `status` is the result of `lstat` on the file, which `os.scandir` entries
+    cache when walking the working tree.
+    """
+    status = get_stat_data(status)
+
+    # Like Git, only record whether a file is executable.
+    perms = 0o755 if status['perms'] & 0o100 else 0o644
+    status['perms'] = PERMS[perms]
+
+    return status
 
-def add_file_to_index(path):
-    data = read_file(path)
-    obj = Object('blob', len(data), data)
-    store_object(obj)
 
-    status = stat(path)
-    status['perms'] = '100{:o}'.format(status['perms'])
+def stat_working_tree_file(path):
+    return get_working_tree_stat(os.lstat(path))
+
+
+def entry_matches_stat(entry, status):
+    """Return whether an index entry has the same stat data as a file."""
+    # The size of racily clean entries was zeroed when writing the index.
+    if entry.size == 0 and entry.object_id != EMPTY_BLOB_ID:
+        return False
+
+    return all(getattr(entry, field) == status[field] for field in STAT_FIELDS)
+
+
+def hash_index_entry(basedir, path):
+    """Store the contents of a working tree file and return its index entry."""
+    fullpath = os.path.join(basedir, path)
+
+    # Stat data is taken first, so that changes made while hashing are noticed.
+    status = stat_working_tree_file(fullpath)
+    object_id = hash_file(fullpath, write=True)
 
     # TODO: handle symbolic links
-    # TODO: normalize path
-    entry = IndexEntry(object_type=ObjectType.REGULAR_FILE, object_id=obj.id, path=path, **status)
+    return IndexEntry(object_type=ObjectType.REGULAR_FILE, object_id=object_id, path=path,
+                      **status)
+
+
+def add_files_to_index(paths, workers=None):
+    """Add files to the index, with a single index write.
+
+    Paths are relative to the working tree. Files are hashed and stored by
+    a pool of threads, as hashlib and zlib release the GIL.
+    """
+    workers = workers or os.cpu_count() or 1
+    basedir = get_working_tree_path()
 
     index = read_index()
-    index.add(entry)
+
+    if workers == 1:
+        entries = [hash_index_entry(basedir, path) for path in paths]
+    else:
+        with ThreadPoolExecutor(workers) as executor:
+            entries = list(executor.map(lambda path: hash_index_entry(basedir, path), paths))
+
+    for entry in entries:
+        index.add(entry)
+
     write_index(index)
 
 
+def add_file_to_index(path):
+    add_files_to_index([get_index_entry_path(path)])
+
+
 def add_object_to_index(mode, object_id, path):
     index = read_index()
     index.add_object(mode, object_id, path)
     write_index(index)
 
 
-def remove_from_index(path):
+def remove_files_from_index(paths):
+    """Remove files from the index, with a single index write."""
     index = read_index()
-    if path not in index:
-        raise FudgeException('path {} is not in the index'.format(path))
+    for path in paths:
+        if path not in index:
+            raise FudgeException('path {} is not in the index'.format(path))
+
+        index.remove(path)
 
-    index.remove(path)
     write_index(index)
 
 
+def remove_from_index(path):
+    remove_files_from_index([path])
+
+
 def checkout_index():
+    """Write the files of the index that are missing from the working tree."""
     basedir = get_working_tree_path()
 
     index = read_index()
@@ -231,6 +462,18 @@ def checkout_index():
         dirname = os.path.dirname(path)
         makedirs(dirname)
 
-        if not os.path.exists(path):
-            obj = load_object(entry.object_id)
-            write_file(path, obj.contents)
+        if os.path.exists(path):
+            continue
+
+        # Contents are written to a temporary file first, so that a failed
+        # checkout does not leave a truncated file that later ones would skip.
+        fd, tmppath = tempfile.mkstemp(prefix='.tmp_checkout_', dir=dirname)
+        try:
+            with open(fd, 'wb') as f:
+                for chunk in iter_object_contents(entry.object_id):
+                    f.write(chunk)
+            os.chmod(tmppath, int(entry.perms[3:], 8))
+            os.replace(tmppath, path)
+        except BaseException:
+            os.remove(tmppath)
+            raise
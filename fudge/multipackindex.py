@@ -0,0 +1,154 @@
+import hashlib
+import os
+import struct
+import tempfile
+
+from fudge.packfile import (MIDX_CHUNK_FANOUT, MIDX_CHUNK_IDS, MIDX_CHUNK_LARGE_OFFSETS,
+                            MIDX_CHUNK_OFFSETS, MIDX_CHUNK_PACK_NAMES, MIDX_FILENAME,
+                            MIDX_HEADER_SIZE, MIDX_MAGIC, get_pack_directory, get_packs,
+                            invalidate_pack_directory, load_pack_directory)
+from fudge.utils import FudgeException
+
+
+def get_multi_pack_index_path():
+    return os.path.join(get_pack_directory(), MIDX_FILENAME)
+
+
+def build_multi_pack_index(packs):
+    """Build a version 1 multi-pack-index file covering `packs`.
+
+    Return the file data and the number of objects it covers.
+    """
+    packs = sorted(packs, key=lambda pack: os.path.basename(pack.index.path))
+    names = [os.path.basename(pack.index.path) for pack in packs]
+
+    # Objects stored in several packs are taken from the most recently
+    # modified one, as in Git.
+    order = sorted(range(len(packs)), key=lambda number: (
+        os.stat(packs[number].path).st_mtime_ns, -number))
+
+    locations = {}
+    for number in order:
+        index = packs[number].index
+        for position in range(len(index)):
+            locations[index.get_binary_id(position)] = (number, index.get_offset(position))
+
+    ids = sorted(locations)
+
+    fanout = [0] * 256
+    for binary_id in ids:
+        fanout[binary_id[0]] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    offsets = []
+    large_offsets = []
+    for binary_id in ids:
+        number, offset = locations[binary_id]
+        if offset < 0x80000000:
+            offsets.append(struct.pack('!II', number, offset))
+        else:
+            offsets.append(struct.pack('!II', number, 0x80000000 | len(large_offsets)))
+            large_offsets.append(struct.pack('!Q', offset))
+
+    # Pack names are padded with zero bytes, so that the next chunk is aligned.
+    pack_names = b''.join(bytes(name, 'utf-8') + b'\0' for name in names)
+    pack_names += b'\0' * (-len(pack_names) % 4)
+
+    chunks = [
+        (MIDX_CHUNK_PACK_NAMES, pack_names),
+        (MIDX_CHUNK_FANOUT, struct.pack('!256I', *fanout)),
+        (MIDX_CHUNK_IDS, b''.join(ids)),
+        (MIDX_CHUNK_OFFSETS, b''.join(offsets)),
+    ]
+    if large_offsets:
+        chunks.append((MIDX_CHUNK_LARGE_OFFSETS, b''.join(large_offsets)))
+
+    header = MIDX_MAGIC + struct.pack('!BBBBI', 1, 1, len(chunks), 0, len(packs))
+
+    lookup = []
+    offset = MIDX_HEADER_SIZE + 12 * (len(chunks) + 1)
+    for chunk_id, chunk in chunks:
+        lookup.append(struct.pack('!4sQ', chunk_id, offset))
+        offset += len(chunk)
+    lookup.append(struct.pack('!4sQ', b'\0\0\0\0', offset))
+
+    data = header + b''.join(lookup) + b''.join(chunk for _, chunk in chunks)
+    data += hashlib.sha1(data).digest()
+
+    return data, len(ids)
+
+
+def write_multi_pack_index():
+    """Write a multi-pack-index covering every pack of the repository.
+
+    Return its path and the number of objects it covers, or (None, 0) if
+    there is no pack.
+    """
+    packs = get_packs()
+    if not packs:
+        return None, 0
+
+    data, num_objects = build_multi_pack_index(packs)
+
+    # The file is renamed into place, as the current one may be mapped in memory.
+    path = get_multi_pack_index_path()
+    fd, tmppath = tempfile.mkstemp(prefix='tmp_midx_', dir=os.path.dirname(path))
+    with open(fd, 'wb') as f:
+        f.write(data)
+
+    os.chmod(tmppath, 0o444)
+    os.replace(tmppath, path)
+    invalidate_pack_directory(os.path.dirname(path))
+
+    return path, num_objects
+
+
+def verify_multi_pack_index():
+    """Check the multi-pack-index against the packs it covers.
+
+    Return the number of objects it covers.
+    """
+    path = get_multi_pack_index_path()
+    if not os.path.exists(path):
+        raise FudgeException('there is no multi-pack-index file')
+
+    multi_pack_index = load_pack_directory().multi_pack_index
+    if multi_pack_index is None:
+        raise FudgeException('multi-pack-index file refers to missing packs')
+
+    data = multi_pack_index.data
+    if hashlib.sha1(memoryview(data)[:-20]).digest() != data[-20:]:
+        raise FudgeException('bad multi-pack-index file checksum')
+
+    if multi_pack_index.pack_names != sorted(multi_pack_index.pack_names):
+        raise FudgeException('multi-pack-index pack names are not sorted')
+
+    fanout = multi_pack_index.fanout
+    previous = None
+    for position, object_id in enumerate(multi_pack_index):
+        binary_id = multi_pack_index.get_binary_id(position)
+        if previous is not None and binary_id <= previous:
+            raise FudgeException('multi-pack-index object IDs are not sorted')
+        previous = binary_id
+
+        first_byte = binary_id[0]
+        if position >= fanout[first_byte] or (first_byte and position < fanout[first_byte - 1]):
+            raise FudgeException('invalid multi-pack-index fan-out table')
+
+        pack_number, offset = multi_pack_index.get_location(position)
+        if pack_number >= len(multi_pack_index.packs):
+            raise FudgeException('object {} is in an unknown pack'.format(object_id))
+
+        index = multi_pack_index.packs[pack_number].index
+        pack_position = index.find(object_id)
+        if pack_position is None or index.get_offset(pack_position) != offset:
+            raise FudgeException('object {} has an incorrect pack offset'.format(object_id))
+
+    for pack in multi_pack_index.packs:
+        for object_id in pack.index:
+            if multi_pack_index.find(object_id) is None:
+                raise FudgeException('object {} of {} is missing'.format(
+                    object_id, os.path.basename(pack.path)))
+
+    return len(multi_pack_index)
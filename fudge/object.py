@@ -1,20 +1,83 @@
-import enum
+import atexit
+import bisect
+import hashlib
 import os
+import sys
+import tempfile
+import threading
 import zlib
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
-from fudge.repository import get_repository_path
-from fudge.utils import FudgeException, get_hash, ishex, makedirs, read_file, write_file
+from fudge.config import get_config_path, get_config_value
+from fudge.packfile import (find_packed_entry, find_packed_object, get_object_id_tables,
+                            iter_inflate, read_packed_object, read_packed_object_info)
+from fudge.repository import get_repository
+from fudge.utils import FudgeException, LRUCache, ishex, makedirs, read_file
+
+
+OBJECT_CACHE_SIZE = 64 * 1024 * 1024
+
+# Same defaults as Git: abbreviated IDs are at least 4 characters long when
+# given, and 7 characters long when shown.
+MIN_ABBREV = 4
+DEFAULT_ABBREV = 7
+HEADER_CHUNK_SIZE = 64
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Objects queued per ObjectWriter thread.
+WRITER_QUEUE_SIZE = 16
+
+# How loose objects are synced to disk: not at all, one by one as they are
+# written, or all at once before refs or the index are updated.
+FSYNC_NONE = 'none'
+FSYNC_OBJECT = 'object'
+FSYNC_BATCH = 'batch'
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_OBJECT, FSYNC_BATCH)
+
+# Objects read or written by this process, keyed by repository path and
+# object ID, so that commands loading the same trees and commits several
+# times only inflate them once.
+object_cache = LRUCache(OBJECT_CACHE_SIZE)
+
+_fsync_policy = None
+
+# Loose objects written under the batch fsync policy and not synced yet.
+_unsynced_objects = []
+
+# Sorted loose object file names, keyed by fan-out directory. Each entry
+# holds the directory's modification time when it was last listed.
+_loose_listings = {}
+
+
+ObjectInfo = namedtuple('ObjectInfo', ['id', 'type', 'size'])
 
 
 class Object(object):
+    """An object, whose contents may be any bytes-like object.
+
+    Objects loaded from the object store, loose or packed, have bytes
+    contents. Objects are not modified once created, so their ID is only
+    computed once. Their size is the length of their contents: it is not
+    stored, which saves an int object per object larger than 256 bytes.
+    """
+
+    __slots__ = ('type', 'contents', '_id')
+
     def __init__(self, type_, size, contents):
-        self.type = type_
-        self.size = size
+        # There are only a few object types, so objects share their type string.
+        self.type = sys.intern(type_)
 
         if isinstance(contents, str):
             contents = bytes(contents, 'utf-8')
         self.contents = contents
 
+        self._id = None
+
+    @property
+    def size(self):
+        return len(self.contents)
+
     @property
     def header(self):
         header = '{} {}\0'.format(self.type, self.size)
@@ -22,85 +85,531 @@ class Object(object):
 
     @property
     def id(self):
-        return get_hash(self.header + self.contents)
-
-
-class ObjectType(enum.IntEnum):
-    COMMIT = 1
-    TREE = 2
-    BLOB = 3
-    TAG = 4
-    DELTA_OFFSET = 6
-    DELTA_BASE = 7
-
-    @classmethod
-    def exists(cls, value):
-        return any(value == item.value for item in cls)
-
-    @classmethod
-    def to_name(cls, value):
-        return ObjectType(value).name.lower()
+        if self._id is None:
+            sha1 = hashlib.sha1(self.header)
+            sha1.update(self.contents)
+            self._id = sha1.hexdigest()
+        return self._id
 
-    @classmethod
-    def from_name(cls, value):
-        value = value.upper()
-        return ObjectType[value]
+    def compress(self):
+        """Return the zlib-compressed header and contents of the object, as stored when loose."""
+        compress = zlib.compressobj()
+        return compress.compress(self.header) + compress.compress(self.contents) + compress.flush()
 
 
 def get_object_path(object_id, mkdir=False):
-    basedir = get_repository_path()
     dirname, filename = object_id[:2], object_id[2:]
 
-    dirpath = os.path.join(basedir, 'objects', dirname)
+    dirpath = os.path.join(get_repository().objects_path, dirname)
     if mkdir:
         makedirs(dirpath)
 
     return os.path.join(dirpath, filename)
 
 
-def find_object_path(object_id):
-    if len(object_id) < 4:
-        raise FudgeException('invalid object name {}'.format(object_id))
+def get_loose_object_filenames(dirname, objects_path=None):
+    """Return the sorted file names of the loose objects in a fan-out directory.
+
+    The object directory of the current repository is searched by default.
+    """
+    dirpath = os.path.join(objects_path or get_repository().objects_path, dirname)
+
+    try:
+        mtime = os.stat(dirpath).st_mtime_ns
+    except FileNotFoundError:
+        return []
+
+    cached = _loose_listings.get(dirpath)
+    if cached and cached[0] == mtime:
+        return cached[1]
 
-    basedir = get_repository_path()
+    filenames = sorted(filename for filename in os.listdir(dirpath) if len(filename) == 38)
+    _loose_listings[dirpath] = (mtime, filenames)
+    return filenames
+
+
+def iter_neighbor_ids(object_id):
+    """Yield the object IDs sorted right before and after a (possibly abbreviated) object ID.
+
+    Loose objects of the repository and of its alternates, and each table
+    of packed object IDs are searched separately, so IDs may be yielded
+    more than once.
+    """
+    repository = get_repository()
     dirname, filepart = object_id[:2], object_id[2:]
 
-    dirpath = os.path.join(basedir, 'objects', dirname)
-    if not os.path.exists(dirpath):
-        return None
+    for objects_path in [repository.objects_path] + repository.alternates:
+        filenames = get_loose_object_filenames(dirname, objects_path)
+        position = bisect.bisect_left(filenames, filepart)
+        for filename in filenames[max(position - 1, 0):position + 2]:
+            yield dirname + filename
+
+    for table in get_object_id_tables():
+        position = table.bisect(object_id)
+        for neighbor in range(max(position - 1, 0), min(position + 2, len(table))):
+            yield table.get_id(neighbor)
+
+
+def resolve_object_id(object_id):
+    """Return the full ID of the only object whose ID starts with `object_id`."""
+    object_id = check_object_id(object_id)
+    if len(object_id) == 40:
+        return object_id
+
+    if len(object_id) < MIN_ABBREV:
+        raise FudgeException('invalid object name {}'.format(object_id))
+
+    matches = set(other for other in iter_neighbor_ids(object_id) if other.startswith(object_id))
+    if not matches:
+        raise FudgeException('object {} does not exist'.format(object_id))
+    if len(matches) > 1:
+        raise FudgeException('short object ID {} is ambiguous'.format(object_id))
+
+    return matches.pop()
+
+
+def abbreviate_object_id(object_id, min_length=DEFAULT_ABBREV):
+    """Return the shortest prefix of an object ID that is unique in the repository."""
+    length = min_length
+    for other in iter_neighbor_ids(object_id):
+        if other != object_id:
+            length = max(length, len(os.path.commonprefix([object_id, other])) + 1)
+
+    return object_id[:length]
+
 
-    for filename in os.listdir(dirpath):
-        if filename.startswith(filepart):
-            return os.path.join(dirpath, filename)
+def find_object_path(object_id):
+    """Return the path to a loose object, or None if the object is not loose.
+
+    Loose objects of alternates are found too.
+    """
+    object_id = resolve_object_id(object_id)
+
+    path = get_object_path(object_id)
+    if os.path.exists(path):
+        return path
+
+    for objects_path in get_repository().alternates:
+        path = os.path.join(objects_path, object_id[:2], object_id[2:])
+        if os.path.exists(path):
+            return path
 
     return None
 
 
+def in_alternates(object_id):
+    """Return whether an object is stored by an alternate of the current repository."""
+    alternates = get_repository().alternates
+    if not alternates:
+        return False
+
+    for objects_path in alternates:
+        if os.path.exists(os.path.join(objects_path, object_id[:2], object_id[2:])):
+            return True
+
+    dirpaths = [os.path.join(objects_path, 'pack') for objects_path in alternates]
+    return find_packed_entry(object_id, dirpaths) is not None
+
+
+def iter_loose_object_ids():
+    """Yield the ID of every loose object."""
+    basedir = get_repository().objects_path
+
+    for dirname in sorted(os.listdir(basedir)):
+        if len(dirname) != 2 or not ishex(dirname):
+            continue
+
+        for filename in sorted(os.listdir(os.path.join(basedir, dirname))):
+            if len(filename) == 38 and ishex(filename):
+                yield dirname + filename
+
+
+def set_object_cache_size(max_size):
+    """Set the number of bytes of object contents kept in memory, evicting objects if needed."""
+    object_cache.resize(max_size)
+
+
+def cache_object(object_id, obj):
+    key = (get_repository().path, object_id)
+    object_cache.put(key, obj, len(obj.contents))
+
+
+def get_fsync_policy():
+    """Return how loose objects are synced to disk.
+
+    Like Git, objects are only synced if `core.fsyncObjectFiles` is true,
+    and synced at once if `core.fsyncMethod` is `batch`.
+    """
+    global _fsync_policy
+
+    if _fsync_policy is None:
+        _fsync_policy = FSYNC_NONE
+
+        if os.path.exists(get_config_path()):
+            value = get_config_value('core', 'fsyncObjectFiles') or 'false'
+            if value.lower() in ('true', 'yes', 'on', '1'):
+                method = get_config_value('core', 'fsyncMethod')
+                _fsync_policy = FSYNC_BATCH if method == 'batch' else FSYNC_OBJECT
+
+    return _fsync_policy
+
+
+def set_fsync_policy(policy):
+    """Set how loose objects are synced to disk, syncing pending objects first."""
+    global _fsync_policy
+
+    if policy not in FSYNC_POLICIES:
+        raise FudgeException('invalid fsync policy: {}'.format(policy))
+
+    sync_objects()
+    _fsync_policy = policy
+
+
+def sync_objects():
+    """Sync the loose objects written under the batch fsync policy to disk."""
+    if not _unsynced_objects:
+        return
+
+    # Only the objects written by this process are flushed, rather than
+    # every file system with `os.sync`.
+    for path in _unsynced_objects:
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+
+    # Then the directories their names were added to, once each. Directories
+    # cannot be opened on some platforms, such as Windows.
+    if hasattr(os, 'O_DIRECTORY'):
+        for dirpath in sorted(set(os.path.dirname(path) for path in _unsynced_objects)):
+            fd = os.open(dirpath, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    del _unsynced_objects[:]
+
+
+atexit.register(sync_objects)
+
+
+def write_temporary_object(dirpath, write, policy):
+    """Write a loose object to a new temporary file in `dirpath`.
+
+    `write` is called with the file, writes the compressed object to it and
+    returns the object ID.
+    Return the path to the temporary file and the object ID.
+    """
+    fd, tmppath = tempfile.mkstemp(prefix='tmp_obj_', dir=dirpath)
+
+    try:
+        with open(fd, 'wb') as f:
+            object_id = write(f)
+            if policy == FSYNC_OBJECT:
+                f.flush()
+                os.fsync(f.fileno())
+    except Exception:
+        os.remove(tmppath)
+        raise
+
+    return tmppath, object_id
+
+
+def install_object(tmppath, path, policy):
+    """Rename a complete temporary object file to its final path."""
+    # Like Git, make loose objects read-only.
+    os.chmod(tmppath, 0o444)
+    os.replace(tmppath, path)
+
+    # The listing would otherwise be trusted until the fan-out directory's
+    # modification time changes, which may not happen within a clock tick.
+    _loose_listings.pop(os.path.dirname(path), None)
+
+    if policy == FSYNC_BATCH:
+        _unsynced_objects.append(path)
+
+
+def write_object_file(write):
+    """Write a loose object atomically.
+
+    `write` is called with a temporary file in the object store, writes the
+    compressed object to it and returns the object ID. The temporary file is
+    then renamed, so a crash or a concurrent writer never leaves a truncated
+    object behind.
+    Return the object ID.
+    """
+    policy = get_fsync_policy()
+
+    dirpath = get_repository().objects_path
+    tmppath, object_id = write_temporary_object(dirpath, write, policy)
+
+    path = get_object_path(object_id, mkdir=True)
+    if os.path.exists(path) or in_alternates(object_id):
+        os.remove(tmppath)
+    else:
+        install_object(tmppath, path, policy)
+
+    return object_id
+
+
 def store_object(obj):
     """Store an object in the object store."""
-    path = get_object_path(obj.id, mkdir=True)
+    object_id = obj.id
 
-    if not os.path.exists(path):
-        compressed = zlib.compress(obj.header + obj.contents)
-        write_file(path, compressed)
+    # Objects borrowed from alternates are not duplicated.
+    if not os.path.exists(get_object_path(object_id)) and not in_alternates(object_id):
+        def write(f):
+            f.write(obj.compress())
+            return object_id
 
+        write_object_file(write)
 
-def load_object(object_id):
-    """Load an object from the object store."""
+    cache_object(object_id, obj)
+
+
+class ObjectWriter(object):
+    """Store many objects at once.
+
+    The object store is looked up once, each fan-out directory is created
+    and listed at most once, and objects are hashed, compressed and written
+    by a pool of threads, as hashlib and zlib release the GIL.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        repository = get_repository()
+        self.basedir = repository.path
+        self.dirpath = repository.objects_path
+        self.alternates = repository.alternates
+        self.policy = get_fsync_policy()
+
+        self.fanout = {}
+        self.lock = threading.Lock()
+
+    def get_filenames(self, dirname):
+        """Return the names of the objects in a fan-out directory, creating it if needed."""
+        with self.lock:
+            filenames = self.fanout.get(dirname)
+            if filenames is None:
+                dirpath = os.path.join(self.dirpath, dirname)
+                makedirs(dirpath)
+                filenames = self.fanout[dirname] = set(os.listdir(dirpath))
+            return filenames
+
+    def store(self, obj):
+        """Store one object, unless it already exists. Return its ID."""
+        object_id = obj.id
+
+        dirname, filename = object_id[:2], object_id[2:]
+        filenames = self.get_filenames(dirname)
+        if filename not in filenames and not (self.alternates and in_alternates(object_id)):
+            def write(f):
+                f.write(obj.compress())
+                return object_id
+
+            tmppath, _ = write_temporary_object(self.dirpath, write, self.policy)
+            install_object(tmppath, os.path.join(self.dirpath, dirname, filename), self.policy)
+            filenames.add(filename)
+
+        object_cache.put((self.basedir, object_id), obj, len(obj.contents))
+        return object_id
+
+    def write(self, objects):
+        """Store objects from an iterable. Return their IDs, in the same order."""
+        if self.workers == 1:
+            return [self.store(obj) for obj in objects]
+
+        ids = []
+        pending = deque()
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            for obj in objects:
+                pending.append(executor.submit(self.store, obj))
+
+                # Bound the number of objects held in memory.
+                if len(pending) >= self.workers * WRITER_QUEUE_SIZE:
+                    ids.append(pending.popleft().result())
+
+            ids.extend(future.result() for future in pending)
+
+        return ids
+
+
+def check_object_id(object_id):
     object_id = object_id.lower()
     if not ishex(object_id):
         raise FudgeException('invalid object name {}'.format(object_id))
+    return object_id
 
-    path = find_object_path(object_id)
-    if not path:
-        raise FudgeException('object {} does not exist'.format(object_id))
 
-    data = read_file(path)
-    data = zlib.decompress(data)
+def get_cached_object(object_id):
+    return object_cache.get((get_repository().path, object_id))
+
 
-    header, contents = data.split(b'\0', 1)
+def parse_object_header(header):
     header = str(header, 'utf-8')
     type_, size = header.split()
-    size = int(size)
+    return type_, int(size)
+
+
+def read_loose_object(path):
+    data = read_file(path)
+    data = zlib.decompress(data)
+
+    end = data.index(b'\0')
+    type_, size = parse_object_header(data[:end])
+
+    # Like packed objects, the contents are bytes.
+    return Object(type_, size, data[end+1:])
+
+
+def read_loose_object_header(path):
+    """Read the type and size of a loose object, only inflating the start of the file."""
+    decompress = zlib.decompressobj()
+    data = b''
+
+    with open(path, 'rb') as f:
+        while b'\0' not in data:
+            chunk = f.read(HEADER_CHUNK_SIZE)
+            if not chunk:
+                raise FudgeException('invalid object header in {}'.format(path))
+            data += decompress.decompress(chunk)
+
+    header, _ = data.split(b'\0', 1)
+    return parse_object_header(header)
+
+
+def iter_loose_object_contents(path):
+    """Yield the contents of a loose object in chunks, as the file is inflated."""
+    with open(path, 'rb') as f:
+        chunks = iter(lambda: f.read(STREAM_CHUNK_SIZE), b'')
+
+        header = b''
+        size = None
+        total = 0
+
+        for data in iter_inflate(chunks, STREAM_CHUNK_SIZE):
+            if size is None:
+                header += data
+                if b'\0' not in header:
+                    continue
+                header, data = header.split(b'\0', 1)
+                _, size = parse_object_header(header)
+
+            total += len(data)
+            if data:
+                yield data
+
+    if size is None:
+        raise FudgeException('invalid object header in {}'.format(path))
+    if total != size:
+        raise FudgeException('invalid object length')
+
+
+def iter_object_contents(object_id):
+    """Return an iterator over the contents of an object, in chunks.
+
+    The object is looked up right away, but its contents are only inflated
+    as they are iterated over, so large blobs are never fully in memory
+    unless they are deltified in a pack.
+    """
+    object_id = resolve_object_id(object_id)
+
+    obj = get_cached_object(object_id)
+    if obj is not None:
+        return iter([obj.contents])
+
+    path = find_object_path(object_id)
+    if path:
+        return iter_loose_object_contents(path)
+
+    found = find_packed_object(object_id)
+    if not found:
+        raise FudgeException('object {} does not exist'.format(object_id))
+
+    pack, offset = found
+    return pack.iter_contents(offset)
+
+
+def hash_blob_stream(f, size, output=None):
+    """Hash `size` bytes read from a file object as a blob, in fixed-size chunks.
+
+    If `output` is given, the loose object is compressed into it at the same time.
+    Return the object ID.
+    """
+    header = bytes('blob {}\0'.format(size), 'utf-8')
+    sha1 = hashlib.sha1(header)
+    compress = zlib.compressobj()
+    if output:
+        output.write(compress.compress(header))
+
+    remaining = size
+    while remaining:
+        chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise FudgeException('file was truncated while being read')
+
+        sha1.update(chunk)
+        if output:
+            output.write(compress.compress(chunk))
+        remaining -= len(chunk)
+
+    if f.read(1):
+        raise FudgeException('file grew while being read')
+
+    if output:
+        output.write(compress.flush())
+
+    return sha1.hexdigest()
+
+
+def hash_file(path, write=False):
+    """Compute the blob ID of a file and optionally store it, using constant memory."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not write:
+            return hash_blob_stream(f, size)
+
+        return write_object_file(lambda output: hash_blob_stream(f, size, output))
+
+
+def load_object(object_id):
+    """Load an object from the object cache, or else from the object store."""
+    object_id = resolve_object_id(object_id)
+
+    obj = get_cached_object(object_id)
+    if obj is not None:
+        return obj
+
+    path = find_object_path(object_id)
+    if path:
+        obj = read_loose_object(path)
+    else:
+        packed = read_packed_object(object_id)
+        if not packed:
+            raise FudgeException('object {} does not exist'.format(object_id))
+
+        type_, contents = packed
+        obj = Object(type_, len(contents), contents)
+
+    cache_object(object_id, obj)
+    return obj
+
+
+def object_info(object_id):
+    """Return the full ID, type and size of an object without loading its contents."""
+    object_id = resolve_object_id(object_id)
+
+    obj = get_cached_object(object_id)
+    if obj is not None:
+        return ObjectInfo(object_id, obj.type, obj.size)
+
+    path = find_object_path(object_id)
+    if path:
+        type_, size = read_loose_object_header(path)
+        return ObjectInfo(object_id, type_, size)
+
+    packed = read_packed_object_info(object_id)
+    if not packed:
+        raise FudgeException('object {} does not exist'.format(object_id))
 
-    return Object(type_, size, contents)
+    return ObjectInfo(*packed)
@@ -1,125 +1,530 @@
+import binascii
+import hashlib
+import io
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
 import zlib
+from collections import defaultdict, deque
+
+from fudge.delta import apply_delta
+from fudge.object import Object
+from fudge.packfile import (CHUNK_SIZE, DELTA_BASE_CACHE_SIZE, DeltaBaseCache, ObjectType,
+                            get_pack_directory, invalidate_pack_directory, map_file,
+                            read_entry_header, read_raw_entry, resolve_entry)
+from fudge.parsing.builder import Builder
+from fudge.utils import FudgeException, get_hash, makedirs, write_file
+
+
+# Number of delta trees resolved per task when resolving deltas in parallel.
+RESOLVE_BATCH_SIZE = 256
+
+# A packed object's header is at most 10 bytes for the type and size, plus
+# 10 bytes for an offset delta's base or 20 bytes for a ref delta's base.
+MAX_HEADER_SIZE = 32
+
+
+class PackEntry(object):
+    """An object recorded while indexing a pack file."""
+
+    def __init__(self, offset, object_type, size, base, data_offset, crc32):
+        self.offset = offset
+        self.type = object_type
+        self.size = size
+        self.base = base
+        self.data_offset = data_offset
+        self.crc32 = crc32
+
+        self.id = None
+
+
+class PackStream(object):
+    """Read a pack file sequentially from a file object, in bounded chunks.
+
+    Consumed bytes are hashed to check the pack checksum, and copied to
+    `output` when one is given, so a pack can be stored while it is parsed.
+    """
+
+    def __init__(self, f, output=None, offset=0):
+        self.file = f
+        self.output = output
+
+        self.buffer = b''
+        self.position = 0
+        self.offset = offset
+
+        self.sha1 = hashlib.sha1()
+        self.crc32 = 0
 
-from fudge.object import Object, ObjectType
-from fudge.parsing.parser import Parser
-from fudge.utils import FudgeException
+    @property
+    def available(self):
+        return len(self.buffer) - self.position
 
+    def fill(self, n):
+        """Buffer at least `n` bytes, or as many as are left in the file."""
+        while self.available < n:
+            chunk = self.file.read(CHUNK_SIZE)
+            if not chunk:
+                return False
+            self.buffer = self.buffer[self.position:] + chunk
+            self.position = 0
+        return True
 
-def parse_pack(data):
-    parser = Parser(data)
-    objects = {}
+    def consume(self, n, checksum=True):
+        data = memoryview(self.buffer)[self.position:self.position+n]
+        self.position += n
+        self.offset += n
+
+        if checksum:
+            self.sha1.update(data)
+            self.crc32 = zlib.crc32(data, self.crc32)
+            if self.output:
+                self.output.write(data)
+
+        return data
 
-    if parser.get(4) != b'PACK':
-        raise FudgeException('invalid pack file')
+    def read(self, n, checksum=True):
+        if not self.fill(n):
+            raise FudgeException('truncated pack file')
+        return bytes(self.consume(n, checksum))
 
-    version = parser.get_u4()
-    if version != 2:
-        raise FudgeException('unsupported pack file version: {}'.format(version))
+    def read_header(self):
+        """Read a packed object's header and reset the entry's CRC32."""
+        self.crc32 = 0
+        self.fill(MAX_HEADER_SIZE)
+
+        # Fewer bytes than a full header may be left at the end of the file.
+        try:
+            object_type, size, base, data_position = read_entry_header(self.buffer, self.position)
+        except IndexError:
+            raise FudgeException('truncated pack file')
+        if data_position > len(self.buffer):
+            raise FudgeException('truncated pack file')
+        if object_type == ObjectType.DELTA_OFFSET:
+            # Make the base offset relative to the start of the pack.
+            base += self.offset - self.position
 
-    num_objects = parser.get_u4()
-    for _ in range(num_objects):
-        obj, base_object_id = parse_packed_object(parser)
-        if ObjectType.from_name(obj.type) == ObjectType.DELTA_BASE:
-            base_object = objects[base_object_id]
-            obj = parse_delta_hunks(obj.contents, base_object)
+        self.consume(data_position - self.position)
+        return object_type, size, base
+
+    def inflate(self, size, keep=True):
+        """Inflate the next zlib stream, feeding it one buffered chunk at a time.
+
+        When `keep` is False, the inflated data is only counted.
+        """
+        decompress = zlib.decompressobj()
+        chunks = []
+        length = 0
+
+        while not decompress.eof:
+            if not self.available and not self.fill(1):
+                raise FudgeException('truncated pack file')
+
+            chunk = memoryview(self.buffer)[self.position:]
+            contents = decompress.decompress(chunk)
+            self.consume(len(chunk) - len(decompress.unused_data))
+
+            length += len(contents)
+            if keep:
+                chunks.append(contents)
+
+        if length != size:
+            raise FudgeException('invalid object length')
+
+        return b''.join(chunks)
 
-        objects[obj.id] = obj
+    def read_pack_header(self):
+        if self.read(4) != b'PACK':
+            raise FudgeException('invalid pack file')
 
-    # TODO: verify checksum
-    checksum = parser.get_sha1()
+        version = struct.unpack('!I', self.read(4))[0]
+        if version != 2:
+            raise FudgeException('unsupported pack file version: {}'.format(version))
+
+        return struct.unpack('!I', self.read(4))[0]
+
+    def read_checksum(self):
+        """Read the pack checksum and compare it to the checksum of the consumed data."""
+        expected = self.sha1.hexdigest()
+
+        checksum = self.read(20, checksum=False)
+        if self.output:
+            self.output.write(checksum)
+
+        checksum = str(binascii.hexlify(checksum), 'utf-8')
+        if checksum != expected:
+            raise FudgeException('bad pack file checksum')
+
+        if self.fill(1):
+            raise FudgeException('unexpected data after the pack file checksum')
+
+        return checksum
+
+
+def parse_pack(f, cache_size=DELTA_BASE_CACHE_SIZE):
+    """Parse a pack file read from a file object (or a bytes-like object).
+
+    Objects are yielded as they are resolved. Only their offsets are kept:
+    delta bases come from a bounded cache, or are read again from the file
+    once evicted, so non-seekable file objects are first spooled to disk.
+    """
+    if not hasattr(f, 'read'):
+        f = io.BytesIO(f)
+    elif not (hasattr(f, 'seekable') and f.seekable()):
+        spool = tempfile.TemporaryFile()
+        shutil.copyfileobj(f, spool, CHUNK_SIZE)
+        spool.seek(0)
+        f = spool
+
+    start = f.tell()
+    stream = PackStream(f)
+    cache = DeltaBaseCache(cache_size)
 
-    return objects.values()
+    offsets = {}
+    pending = defaultdict(list)
 
+    def read_raw(offset):
+        position = f.tell()
+        f.seek(start + offset)
 
-def parse_packed_object(parser):
-    byte = parser.get_u1()
-    extended = (byte >> 7) & 1
+        entry_stream = PackStream(f, offset=offset)
+        object_type, size, base = entry_stream.read_header()
+        data = entry_stream.inflate(size)
+
+        f.seek(position)
+        return object_type, base, data
+
+    num_objects = stream.read_pack_header()
+    for _ in range(num_objects):
+        offset = stream.offset
+        obj, base = parse_packed_object(stream)
+
+        object_type = ObjectType.from_name(obj.type)
+        if object_type == ObjectType.DELTA_BASE:
+            if base not in offsets:
+                # The base comes later in the pack.
+                pending[base].append((offset, obj.contents))
+                continue
+            base = offsets[base]
+
+        if object_type in (ObjectType.DELTA_OFFSET, ObjectType.DELTA_BASE):
+            object_type, contents = resolve_entry(base, read_raw, offsets.get, cache)
+            contents = apply_delta(contents, obj.contents)
+        else:
+            contents = obj.contents
 
-    object_type = (byte >> 4) & 0x7
-    if not ObjectType.exists(object_type):
-        raise FudgeException('invalid packed object type: {}'.format(object_type))
-    elif object_type == ObjectType.DELTA_OFFSET:
-        raise FudgeException('unsupported packed object type: {}'.format(object_type))
+        resolved = [(offset, object_type, contents)]
+        while resolved:
+            offset, object_type, contents = resolved.pop()
+            cache.put(offset, object_type, contents)
 
-    size = byte & 0xf
+            obj = Object(ObjectType.to_name(object_type), len(contents), contents)
+            offsets[obj.id] = offset
+            yield obj
 
-    shift = 4
-    while extended:
-        byte = parser.get_u1()
-        extended = (byte >> 7) & 1
-        size |= (byte & 0x7f) << shift
-        shift += 7
+            for delta_offset, delta in pending.pop(obj.id, []):
+                resolved.append((delta_offset, object_type, apply_delta(contents, delta)))
 
-    base_object_id = None
-    if object_type == ObjectType.DELTA_BASE:
-        base_object_id = parser.get_sha1()
+    stream.read_checksum()
 
-    decompress = zlib.decompressobj()
-    contents = decompress.decompress(parser.data[parser.offset:])
-    if len(contents) != size:
-        raise FudgeException('invalid object length')
+    if pending:
+        raise FudgeException('pack file contains deltas with missing bases')
 
-    # The pack file format does not contain the length of the compressed data,
-    # and Python's zlib does not give us a way to directly access the number
-    # of bytes read during decompression.
-    # To work around that, we pass the whole buffer to Python's zlib and use
-    # the length of the remaining data to update the parser's offset.
-    parser.offset = len(parser.data) - len(decompress.unused_data)
 
+def parse_packed_object(stream):
+    object_type, size, base = stream.read_header()
+    contents = stream.inflate(size)
     name = ObjectType.to_name(object_type)
 
-    return Object(name, size, contents), base_object_id
+    return Object(name, size, contents), base
+
+
+def index_pack(f, path, workers=1):
+    """Index a pack file read from a file object, storing it as-is at `path`.
+
+    Record the offset and CRC32 of every entry in a single sequential pass,
+    then resolve deltas to compute their object IDs, using `workers` processes.
+    Return the entries and the pack checksum.
+    """
+    with open(path, 'wb') as output:
+        stream = PackStream(f, output)
+        entries = []
+
+        num_objects = stream.read_pack_header()
+        for _ in range(num_objects):
+            offset = stream.offset
+            object_type, size, base = stream.read_header()
+            data_offset = stream.offset
+            stream.inflate(size, keep=False)
+
+            entry = PackEntry(offset, object_type, size, base, data_offset, stream.crc32)
+            entries.append(entry)
+
+        checksum = stream.read_checksum()
+
+    resolve_deltas(path, entries, workers)
+
+    return entries, checksum
+
+
+class DeltaTreeResolver(object):
+    """Resolve delta trees of a pack file, given the children of every base.
+
+    Each resolver maps the pack file on its own, so that independent trees
+    can be resolved in separate processes.
+    """
+
+    def __init__(self, path, children_by_offset, children_by_id, cache_size):
+        self.data = map_file(path)
+        self.children_by_offset = children_by_offset
+        self.children_by_id = children_by_id
+        self.cache = DeltaBaseCache(cache_size)
+
+    def read_raw(self, offset):
+        return read_raw_entry(self.data, offset)
+
+    def resolve(self, roots):
+        """Compute the object ID of every entry in the trees of `roots`.
+
+        Return a list of (offset, object ID) pairs.
+        """
+        resolved = []
+        offsets = {}
+
+        # Walk depth-first, so that the base of the next entry is most likely cached.
+        stack = list(reversed(roots))
+        while stack:
+            offset = stack.pop()
+
+            object_type, contents = resolve_entry(offset, self.read_raw, offsets.get, self.cache)
+            object_id = Object(ObjectType.to_name(object_type), len(contents), contents).id
+            offsets[object_id] = offset
+            resolved.append((offset, object_id))
+
+            stack.extend(self.children_by_offset.get(offset, []))
+            stack.extend(self.children_by_id.get(object_id, []))
+
+        return resolved
+
+    def close(self):
+        self.data.close()
+
+
+# The resolver of a worker process, set up once per process by the pool.
+_resolver = None
+
+
+def init_worker(*args):
+    global _resolver
+    _resolver = DeltaTreeResolver(*args)
 
 
-def parse_delta_hunks(data, base_object):
-    parser = Parser(data)
-    base_object_length = parser.get_leb128()
-    result_object_length = parser.get_leb128()
+def resolve_delta_trees(roots):
+    return _resolver.resolve(roots)
 
-    if base_object.size != base_object_length:
-        raise FudgeException('invalid base object length')
 
-    source = base_object.contents
-    dest = bytearray()
+def resolve_deltas(path, entries, workers=1, cache_size=DELTA_BASE_CACHE_SIZE):
+    """Compute the object ID of every entry of the pack file at `path`.
 
-    while not parser.eof:
-        opcode = parser.get_u1()
+    Build the delta forest first, then resolve its independent trees in
+    batches, across `workers` processes when there is more than one.
+    Entries are resolved through a bounded delta base cache, so only the
+    delta chain being walked has to be kept in memory.
+    """
+    children_by_offset = defaultdict(list)
+    children_by_id = defaultdict(list)
+    roots = []
 
-        copy_hunk = (opcode >> 7) & 1
-        if copy_hunk:
-            copy_offset = 0
-            copy_length = 0
+    for entry in entries:
+        if entry.type == ObjectType.DELTA_OFFSET:
+            children_by_offset[entry.base].append(entry.offset)
+        elif entry.type == ObjectType.DELTA_BASE:
+            children_by_id[entry.base].append(entry.offset)
+        else:
+            roots.append(entry.offset)
+
+    batches = [roots[i:i+RESOLVE_BATCH_SIZE] for i in range(0, len(roots), RESOLVE_BATCH_SIZE)]
+    args = (path, children_by_offset, children_by_id, cache_size // max(workers, 1))
+
+    ids = {}
+    if workers > 1 and len(batches) > 1:
+        with multiprocessing.Pool(workers, initializer=init_worker, initargs=args) as pool:
+            for resolved in pool.imap_unordered(resolve_delta_trees, batches):
+                ids.update(resolved)
+    else:
+        resolver = DeltaTreeResolver(*args)
+        try:
+            for batch in batches:
+                ids.update(resolver.resolve(batch))
+        finally:
+            resolver.close()
+
+    if len(ids) != len(entries):
+        raise FudgeException('pack file contains deltas with missing bases')
+
+    for entry in entries:
+        entry.id = ids[entry.offset]
+
+
+def write_pack_index(path, entries, checksum):
+    """Write a version 2 pack index file."""
+    entries = sorted(entries, key=lambda entry: entry.id)
+
+    builder = Builder(padding=False)
+    builder.set(b'\377tOc')
+    builder.set_u4(2)
+
+    fanout = [0] * 256
+    for entry in entries:
+        fanout[int(entry.id[:2], 16)] += 1
+
+    total = 0
+    for count in fanout:
+        total += count
+        builder.set_u4(total)
+
+    for entry in entries:
+        builder.set_sha1(entry.id)
+
+    for entry in entries:
+        builder.set_u4(entry.crc32)
+
+    large_offsets = []
+    for entry in entries:
+        if entry.offset < 0x80000000:
+            builder.set_u4(entry.offset)
+        else:
+            builder.set_u4(0x80000000 | len(large_offsets))
+            large_offsets.append(entry.offset)
+
+    for offset in large_offsets:
+        builder.set_u8(offset)
+
+    builder.set_sha1(checksum)
+    builder.set_sha1(get_hash(builder.data))
+
+    write_file(path, builder.data)
+
+
+def install_pack(tmppath, basepath, entries, checksum):
+    """Move a complete pack file to `basepath`.pack and write its index next to it."""
+    # Like Git, make packs read-only: they are never modified once written.
+    os.chmod(tmppath, 0o444)
+    os.replace(tmppath, basepath + '.pack')
+
+    # The index is written last: packs are only looked up once it exists. It
+    # is renamed into place, as the same pack may already be mapped in memory.
+    write_pack_index(tmppath + '.idx', entries, checksum)
+    os.chmod(tmppath + '.idx', 0o444)
+    os.replace(tmppath + '.idx', basepath + '.idx')
+
+    invalidate_pack_directory(os.path.dirname(basepath))
+
+    return basepath + '.pack'
+
+
+def store_pack(f, workers=1):
+    """Store a pack file read from a file object as-is in the object store, along with its index."""
+    dirpath = get_pack_directory()
+    makedirs(dirpath)
+
+    fd, tmppath = tempfile.mkstemp(prefix='tmp_pack_', dir=dirpath)
+    os.close(fd)
+
+    try:
+        entries, checksum = index_pack(f, tmppath, workers)
+    except Exception:
+        os.remove(tmppath)
+        raise
+
+    basepath = os.path.join(dirpath, 'pack-{}'.format(checksum))
+    path = install_pack(tmppath, basepath, entries, checksum)
+
+    return path, len(entries)
 
-            for i in range(4):
-                if opcode & 1:
-                    copy_offset |= parser.get_u1() << (i * 8)
-                opcode >>= 1
 
-            for i in range(2):
-                if opcode & 1:
-                    copy_length |= parser.get_u1() << (i * 8)
-                opcode >>= 1
+def encode_entry_header(object_type, size):
+    """Encode the type and inflated size of a packed object."""
+    byte = (object_type << 4) | (size & 0xf)
+    size >>= 4
 
-            if not copy_length:
-                copy_length = 1 << 16
+    header = bytearray()
+    while size:
+        header.append(byte | 0x80)
+        byte = size & 0x7f
+        size >>= 7
+    header.append(byte)
 
-            copy_from_dest = opcode & 1
-            if copy_from_dest:
-                dest += dest[copy_offset:copy_offset+copy_length]
-            else:
-                dest += source[copy_offset:copy_offset+copy_length]
+    return bytes(header)
+
+
+def encode_delta_offset(distance):
+    """Encode the distance between an offset delta and its base."""
+    data = bytearray([distance & 0x7f])
+    distance >>= 7
+
+    while distance:
+        distance -= 1
+        data.append(0x80 | (distance & 0x7f))
+        distance >>= 7
+
+    return bytes(reversed(data))
+
+
+class PackWriter(object):
+    """Write a version 2 pack file, recording its entries for the pack index."""
+
+    def __init__(self, path, num_objects):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.sha1 = hashlib.sha1()
+
+        self.offset = 0
+        self.entries = []
+
+        self.write(b'PACK' + struct.pack('!II', 2, num_objects))
+
+    def write(self, data):
+        self.file.write(data)
+        self.sha1.update(data)
+        self.offset += len(data)
+
+    def add(self, object_id, object_type, contents, base_offset=None):
+        """Write an object, or a delta against the entry at `base_offset`.
+
+        Return the offset of the new entry.
+        """
+        offset = self.offset
+
+        if base_offset is None:
+            header = encode_entry_header(object_type, len(contents))
         else:
-            length = opcode & 0x7f
-            insert_data = parser.get(length)
-            dest += insert_data
+            object_type = ObjectType.DELTA_OFFSET
+            header = encode_entry_header(object_type, len(contents))
+            header += encode_delta_offset(offset - base_offset)
+
+        data = header + zlib.compress(contents)
+        self.write(data)
+
+        crc32 = zlib.crc32(data) & 0xffffffff
+        entry = PackEntry(offset, object_type, len(contents), base_offset, offset + len(header), crc32)
+        entry.id = object_id
+        self.entries.append(entry)
+
+        return offset
 
-    if len(dest) != result_object_length:
-        raise FudgeException('invalid result object length')
+    def close(self):
+        """Write the pack checksum and return it."""
+        checksum = self.sha1.digest()
+        self.file.write(checksum)
+        self.file.close()
 
-    return Object(base_object.type, result_object_length, dest)
+        return str(binascii.hexlify(checksum), 'utf-8')
 
 
 if __name__ == '__main__':
-    from fudge.utils import read_file
-    data = read_file('pack')
-    parse_pack(data)
+    with open('pack', 'rb') as f:
+        # Objects are parsed lazily: consume them without keeping them around.
+        deque(parse_pack(f), maxlen=0)
@@ -0,0 +1,689 @@
+import binascii
+import enum
+import mmap
+import os
+import struct
+import zlib
+from collections import namedtuple
+
+from fudge.delta import apply_delta, decode_size
+from fudge.parsing.parser import Parser
+from fudge.repository import get_repository
+from fudge.utils import FudgeException, LRUCache, get_hash
+
+
+CHUNK_SIZE = 64 * 1024
+HEAD_CHUNK_SIZE = 64
+DELTA_BASE_CACHE_SIZE = 32 * 1024 * 1024
+
+# A delta starts with the sizes of its base and result objects, as two
+# little endian base 128 numbers of up to 10 bytes each.
+MAX_DELTA_HEADER_SIZE = 20
+
+INDEX_MAGIC = b'\377tOc'
+INDEX_HEADER_SIZE = 8
+INDEX_FANOUT_SIZE = 256 * 4
+
+MIDX_FILENAME = 'multi-pack-index'
+MIDX_MAGIC = b'MIDX'
+MIDX_HEADER_SIZE = 12
+MIDX_CHUNK_PACK_NAMES = b'PNAM'
+MIDX_CHUNK_FANOUT = b'OIDF'
+MIDX_CHUNK_IDS = b'OIDL'
+MIDX_CHUNK_OFFSETS = b'OOFF'
+MIDX_CHUNK_LARGE_OFFSETS = b'LOFF'
+MIDX_REQUIRED_CHUNKS = (MIDX_CHUNK_PACK_NAMES, MIDX_CHUNK_FANOUT, MIDX_CHUNK_IDS, MIDX_CHUNK_OFFSETS)
+
+
+class ObjectType(enum.IntEnum):
+    COMMIT = 1
+    TREE = 2
+    BLOB = 3
+    TAG = 4
+    DELTA_OFFSET = 6
+    DELTA_BASE = 7
+
+    @classmethod
+    def exists(cls, value):
+        return any(value == item.value for item in cls)
+
+    @classmethod
+    def to_name(cls, value):
+        return ObjectType(value).name.lower()
+
+    @classmethod
+    def from_name(cls, value):
+        value = value.upper()
+        return ObjectType[value]
+
+
+def map_file(path):
+    """Memory-map a whole file for reading."""
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def prefix_to_bytes(prefix):
+    """Convert a (possibly odd-length) hexadecimal prefix to the smallest matching binary ID."""
+    if len(prefix) % 2:
+        prefix += '0'
+    return binascii.unhexlify(prefix)
+
+
+def read_entry_header(data, offset):
+    """Read the header of the pack entry starting at `offset`.
+
+    Return the object type, its inflated size, its delta base (an offset for
+    offset deltas, an object ID for ref deltas, None otherwise) and the
+    offset of its compressed data.
+    """
+    entry_offset = offset
+
+    byte = data[offset]
+    offset += 1
+    object_type = (byte >> 4) & 0x7
+    if not ObjectType.exists(object_type):
+        raise FudgeException('invalid packed object type: {}'.format(object_type))
+
+    size = byte & 0xf
+    shift = 4
+    while byte & 0x80:
+        byte = data[offset]
+        offset += 1
+        size |= (byte & 0x7f) << shift
+        shift += 7
+
+    base = None
+    if object_type == ObjectType.DELTA_OFFSET:
+        byte = data[offset]
+        offset += 1
+        distance = byte & 0x7f
+        while byte & 0x80:
+            byte = data[offset]
+            offset += 1
+            distance = ((distance + 1) << 7) | (byte & 0x7f)
+        base = entry_offset - distance
+    elif object_type == ObjectType.DELTA_BASE:
+        base = str(binascii.hexlify(data[offset:offset+20]), 'utf-8')
+        offset += 20
+
+    return object_type, size, base, offset
+
+
+def inflate(data, offset, size):
+    """Inflate the zlib stream starting at `offset` without copying the rest of the data.
+
+    Return the inflated contents and the offset right after the zlib stream.
+    """
+    view = memoryview(data)
+    decompress = zlib.decompressobj()
+    chunks = []
+
+    while not decompress.eof:
+        chunk = view[offset:offset+CHUNK_SIZE]
+        if not chunk:
+            raise FudgeException('truncated pack file')
+        chunks.append(decompress.decompress(chunk))
+        offset += len(chunk)
+
+    contents = b''.join(chunks)
+    if len(contents) != size:
+        raise FudgeException('invalid object length')
+
+    return contents, offset - len(decompress.unused_data)
+
+
+def inflate_head(data, offset, size):
+    """Inflate at most the first `size` bytes of the zlib stream starting at `offset`."""
+    view = memoryview(data)
+    decompress = zlib.decompressobj()
+    head = b''
+
+    while len(head) < size and not decompress.eof:
+        chunk = decompress.unconsumed_tail
+        if not chunk:
+            chunk = view[offset:offset+HEAD_CHUNK_SIZE]
+            if not chunk:
+                raise FudgeException('truncated pack file')
+            offset += len(chunk)
+        head += decompress.decompress(chunk, size - len(head))
+
+    return head
+
+
+def iter_inflate(chunks, max_size=CHUNK_SIZE):
+    """Inflate a zlib stream read from an iterable of compressed chunks.
+
+    Yield inflated chunks of at most `max_size` bytes, and stop at the end of
+    the zlib stream.
+    """
+    decompress = zlib.decompressobj()
+
+    for chunk in chunks:
+        while True:
+            data = decompress.decompress(chunk, max_size)
+            if data:
+                yield data
+
+            chunk = decompress.unconsumed_tail
+            if decompress.eof or (not chunk and len(data) < max_size):
+                break
+
+        if decompress.eof:
+            return
+
+    raise FudgeException('truncated zlib stream')
+
+
+def read_raw_entry(data, offset):
+    """Read the pack entry starting at `offset` without resolving it.
+
+    Return the entry type, its delta base and its inflated data.
+    """
+    object_type, size, base, data_offset = read_entry_header(data, offset)
+    contents, _ = inflate(data, data_offset, size)
+    return object_type, base, contents
+
+
+class ObjectIDTable(object):
+    """A memory-mapped table of sorted binary object IDs, narrowed down by a fan-out table.
+
+    Subclasses set `data`, `fanout`, `num_objects` and `ids_offset`.
+    """
+
+    def __len__(self):
+        return self.num_objects
+
+    def __iter__(self):
+        for position in range(self.num_objects):
+            yield self.get_id(position)
+
+    def get_binary_id(self, position):
+        start = self.ids_offset + 20 * position
+        return self.data[start:start+20]
+
+    def get_id(self, position):
+        return str(binascii.hexlify(self.get_binary_id(position)), 'utf-8')
+
+    def bisect(self, object_id):
+        """Return the position of the first object whose ID is not lower than `object_id`."""
+        key = prefix_to_bytes(object_id)
+
+        first_byte = key[0]
+        low = self.fanout[first_byte - 1] if first_byte > 0 else 0
+        high = self.fanout[first_byte]
+
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_binary_id(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def find(self, object_id):
+        """Return the position of the first object whose ID starts with `object_id`."""
+        position = self.bisect(object_id)
+        if position < self.num_objects and self.get_id(position).startswith(object_id):
+            return position
+
+        return None
+
+
+class PackIndex(ObjectIDTable):
+    """A version 2 pack index (`.idx`) file.
+
+    The file is memory-mapped and object IDs are found with a binary search
+    over the sorted SHA-1 table, narrowed down by the fan-out table.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = map_file(path)
+
+        if self.data[:4] != INDEX_MAGIC:
+            raise FudgeException('invalid pack index file magic')
+
+        version = struct.unpack_from('!I', self.data, 4)[0]
+        if version != 2:
+            raise FudgeException('unsupported pack index file version: {}'.format(version))
+
+        self.fanout = struct.unpack_from('!256I', self.data, INDEX_HEADER_SIZE)
+        self.num_objects = self.fanout[-1]
+
+        self.ids_offset = INDEX_HEADER_SIZE + INDEX_FANOUT_SIZE
+        self.crcs_offset = self.ids_offset + 20 * self.num_objects
+        self.offsets_offset = self.crcs_offset + 4 * self.num_objects
+        self.large_offsets_offset = self.offsets_offset + 4 * self.num_objects
+
+    @property
+    def pack_checksum(self):
+        start = len(self.data) - 40
+        return str(binascii.hexlify(self.data[start:start+20]), 'utf-8')
+
+    def get_crc32(self, position):
+        return struct.unpack_from('!I', self.data, self.crcs_offset + 4 * position)[0]
+
+    def get_offset(self, position):
+        offset = struct.unpack_from('!I', self.data, self.offsets_offset + 4 * position)[0]
+        if offset & 0x80000000:
+            large_position = offset & 0x7fffffff
+            start = self.large_offsets_offset + 8 * large_position
+            offset = struct.unpack_from('!Q', self.data, start)[0]
+        return offset
+
+
+class MultiPackIndex(ObjectIDTable):
+    """A version 1 multi-pack-index file.
+
+    It holds a single sorted SHA-1 table for the objects of several packs,
+    along with the pack and the offset of each object, so that lookups do
+    not depend on the number of packs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = map_file(path)
+
+        if self.data[:4] != MIDX_MAGIC:
+            raise FudgeException('invalid multi-pack-index file magic')
+
+        version, hash_version, num_chunks, num_base_files, num_packs = struct.unpack_from(
+            '!BBBBI', self.data, 4)
+        if version != 1:
+            raise FudgeException('unsupported multi-pack-index file version: {}'.format(version))
+        if hash_version != 1:
+            raise FudgeException('unsupported multi-pack-index hash version: {}'.format(hash_version))
+        if num_base_files:
+            raise FudgeException('incremental multi-pack-index files are not supported')
+
+        # The lookup table ends with an extra row holding the end of the last chunk.
+        rows = [struct.unpack_from('!4sQ', self.data, MIDX_HEADER_SIZE + 12 * i)
+                for i in range(num_chunks + 1)]
+        self.chunks = {chunk_id: (offset, rows[i + 1][1])
+                       for i, (chunk_id, offset) in enumerate(rows[:-1])}
+
+        for chunk_id in MIDX_REQUIRED_CHUNKS:
+            if chunk_id not in self.chunks:
+                raise FudgeException('multi-pack-index file is missing the {} chunk'.format(
+                    str(chunk_id, 'utf-8')))
+
+        # Pack names may be followed by zero bytes, for alignment.
+        start, end = self.chunks[MIDX_CHUNK_PACK_NAMES]
+        names = bytes(self.data[start:end]).split(b'\0')
+        self.pack_names = [str(name, 'utf-8') for name in names if name]
+        if len(self.pack_names) != num_packs:
+            raise FudgeException('invalid multi-pack-index pack names')
+
+        self.fanout = struct.unpack_from('!256I', self.data, self.chunks[MIDX_CHUNK_FANOUT][0])
+        self.num_objects = self.fanout[-1]
+
+        self.ids_offset = self.chunks[MIDX_CHUNK_IDS][0]
+        self.offsets_offset = self.chunks[MIDX_CHUNK_OFFSETS][0]
+        self.large_offsets_offset = self.chunks.get(MIDX_CHUNK_LARGE_OFFSETS, (None, None))[0]
+
+        # The covered packs, in the order of their names, once they are opened.
+        self.packs = None
+
+    @property
+    def checksum(self):
+        return str(binascii.hexlify(self.data[-20:]), 'utf-8')
+
+    def get_location(self, position):
+        """Return the number of the pack containing an object, and the object's offset in it."""
+        pack_number, offset = struct.unpack_from('!II', self.data, self.offsets_offset + 8 * position)
+        if offset & 0x80000000:
+            if self.large_offsets_offset is None:
+                raise FudgeException('multi-pack-index file is missing the LOFF chunk')
+            start = self.large_offsets_offset + 8 * (offset & 0x7fffffff)
+            offset = struct.unpack_from('!Q', self.data, start)[0]
+        return pack_number, offset
+
+
+class Pack(object):
+    """A version 2 pack file and its index."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index = PackIndex(os.path.splitext(path)[0] + '.idx')
+        self.data = map_file(path)
+        self.cache = DeltaBaseCache()
+
+        parser = Parser(self.data[:12])
+        if parser.get(4) != b'PACK':
+            raise FudgeException('invalid pack file')
+
+        version = parser.get_u4()
+        if version != 2:
+            raise FudgeException('unsupported pack file version: {}'.format(version))
+
+        num_objects = parser.get_u4()
+        if num_objects != len(self.index):
+            raise FudgeException('pack file and pack index file do not match')
+
+    @property
+    def checksum(self):
+        return str(binascii.hexlify(self.data[-20:]), 'utf-8')
+
+    def verify(self):
+        """Check the pack checksums, and that every object hashes to its ID."""
+        if get_hash(memoryview(self.data)[:-20]) != self.checksum:
+            raise FudgeException('bad pack file checksum')
+
+        index_data = self.index.data
+        if get_hash(memoryview(index_data)[:-20]) != str(binascii.hexlify(index_data[-20:]), 'utf-8'):
+            raise FudgeException('bad pack index file checksum')
+
+        if self.index.pack_checksum != self.checksum:
+            raise FudgeException('pack file and pack index file do not match')
+
+        for position, object_id in enumerate(self.index):
+            type_, contents = self.read(self.index.get_offset(position))
+
+            header = bytes('{} {}\0'.format(type_, len(contents)), 'utf-8')
+            if get_hash(header + contents) != object_id:
+                raise FudgeException('packed object {} is corrupt'.format(object_id))
+
+    def find_offset(self, object_id):
+        position = self.index.find(object_id)
+        if position is None:
+            return None
+        return self.index.get_offset(position)
+
+    def read_raw(self, offset):
+        return read_raw_entry(self.data, offset)
+
+    def read(self, offset):
+        """Read an object, resolving delta chains iteratively.
+
+        Return the object type and its contents.
+        """
+        object_type, contents = resolve_entry(offset, self.read_raw, self.find_offset, self.cache)
+        return ObjectType.to_name(object_type), contents
+
+    def iter_contents(self, offset):
+        """Yield the contents of an object in chunks.
+
+        Entries that are not deltas are inflated as they are read, while
+        deltas are resolved in memory first.
+        """
+        object_type, size, base, data_offset = read_entry_header(self.data, offset)
+        if base is not None:
+            yield self.read(offset)[1]
+            return
+
+        view = memoryview(self.data)
+        chunks = (view[start:start+CHUNK_SIZE] for start in range(data_offset, len(view), CHUNK_SIZE))
+
+        total = 0
+        for data in iter_inflate(chunks):
+            total += len(data)
+            yield data
+
+        if total != size:
+            raise FudgeException('invalid object length')
+
+    def read_info(self, offset):
+        """Read an object's type and size, only inflating the header of a delta.
+
+        The type of a delta is found by following its chain of entry headers.
+        Return the object type and its size.
+        """
+        object_type, size, base, data_offset = read_entry_header(self.data, offset)
+        if base is not None:
+            head = inflate_head(self.data, data_offset, MAX_DELTA_HEADER_SIZE)
+            _, position = decode_size(head, 0)
+            size, _ = decode_size(head, position)
+
+        while base is not None:
+            if object_type == ObjectType.DELTA_BASE:
+                offset = self.find_offset(base)
+                if offset is None:
+                    raise FudgeException('delta base {} is not in the pack'.format(base))
+            else:
+                offset = base
+            object_type, _, base, _ = read_entry_header(self.data, offset)
+
+        return ObjectType.to_name(object_type), size
+
+
+class DeltaBaseCache(LRUCache):
+    """A least recently used cache of resolved pack entries, keyed by pack offset.
+
+    The cache is bounded by the total size of the cached contents, so that
+    resolving delta chains does not make memory grow with the pack size.
+    """
+
+    def __init__(self, max_size=DELTA_BASE_CACHE_SIZE):
+        super().__init__(max_size)
+
+    def put(self, offset, object_type, contents):
+        super().put(offset, (object_type, contents), len(contents))
+
+
+def resolve_entry(offset, read_raw, find_offset, cache):
+    """Resolve the pack entry at `offset` without recursion.
+
+    Walk down the delta chain until an entry is found in the cache or a
+    non-delta entry is reached, then apply the deltas back up, caching
+    every intermediate result.
+    `read_raw` reads an entry's type, delta base and inflated data at an
+    offset, and `find_offset` returns the offset of a ref delta's base.
+    Return the object type and its contents.
+    """
+    deltas = []
+
+    while True:
+        cached = cache.get(offset)
+        if cached is not None:
+            object_type, contents = cached
+            break
+
+        object_type, base, data = read_raw(offset)
+        if object_type == ObjectType.DELTA_OFFSET:
+            deltas.append((offset, data))
+            offset = base
+        elif object_type == ObjectType.DELTA_BASE:
+            deltas.append((offset, data))
+            offset = find_offset(base)
+            if offset is None:
+                raise FudgeException('delta base {} is not in the pack'.format(base))
+        else:
+            contents = data
+            cache.put(offset, object_type, contents)
+            break
+
+    for delta_offset, delta in reversed(deltas):
+        contents = apply_delta(contents, delta)
+        cache.put(delta_offset, object_type, contents)
+
+    return object_type, contents
+
+
+def get_pack_directory():
+    return get_repository().pack_path
+
+
+def get_pack_directories():
+    """Return the pack directory of the current repository, then those of its alternates."""
+    repository = get_repository()
+    return [repository.pack_path] + [os.path.join(path, 'pack') for path in repository.alternates]
+
+
+PackDirectory = namedtuple('PackDirectory', ['packs', 'multi_pack_index', 'other_packs'])
+
+
+# Opened packs and multi-pack-index, keyed by pack directory. Each entry
+# holds the directory's modification time when it was last listed, so new
+# packs are picked up without listing the directory on every lookup.
+_packs = {}
+
+
+def invalidate_pack_directory(dirpath):
+    """Forget the cached packs and multi-pack-index of a pack directory.
+
+    The cache is revalidated by the directory's modification time, which may
+    not change within a clock tick: functions adding or removing files in a
+    pack directory must call this once they are done.
+    """
+    _packs.pop(dirpath, None)
+
+
+def load_pack_directory(dirpath=None):
+    """Return the packs of a pack directory and its multi-pack-index.
+
+    The pack directory of the current repository is loaded by default.
+    The multi-pack-index is ignored if one of the packs it covers is missing.
+    `other_packs` are the packs it does not cover, or all packs without one.
+    """
+    dirpath = dirpath or get_pack_directory()
+    if not os.path.exists(dirpath):
+        return PackDirectory([], None, [])
+
+    mtime = os.stat(dirpath).st_mtime_ns
+    cached = _packs.get(dirpath)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    opened = {pack.path: pack for pack in cached[1].packs} if cached else {}
+
+    packs = []
+    for filename in sorted(os.listdir(dirpath)):
+        if not filename.endswith('.pack'):
+            continue
+
+        path = os.path.join(dirpath, filename)
+        if not os.path.exists(os.path.splitext(path)[0] + '.idx'):
+            continue
+
+        pack = opened.get(path) or Pack(path)
+        packs.append(pack)
+
+    multi_pack_index = None
+    other_packs = packs
+
+    path = os.path.join(dirpath, MIDX_FILENAME)
+    if os.path.exists(path):
+        packs_by_name = {os.path.basename(pack.index.path): pack for pack in packs}
+
+        multi_pack_index = MultiPackIndex(path)
+        if all(name in packs_by_name for name in multi_pack_index.pack_names):
+            multi_pack_index.packs = [packs_by_name[name] for name in multi_pack_index.pack_names]
+            covered = set(multi_pack_index.pack_names)
+            other_packs = [pack for pack in packs
+                           if os.path.basename(pack.index.path) not in covered]
+        else:
+            multi_pack_index = None
+
+    directory = PackDirectory(packs, multi_pack_index, other_packs)
+    _packs[dirpath] = (mtime, directory)
+    return directory
+
+
+def get_packs():
+    """Return the packs of the current repository, without those of its alternates."""
+    return load_pack_directory().packs
+
+
+def get_object_id_tables():
+    """Return the tables listing the IDs of all packed objects, including those of alternates.
+
+    Packs of a directory do not overlap, but alternates may store the same objects.
+    """
+    tables = []
+    for dirpath in get_pack_directories():
+        directory = load_pack_directory(dirpath)
+        if directory.multi_pack_index:
+            tables.append(directory.multi_pack_index)
+        tables.extend(pack.index for pack in directory.other_packs)
+
+    return tables
+
+
+def remove_pack(pack):
+    """Remove a pack file, its index and its bitmap index if any.
+
+    A multi-pack-index covering the pack is removed first, as it would be
+    ignored once the pack is missing.
+    """
+    dirpath = os.path.dirname(pack.path)
+    midx_path = os.path.join(dirpath, MIDX_FILENAME)
+    if os.path.exists(midx_path):
+        if os.path.basename(pack.index.path) in MultiPackIndex(midx_path).pack_names:
+            os.remove(midx_path)
+
+    bitmap_path = os.path.splitext(pack.path)[0] + '.bitmap'
+    if os.path.exists(bitmap_path):
+        os.remove(bitmap_path)
+
+    os.remove(pack.index.path)
+    os.remove(pack.path)
+
+    invalidate_pack_directory(dirpath)
+
+
+def find_packed_entry(object_id, dirpaths=None):
+    """Find the first packed object whose ID starts with `object_id`.
+
+    The pack directories, by default those of the current repository and
+    its alternates, are searched in order. In each of them, the
+    multi-pack-index is searched first, then the packs it does not cover.
+    Return the full object ID, the pack containing the object and the
+    object's offset in that pack, or None if no pack contains the object.
+    """
+    for dirpath in dirpaths or get_pack_directories():
+        directory = load_pack_directory(dirpath)
+
+        multi_pack_index = directory.multi_pack_index
+        if multi_pack_index:
+            position = multi_pack_index.find(object_id)
+            if position is not None:
+                pack_number, offset = multi_pack_index.get_location(position)
+                pack = multi_pack_index.packs[pack_number]
+                return multi_pack_index.get_id(position), pack, offset
+
+        for pack in directory.other_packs:
+            position = pack.index.find(object_id)
+            if position is not None:
+                return pack.index.get_id(position), pack, pack.index.get_offset(position)
+
+    return None
+
+
+def find_packed_object(object_id):
+    """Return the pack containing an object and the object's offset in that pack."""
+    found = find_packed_entry(object_id)
+    if not found:
+        return None
+
+    _, pack, offset = found
+    return pack, offset
+
+
+def read_packed_object(object_id):
+    """Read an object from the packs of the current repository and its alternates.
+
+    Return the object type and its contents, or None if no pack contains the object.
+    """
+    found = find_packed_object(object_id)
+    if not found:
+        return None
+
+    pack, offset = found
+    return pack.read(offset)
+
+
+def read_packed_object_info(object_id):
+    """Read the type and size of an object from the packs of the current repository.
+
+    Packs of alternates are searched too. Return the full object ID, the
+    object type and its size, or None if no pack contains the object.
+    """
+    found = find_packed_entry(object_id)
+    if not found:
+        return None
+
+    full_id, pack, offset = found
+    type_, size = pack.read_info(offset)
+    return full_id, type_, size
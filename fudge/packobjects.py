@@ -0,0 +1,320 @@
+import binascii
+import hashlib
+import os
+import struct
+import tempfile
+from collections import deque
+
+from fudge.bitmap import (BITMAP_MAGIC, BITMAP_OPT_FULL_DAG, TYPE_ORDER, Bitmap, encode_ewah,
+                          get_bitmap_index, get_bitmap_path)
+from fudge.commit import read_commit
+from fudge.config import get_config_path, get_config_value, parse_size
+from fudge.delta import create_delta
+from fudge.object import get_object_path, iter_loose_object_ids, load_object, object_info
+from fudge.pack import PackWriter, install_pack
+from fudge.packfile import (ObjectType, Pack, find_packed_entry, get_pack_directory, get_packs,
+                            remove_pack)
+from fudge.repository import get_repository
+from fudge.revlist import (fill_reachable, get_tips, iter_reachable_object_ids,
+                           iter_reachable_objects)
+from fudge.utils import FudgeException, makedirs
+
+
+DEFAULT_WINDOW = 10
+DEFAULT_DEPTH = 50
+
+# One commit out of this many gets a bitmap, in addition to every tip.
+BITMAP_COMMIT_INTERVAL = 100
+
+# Objects larger than this are stored whole. Git defaults to 512 MiB, but
+# deltas are computed in Python here, at a few MB/s for unrelated objects.
+DEFAULT_BIG_FILE_THRESHOLD = 16 * 1024 * 1024
+
+
+class ObjectToPack(object):
+    def __init__(self, object_id, object_type, size, name_hash):
+        self.id = object_id
+        self.type = object_type
+        self.size = size
+        self.name_hash = name_hash
+
+        self.offset = None
+        self.depth = 0
+
+
+def name_hash(name):
+    """Hash a path, mostly from its last characters.
+
+    Files with the same name or extension get close hashes, so that sorting
+    by hash puts them next to each other.
+    """
+    value = 0
+    for byte in bytes(name, 'utf-8'):
+        if chr(byte).isspace():
+            continue
+        value = ((value >> 2) + (byte << 24)) & 0xffffffff
+    return value
+
+
+def find_delta(obj, contents, window, max_depth):
+    """Find the smallest delta for an object against the objects of the window.
+
+    Return the delta base and the delta, or None and None.
+    """
+    best_base, best_delta = None, None
+    max_size = obj.size // 2 - 20
+
+    for base, base_contents in reversed(window):
+        if base.type != obj.type or base.depth >= max_depth:
+            continue
+
+        # A much smaller base cannot give a small delta.
+        if base.size < obj.size // 32:
+            continue
+
+        limit = len(best_delta) - 1 if best_delta else max_size
+        if limit <= 0:
+            break
+
+        delta = create_delta(base_contents, contents, limit)
+        if delta is not None:
+            best_base, best_delta = base, delta
+
+    return best_base, best_delta
+
+
+def get_big_file_threshold():
+    """Return the size above which objects are not deltified, from `core.bigFileThreshold`."""
+    if not os.path.exists(get_config_path()):
+        return DEFAULT_BIG_FILE_THRESHOLD
+
+    value = get_config_value('core', 'bigFileThreshold')
+    return parse_size(value) if value else DEFAULT_BIG_FILE_THRESHOLD
+
+
+def pack_objects(objects, basepath, window=DEFAULT_WINDOW, depth=DEFAULT_DEPTH,
+                 big_file_threshold=None):
+    """Write objects to a new pack file named `<basepath>-<checksum>.pack`, and its index.
+
+    `objects` yields object IDs and the paths they were found at. Objects
+    are sorted by type, path hash and decreasing size to bring similar
+    objects together, then each object is compared to the `window` objects
+    before it to find a delta base, with delta chains of at most `depth`.
+    Objects larger than `big_file_threshold` are neither deltified nor used
+    as delta bases.
+    Return the path to the pack file and the number of packed objects.
+    """
+    if big_file_threshold is None:
+        big_file_threshold = get_big_file_threshold()
+
+    to_pack = {}
+    for object_id, name in objects:
+        if object_id in to_pack:
+            continue
+
+        # Only the header of each object is read: contents are loaded once, when written.
+        info = object_info(object_id)
+        object_type = ObjectType.from_name(info.type)
+        to_pack[object_id] = ObjectToPack(object_id, object_type, info.size, name_hash(name))
+
+    to_pack = sorted(to_pack.values(), key=lambda obj: (obj.type, obj.name_hash, -obj.size))
+
+    fd, tmppath = tempfile.mkstemp(prefix='tmp_pack_', dir=os.path.dirname(basepath) or '.')
+    os.close(fd)
+
+    writer = PackWriter(tmppath, len(to_pack))
+    candidates = deque(maxlen=window)
+
+    try:
+        for obj in to_pack:
+            contents = load_object(obj.id).contents
+
+            if obj.size > big_file_threshold:
+                obj.offset = writer.add(obj.id, obj.type, contents)
+                continue
+
+            base, delta = find_delta(obj, contents, candidates, depth)
+            if delta is None:
+                obj.offset = writer.add(obj.id, obj.type, contents)
+            else:
+                obj.offset = writer.add(obj.id, obj.type, delta, base.offset)
+                obj.depth = base.depth + 1
+
+            candidates.append((obj, contents))
+
+        checksum = writer.close()
+    except Exception:
+        writer.file.close()
+        os.remove(tmppath)
+        raise
+
+    basepath = '{}-{}'.format(basepath, checksum)
+    path = install_pack(tmppath, basepath, writer.entries, checksum)
+
+    return path, len(to_pack)
+
+
+def is_local_object(object_id):
+    """Return whether an object is stored by the current repository, not only by its alternates."""
+    if os.path.exists(get_object_path(object_id)):
+        return True
+    return find_packed_entry(object_id, [get_pack_directory()]) is not None
+
+
+def iter_all_objects(packs):
+    """Yield every object of the repository, reachable objects first, with their paths.
+
+    Objects borrowed from alternates are left out, as in `git gc`. If a pack
+    has a bitmap index, reachable objects are listed from it rather than by
+    walking the whole history, and have no path.
+    """
+    seen = set()
+    has_alternates = bool(get_repository().alternates)
+
+    tips = get_tips()
+    if get_bitmap_index() is None:
+        reachable = iter_reachable_objects(tips)
+    else:
+        reachable = ((object_id, '') for object_id in iter_reachable_object_ids(tips))
+
+    for object_id, name in reachable:
+        seen.add(object_id)
+        if not has_alternates or is_local_object(object_id):
+            yield object_id, name
+
+    for object_id in iter_loose_object_ids():
+        if object_id not in seen:
+            seen.add(object_id)
+            yield object_id, ''
+
+    for pack in packs:
+        for object_id in pack.index:
+            if object_id not in seen:
+                seen.add(object_id)
+                yield object_id, ''
+
+
+def get_write_bitmaps():
+    """Return whether `repack` writes a bitmap index, from `repack.writeBitmaps` as in Git."""
+    if not os.path.exists(get_config_path()):
+        return False
+
+    value = get_config_value('repack', 'writeBitmaps') or 'false'
+    return value.lower() in ('true', 'yes', 'on', '1')
+
+
+def select_commits(tips):
+    """Select the commits that get a bitmap.
+
+    Every tip gets one, then one commit every `BITMAP_COMMIT_INTERVAL`.
+    Return them with the oldest first, so that the bitmaps of older commits
+    can be reused to build the bitmaps of newer ones.
+    """
+    selected = []
+    seen = set()
+    tip_ids = set(tips)
+    commits = list(reversed(tips))
+    while commits:
+        commit_id = commits.pop()
+        if commit_id in seen:
+            continue
+        seen.add(commit_id)
+
+        if commit_id in tip_ids or len(seen) % BITMAP_COMMIT_INTERVAL == 0:
+            selected.append(commit_id)
+
+        commits.extend(read_commit(commit_id).parents)
+
+    return list(reversed(selected))
+
+
+def write_bitmap_index(pack, tips):
+    """Write a bitmap index for `pack`, with bitmaps for the commits reachable from `tips`.
+
+    Every object reachable from the tips must be in the pack.
+    Return the path to the bitmap index and the number of bitmaps.
+    """
+    index = pack.index
+
+    # Bitmap positions follow the order of objects in the pack.
+    pack_order = sorted(range(len(index)), key=index.get_offset)
+    positions = {index.get_id(index_position): position
+                 for position, index_position in enumerate(pack_order)}
+
+    type_bitmaps = {object_type: Bitmap() for object_type in TYPE_ORDER}
+    for position, index_position in enumerate(pack_order):
+        object_type, _ = pack.read_info(index.get_offset(index_position))
+        type_bitmaps[object_type].add(position)
+
+    # Refs may point to other objects, such as tags.
+    tips = [object_id for object_id in tips
+            if object_id in positions and positions[object_id] in type_bitmaps['commit']]
+
+    bitmaps = {}
+    for commit_id in select_commits(tips):
+        bitmap = Bitmap()
+        others = set()
+        fill_reachable([commit_id], bitmap, others, positions.get, bitmaps.get)
+        if others:
+            raise FudgeException('object {} is not in the pack'.format(others.pop()))
+        bitmaps[commit_id] = bitmap
+
+    data = [BITMAP_MAGIC, struct.pack('!HHI', 1, BITMAP_OPT_FULL_DAG, len(bitmaps)),
+            binascii.unhexlify(pack.checksum)]
+    data.extend(encode_ewah(type_bitmaps[object_type]) for object_type in TYPE_ORDER)
+
+    for commit_id, bitmap in bitmaps.items():
+        # Bitmaps are not XORed with previous ones, and no flag is set.
+        data.append(struct.pack('!IBB', index.find(commit_id), 0, 0))
+        data.append(encode_ewah(bitmap))
+
+    data = b''.join(data)
+    data += hashlib.sha1(data).digest()
+
+    # The file is renamed into place, as it may already exist for this pack.
+    path = get_bitmap_path(pack)
+    fd, tmppath = tempfile.mkstemp(prefix='tmp_bitmap_', dir=os.path.dirname(path))
+    with open(fd, 'wb') as f:
+        f.write(data)
+
+    os.chmod(tmppath, 0o444)
+    os.replace(tmppath, path)
+
+    return path, len(bitmaps)
+
+
+def repack(window=DEFAULT_WINDOW, depth=DEFAULT_DEPTH, delete=False, write_bitmap=None):
+    """Pack every object of the repository into a single new pack.
+
+    When `delete` is True, the new pack is verified, then the packs that
+    existed before are removed. When `write_bitmap` is True, or None and
+    enabled in the configuration, a bitmap index is written for the new pack,
+    unless the repository has alternates: bitmaps can only cover objects of
+    the pack.
+    Return the path to the new pack file and the number of packed objects.
+    """
+    if write_bitmap is None:
+        write_bitmap = get_write_bitmaps()
+
+    packs = get_packs()
+
+    objects = list(iter_all_objects(packs))
+    if not objects:
+        return None, 0
+
+    dirpath = get_pack_directory()
+    makedirs(dirpath)
+
+    path, num_objects = pack_objects(objects, os.path.join(dirpath, 'pack'), window, depth)
+
+    if delete:
+        Pack(path).verify()
+
+        for pack in packs:
+            if pack.path != path:
+                remove_pack(pack)
+
+    if write_bitmap and not get_repository().alternates:
+        write_bitmap_index(Pack(path), get_tips())
+
+    return path, num_objects
@@ -1,4 +1,5 @@
 import string
+from contextlib import contextmanager
 
 import requests
 
@@ -56,7 +57,15 @@ def discover_refs(repo_url, service):
     return head_object_id
 
 
-def upload_pack(repo_url):
+@contextmanager
+def upload_pack(repo_url, haves=()):
+    """Request a pack file with the objects reachable from the remote HEAD.
+
+    Objects reachable from the `haves` commits are not sent, if the server
+    has them too. Used as a context manager, giving the pack file as a
+    stream and the ID of the remote HEAD. The connection is closed when
+    leaving the block, so the pack file must be read within it.
+    """
     repo_url = repo_url.rstrip('/')
     service = 'git-upload-pack'
 
@@ -65,6 +74,8 @@ def upload_pack(repo_url):
     command = 'want {}'.format(head_object_id)
     request = pkt_line(command)
     request += pkt_line()
+    for object_id in haves:
+        request += pkt_line('have {}'.format(object_id))
     request += pkt_line('done')
 
     url = '{}/{}'.format(repo_url, service)
@@ -72,22 +83,27 @@ def upload_pack(repo_url):
         'Content-Type': 'application/x-{}-request'.format(service),
         'User-Agent': 'fudge/{}'.format(__version__)
     }
-    response = requests.post(url, headers=headers, data=request)
-    if response.status_code not in (200, 304):
-        raise FudgeException('repository {} does not exist'.format(repo_url))
+    response = requests.post(url, headers=headers, data=request, stream=True)
+    try:
+        if response.status_code not in (200, 304):
+            raise FudgeException('repository {} does not exist'.format(repo_url))
 
-    content_type = response.headers.get('Content-Type')
-    if content_type != 'application/x-{}-result'.format(service):
-        raise FudgeException('invalid response Content-Type: {}'.format(content_type))
+        content_type = response.headers.get('Content-Type')
+        if content_type != 'application/x-{}-result'.format(service):
+            raise FudgeException('invalid response Content-Type: {}'.format(content_type))
 
-    lines = iter(response.content.split(b'\n', 1))
-    status = parse_pkt_line(next(lines))
-    if status != b'NAK':
-        raise FudgeException('could not retrieve the requested pack file')
+        # Hand the pack file over as a stream, so it never has to fit in memory.
+        pack = response.raw
+        pack.decode_content = True
 
-    pack = next(lines)
+        # Without multi_ack, the server acknowledges the first common commit, if any.
+        status = read_pkt_line(pack)
+        if status != b'NAK\n' and not status.startswith(b'ACK '):
+            raise FudgeException('could not retrieve the requested pack file')
 
-    return pack, head_object_id
+        yield pack, head_object_id
+    finally:
+        response.close()
 
 
 def pkt_line(command=None):
@@ -98,6 +114,14 @@ def pkt_line(command=None):
     return '{}{}\n'.format(length, command)
 
 
+def read_pkt_line(f):
+    """Read a single pkt-line from a file object."""
+    length = int(f.read(4), 16)
+    if length == 0:
+        return b''
+    return f.read(length - 4)
+
+
 def parse_pkt_line(line):
     """Parse a pkt-line."""
     length, data = line[:4], line[4:]
@@ -1,18 +1,16 @@
 import os
 
-from fudge.object import load_object
-from fudge.repository import get_repository_path
+from fudge.object import object_info, sync_objects
+from fudge.repository import get_repository
 from fudge.utils import FudgeException, read_file, write_file
 
 
 def get_symbolic_ref_path():
-    basedir = get_repository_path()
-    return os.path.join(basedir, 'HEAD')
+    return get_repository().head_path
 
 
 def get_ref_path(ref):
-    basedir = get_repository_path()
-    return os.path.join(basedir, ref)
+    return os.path.join(get_repository().path, ref)
 
 
 def valid_ref(ref):
@@ -22,6 +20,23 @@ def valid_ref(ref):
         and not any(char in ref for char in blacklist)
 
 
+def iter_refs(basedir=None):
+    """Yield the name and object ID of every ref under `refs/`.
+
+    The refs of the current repository are read by default.
+    """
+    basedir = basedir or get_repository().path
+    refsdir = os.path.join(basedir, 'refs')
+
+    for dirpath, dirnames, filenames in os.walk(refsdir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            ref = os.path.relpath(path, basedir).replace(os.sep, '/')
+            if valid_ref(ref):
+                yield ref, read_file(path, mode='r').rstrip()
+
+
 def read_symbolic_ref(short=False):
     path = get_symbolic_ref_path()
     if not os.path.exists(path):
@@ -74,9 +89,11 @@ def write_ref(ref, object_id):
     elif not valid_ref(ref):
         raise FudgeException('invalid ref')
 
-    obj = load_object(object_id)
-    if obj.type != 'commit':
+    if object_info(object_id).type != 'commit':
         raise FudgeException('the specified object is not a commit')
 
+    # Objects must be on disk before a ref points to them.
+    sync_objects()
+
     path = get_ref_path(ref)
     write_file(path, '{}\n'.format(object_id), mode='w')
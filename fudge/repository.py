@@ -1,10 +1,86 @@
 import os
 
-from fudge.utils import FudgeException, makedirs, write_file
+from fudge.utils import FudgeException, makedirs, read_file, write_file
 
 
-def find_repository_path():
-    current = os.getcwd()
+# Like in Git, alternates of alternates are followed, up to this depth.
+MAX_ALTERNATE_DEPTH = 5
+
+
+class Repository(object):
+    """A repository and the paths to its parts, computed once."""
+
+    def __init__(self, path):
+        self.path = path
+        self.working_tree_path = os.path.dirname(path)
+
+        self.objects_path = os.path.join(path, 'objects')
+        self.pack_path = os.path.join(self.objects_path, 'pack')
+        self.index_path = os.path.join(path, 'index')
+        self.head_path = os.path.join(path, 'HEAD')
+        self.alternates_path = os.path.join(self.objects_path, 'info', 'alternates')
+
+        self._alternates = None
+
+    def __repr__(self):
+        return 'Repository(path={!r})'.format(self.path)
+
+    @property
+    def alternates(self):
+        """The object directories this repository borrows objects from, read once."""
+        if self._alternates is None:
+            self._alternates = find_alternates(self.objects_path)
+        return self._alternates
+
+
+def read_alternates(objects_path):
+    """Return the object directories listed in the `info/alternates` file of an object directory.
+
+    Relative paths are relative to the object directory.
+    """
+    path = os.path.join(objects_path, 'info', 'alternates')
+    if not os.path.exists(path):
+        return []
+
+    alternates = []
+    for line in read_file(path, mode='r').splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            alternates.append(os.path.normpath(os.path.join(objects_path, line)))
+
+    return alternates
+
+
+def find_alternates(objects_path):
+    """Return the alternate object directories of an object directory, and of its alternates."""
+    found = []
+    seen = {os.path.realpath(objects_path)}
+
+    current = [objects_path]
+    for _ in range(MAX_ALTERNATE_DEPTH):
+        following = []
+        for path in current:
+            for alternate in read_alternates(path):
+                realpath = os.path.realpath(alternate)
+                if realpath in seen or not os.path.isdir(alternate):
+                    continue
+                seen.add(realpath)
+
+                found.append(alternate)
+                following.append(alternate)
+
+        current = following
+
+    return found
+
+
+# Repositories found so far, keyed by the directory they were looked up from,
+# so that the directory tree is only walked up once per directory.
+_repositories = {}
+
+
+def find_repository_path(current=None):
+    current = current or os.getcwd()
     while True:
         path = os.path.join(current, '.fudge')
         if os.path.exists(path):
@@ -18,18 +94,27 @@ def find_repository_path():
     return None
 
 
-def get_repository_path():
-    repo = find_repository_path()
+def get_repository():
+    """Return the repository containing the current directory."""
+    cwd = os.getcwd()
 
-    if not repo:
-        raise FudgeException('repository not found')
+    repository = _repositories.get(cwd)
+    if repository is None:
+        path = find_repository_path(cwd)
+        if not path:
+            raise FudgeException('repository not found')
 
-    return repo
+        repository = _repositories[cwd] = Repository(path)
+
+    return repository
+
+
+def get_repository_path():
+    return get_repository().path
 
 
 def get_working_tree_path():
-    repo = get_repository_path()
-    return os.path.dirname(repo)
+    return get_repository().working_tree_path
 
 
 def create_repository(basedir=None):
@@ -41,6 +126,9 @@ def create_repository(basedir=None):
     basedir = os.path.join(basedir, '.fudge')
     reinit = os.path.exists(basedir)
 
+    # The new repository may be closer to a known directory than the one found before.
+    _repositories.clear()
+
     subdirs = ['objects', 'refs/heads']
 
     for subdir in subdirs:
@@ -52,3 +140,19 @@ def create_repository(basedir=None):
         write_file(path, 'ref: refs/heads/master\n', mode='w')
 
     return basedir, reinit
+
+
+def add_alternate(objects_path):
+    """Make the current repository borrow objects from another object directory."""
+    objects_path = os.path.abspath(objects_path)
+    if not os.path.isdir(objects_path):
+        raise FudgeException('object directory {} does not exist'.format(objects_path))
+
+    repository = get_repository()
+    if objects_path in repository.alternates:
+        return
+
+    makedirs(os.path.dirname(repository.alternates_path))
+    write_file(repository.alternates_path, objects_path + '\n', mode='a')
+
+    repository._alternates = None
@@ -0,0 +1,125 @@
+from fudge.bitmap import Bitmap, get_bitmap_index
+from fudge.commit import read_commit
+from fudge.object import load_object
+from fudge.refs import iter_refs, read_ref
+from fudge.tree import iter_tree_entries
+
+
+def get_tips():
+    """Return the object IDs of HEAD and of every ref."""
+    tips = [object_id for _, object_id in iter_refs()]
+
+    head = read_ref('HEAD')
+    if head and head not in tips:
+        tips.append(head)
+
+    return tips
+
+
+def iter_reachable_objects(commit_ids, mark=None, skip_commit=None):
+    """Yield the ID and path of every object reachable from the given commits.
+
+    Commits are walked first and yielded with an empty path, then every tree
+    or blob with the path it was first found at. `mark` is called with each
+    object found and returns False if it was seen before; by default, seen
+    objects are kept in a set. Commits for which `skip_commit` returns True
+    are neither walked nor yielded.
+    """
+    if mark is None:
+        seen = set()
+
+        def mark(object_id):
+            if object_id in seen:
+                return False
+            seen.add(object_id)
+            return True
+
+    trees = []
+    commits = list(commit_ids)
+    while commits:
+        commit_id = commits.pop()
+        if skip_commit and skip_commit(commit_id):
+            continue
+        if not mark(commit_id):
+            continue
+
+        commit = read_commit(commit_id)
+        yield commit_id, ''
+
+        commits.extend(commit.parents)
+        if mark(commit.tree):
+            trees.append((commit.tree, ''))
+
+    while trees:
+        tree_id, path = trees.pop()
+        yield tree_id, path
+
+        for mode, name, object_id in iter_tree_entries(load_object(tree_id)):
+            # Submodule commits are stored in other repositories.
+            if mode == '160000' or not mark(object_id):
+                continue
+
+            child_path = '{}/{}'.format(path, name) if path else name
+            if mode == '40000':
+                trees.append((object_id, child_path))
+            else:
+                yield object_id, child_path
+
+
+def fill_reachable(commit_ids, bitmap, others, find_position, get_bitmap):
+    """Add the objects reachable from the given commits to a bitmap.
+
+    `find_position` returns the bitmap position of an object, or None for
+    objects outside the bitmap's pack, which are added to `others` instead.
+    Commits for which `get_bitmap` returns a bitmap are not walked. Commits
+    are walked before trees, so that the trees already covered by those
+    bitmaps are skipped.
+    """
+    def mark(object_id):
+        position = find_position(object_id)
+        if position is None:
+            if object_id in others:
+                return False
+            others.add(object_id)
+        else:
+            if position in bitmap:
+                return False
+            bitmap.add(position)
+        return True
+
+    def skip_commit(commit_id):
+        position = find_position(commit_id)
+        if position is None or position in bitmap:
+            return False
+
+        reachable = get_bitmap(commit_id)
+        if reachable is None:
+            return False
+
+        bitmap.update(reachable)
+        return True
+
+    for _ in iter_reachable_objects(commit_ids, mark, skip_commit):
+        pass
+
+
+def iter_reachable_object_ids(commit_ids):
+    """Yield the ID of every object reachable from the given commits.
+
+    If a pack has a bitmap index, the history behind the commits it has a
+    bitmap for is not walked: their bitmaps give the reachable objects.
+    """
+    bitmap_index = get_bitmap_index()
+    if bitmap_index is None:
+        for object_id, _ in iter_reachable_objects(commit_ids):
+            yield object_id
+        return
+
+    bitmap = Bitmap()
+    others = set()
+    fill_reachable(commit_ids, bitmap, others, bitmap_index.find_position, bitmap_index.get)
+
+    for position in bitmap:
+        yield bitmap_index.get_id(position)
+
+    yield from others
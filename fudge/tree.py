@@ -1,37 +1,44 @@
 from collections import OrderedDict
 
-from fudge.index import Index, read_index, write_index
-from fudge.object import Object, load_object, store_object
+from fudge.index import CacheTree, Index, read_index, write_index
+from fudge.object import Object, ObjectWriter, load_object
 from fudge.parsing.builder import Builder
 from fudge.parsing.parser import Parser
 from fudge.utils import FudgeException
 
 
 class Node(object):
+    __slots__ = ('name', 'mode', 'object_id', 'children')
+
     def __init__(self, name, mode, object_id):
         self.name = name
         self.mode = mode
         self.object_id = object_id
 
-        self.children = OrderedDict()
+        # Leaves, the vast majority of nodes, have no children dictionary.
+        self.children = None
 
     def __iter__(self):
-        for child in self.children.values():
-            yield child
+        if self.children:
+            yield from self.children.values()
 
     def add(self, child):
+        if self.children is None:
+            self.children = OrderedDict()
         self.children[child.name] = child
 
     def get(self, name):
+        if not self.children:
+            return None
         return self.children.get(name)
 
     @property
     def is_branch(self):
-        return len(self.children) > 0
+        return bool(self.children)
 
     @property
     def is_leaf(self):
-        return len(self.children) == 0
+        return not self.children
 
 
 def get_node(root, path):
@@ -76,17 +83,23 @@ def print_tree(root, recurse):
         print('{:0>6} {} {} {}'.format(node.mode, node_type, node.object_id, path))
 
 
-def build_tree_from_object2(root):
-    obj = load_object(root.object_id)
+def iter_tree_entries(obj):
+    """Yield the mode, name and object ID of every entry of a tree object."""
     if obj.type != 'tree':
         raise FudgeException('the specified object is not a tree')
 
     parser = Parser(obj.contents, padding=False)
     while not parser.eof:
         info = parser.get_utf8()
-        mode, name = info.split()
+        mode, name = info.split(' ', 1)
         object_id = parser.get_sha1()
 
+        yield mode, name, object_id
+
+
+def build_tree_from_object2(root):
+    obj = load_object(root.object_id)
+    for mode, name, object_id in iter_tree_entries(obj):
         node = Node(name, mode, object_id)
         root.add(node)
 
@@ -110,55 +123,107 @@ def read_tree2(index, root, basepath):
             index.add_object(child.mode, child.object_id, path)
 
 
+def build_cache_tree(root):
+    """Build the cache tree of a tree read into the index.
+
+    Return it, with the number of index entries of the tree. Trees holding
+    submodules are left invalid, as submodules are not added to the index.
+    """
+    cache_tree = CacheTree()
+    entry_count = 0
+    complete = True
+
+    for child in root:
+        if child.is_branch:
+            subtree, subtree_entry_count = build_cache_tree(child)
+            cache_tree.subtrees[child.name] = subtree
+            entry_count += subtree_entry_count
+            complete = complete and subtree.is_valid
+        elif child.mode == '160000':
+            complete = False
+        else:
+            entry_count += 1
+
+    if complete:
+        cache_tree.object_id = root.object_id
+        cache_tree.entry_count = entry_count
+
+    return cache_tree, entry_count
+
+
 def read_tree(object_id):
     index = Index()
     root = build_tree_from_object(object_id)
     read_tree2(index, root, '')
+
+    # The trees read are known, so that they need not be written again.
+    index.cache_tree, _ = build_cache_tree(root)
     write_index(index)
 
 
-def build_tree_from_index():
-    root = Node('root', None, None)
+def write_tree2(cache_tree, entries, start, basepath, objects):
+    """Build the tree object of the directory `basepath`, unless its cached tree is valid.
 
-    index = read_index()
-    for entry in index:
-        parts = entry.path.split('/')
-        if len(parts) == 1:
-            path, filename = [], parts[0]
-        else:
-            path, filename = parts[:-1], parts[-1]
+    Index entries from `start` on are those of the directory. Tree objects
+    are appended to `objects`, and the cache tree is updated.
+    Return the position of the first index entry following the directory.
+    """
+    if cache_tree.is_valid:
+        return start + cache_tree.entry_count
 
-        current = root
-        for dirname in path:
-            if not current.get(dirname):
-                node = Node(dirname, '40000', None)
-                current.add(node)
-            current = current.get(dirname)
+    builder = Builder(padding=False)
+    names = set()
 
-        node = Node(filename, entry.perms, entry.object_id)
-        current.add(node)
+    i = start
+    while i < len(entries) and entries[i].path.startswith(basepath):
+        entry = entries[i]
+        name = entry.path[len(basepath):]
 
-    return root
+        if '/' in name:
+            name = name.split('/', 1)[0]
+            subtree = cache_tree.subtrees.get(name)
+            if subtree is None:
+                subtree = cache_tree.subtrees[name] = CacheTree()
 
+            i = write_tree2(subtree, entries, i, basepath + name + '/', objects)
+            mode, object_id = '40000', subtree.object_id
+        else:
+            i += 1
+            mode, object_id = entry.perms, entry.object_id
 
-def write_tree2(root):
-    builder = Builder(padding=False)
-    for child in root:
-        if child.is_branch:
-            object_id = write_tree2(child)
-            child.object_id = object_id
+        names.add(name)
+        builder.set_utf8('{} {}'.format(mode, name))
+        builder.set_sha1(object_id)
 
-        info = '{} {}'.format(child.mode, child.name)
-        builder.set_utf8(info)
-        builder.set_sha1(child.object_id)
+    # Directories without entries left have no tree anymore.
+    for name in set(cache_tree.subtrees) - names:
+        del cache_tree.subtrees[name]
 
     data = builder.data
     obj = Object('tree', len(data), data)
-    store_object(obj)
+    objects.append(obj)
+
+    cache_tree.object_id = obj.id
+    cache_tree.entry_count = i - start
 
-    return obj.id
+    return i
 
 
 def write_tree():
-    root = build_tree_from_index()
-    return write_tree2(root)
+    """Write the tree objects of the index, and return the ID of the root tree.
+
+    Only the trees of directories that changed since the last call are
+    built: the others are taken from the index cache tree.
+    """
+    index = read_index()
+    if index.cache_tree is None:
+        index.cache_tree = CacheTree()
+
+    objects = []
+    write_tree2(index.cache_tree, list(index), 0, '', objects)
+
+    if objects:
+        ObjectWriter().write(objects)
+        write_index(index)
+
+    return index.cache_tree.object_id
@@ -1,5 +1,6 @@
 import hashlib
 import os
+from collections import OrderedDict
 from string import hexdigits
 
 
@@ -7,6 +8,61 @@ class FudgeException(Exception):
     pass
 
 
+class LRUCache(object):
+    """A least recently used cache bounded by the total size of its values.
+
+    The size of each value is given when it is added, and the least recently
+    used values are evicted once the total goes over `max_size`. Lookups are
+    counted in `hits` and `misses`.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_size or key in self.entries:
+            return
+
+        self.entries[key] = (value, size)
+        self.size += size
+        self.evict()
+
+    def evict(self):
+        while self.size > self.max_size:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.size -= size
+
+    def resize(self, max_size):
+        self.max_size = max_size
+        self.evict()
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+
 def read_file(path, mode='rb'):
     with open(path, mode) as f:
         data = f.read()
@@ -24,19 +80,19 @@ def makedirs(path):
         os.makedirs(path)
 
 
-def stat(path):
-    status = os.stat(path)
-
-    def split(time):
-        return [int(part) for part in str(time).split('.')]
+def get_stat_data(status):
+    """Return the stat data stored in index entries, from the result of `os.stat`.
 
-    ctime_s, ctime_n = split(status.st_ctime)
-    mtime_s, mtime_n = split(status.st_mtime)
+    Times are split into seconds and nanoseconds from their exact integer
+    value, as floats cannot hold nanoseconds.
+    """
+    ctime_s, ctime_n = divmod(status.st_ctime_ns, 10 ** 9)
+    mtime_s, mtime_n = divmod(status.st_mtime_ns, 10 ** 9)
 
     return {
-        'ctime_s': ctime_s,
+        'ctime_s': ctime_s & 0xffffffff,
         'ctime_n': ctime_n,
-        'mtime_s': mtime_s,
+        'mtime_s': mtime_s & 0xffffffff,
         'mtime_n': mtime_n,
         'dev': status.st_dev & 0xffffffff,
         'ino': status.st_ino & 0xffffffff,
@@ -47,6 +103,10 @@ def stat(path):
     }
 
 
+def stat(path, follow_symlinks=True):
+    return get_stat_data(os.stat(path) if follow_symlinks else os.lstat(path))
+
+
 def get_hash(data):
     if isinstance(data, str):
         data = bytes(data, 'utf-8')
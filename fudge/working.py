@@ -1,12 +1,13 @@
 import os
 
 from fudge.commit import read_commit
-from fudge.index import read_index
-from fudge.object import Object
+from fudge.index import (entry_matches_stat, get_index_entry_path, get_working_tree_stat,
+                         read_index, write_index)
+from fudge.object import hash_file
 from fudge.refs import read_ref
 from fudge.repository import get_working_tree_path
 from fudge.tree import build_tree_from_object, get_node, walk_tree
-from fudge.utils import read_file
+from fudge.utils import FudgeException
 
 
 def get_gitignore_path():
@@ -27,7 +28,7 @@ def parse_gitignore():
 
     path = get_gitignore_path()
     if not os.path.exists(path):
-        return ignored
+        return ignored, extensions
 
     with open(path, 'r') as f:
         lines = f.readlines()
@@ -46,7 +47,13 @@ def parse_gitignore():
     return ignored, extensions
 
 
-def walk_working_tree():
+def scan_working_tree(path=None):
+    """List the files of the working tree, or of one of its directories.
+
+    Yield the path of each file relative to the working tree, and its
+    `os.scandir` entry, which caches the result of `lstat` once called.
+    Ignored files are skipped.
+    """
     ignored, extensions = parse_gitignore()
 
     def keep(name):
@@ -54,15 +61,59 @@ def walk_working_tree():
         return name not in ignored and extension not in extensions
 
     basedir = get_working_tree_path()
-    for dirpath, dirnames, filenames in os.walk(basedir):
-        dirnames[:] = [d for d in dirnames if keep(d)]
-        filenames[:] = [f for f in filenames if keep(f)]
+    if path:
+        directories = [(os.path.join(basedir, path), path.replace(os.sep, '/') + '/')]
+    else:
+        directories = [(basedir, '')]
+
+    while directories:
+        dirpath, prefix = directories.pop()
+
+        for entry in os.scandir(dirpath):
+            if not keep(entry.name):
+                continue
+
+            # Like `os.walk`, symbolic links to directories are not followed.
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    directories.append((entry.path, prefix + entry.name + '/'))
+            else:
+                yield prefix + entry.name, entry
+
+
+def walk_working_tree(path=None):
+    """List the paths of the files of the working tree, or of one of its directories."""
+    for path, _ in scan_working_tree(path):
+        yield path
+
+
+def expand_paths(paths):
+    """Return the files matching the given paths, relative to the working tree.
+
+    Directories are expanded to the files they contain, except ignored ones.
+    """
+    basedir = get_working_tree_path()
+
+    files = []
+    seen = set()
 
-        for filename in filenames:
-            fullpath = os.path.join(dirpath, filename)
-            path = os.path.relpath(fullpath, basedir)
+    for path in paths:
+        relpath = get_index_entry_path(path)
+        fullpath = os.path.join(basedir, relpath)
 
-            yield path
+        if os.path.isdir(fullpath):
+            matches = walk_working_tree(None if relpath == '.' else relpath)
+        elif os.path.isfile(fullpath):
+            matches = [relpath]
+        else:
+            raise FudgeException("pathspec '{}' did not match any files".format(path))
+
+        for match in matches:
+            if match not in seen:
+                seen.add(match)
+                files.append(match)
+
+    return files
 
 
 def compute_staged():
@@ -130,21 +181,40 @@ def compute_changed_and_untracked():
     index = read_index()
 
     index_paths = set([entry.path for entry in index])
-    working_tree_paths = set(list(walk_working_tree()))
+
+    # The directory entries of the scan save a stat call per file.
+    working_tree = dict(scan_working_tree())
+    working_tree_paths = set(working_tree)
 
     deleted = index_paths - working_tree_paths
     changed.extend([('deleted', path) for path in deleted])
 
+    refreshed = False
+
     similar = index_paths & working_tree_paths
     for path in similar:
         entry = index.get(path)
 
         abspath = os.path.join(basedir, path)
-        contents = read_file(abspath)
-        obj = Object('blob', len(contents), contents)
+        status = get_working_tree_stat(working_tree[path].stat(follow_symlinks=False))
 
-        if entry.object_id != obj.id:
+        # Files are only read if their stat data changed, or if they may have
+        # changed without their stat data changing.
+        if entry.perms != status['perms']:
+            changed.append(('modified', path))
+        elif entry_matches_stat(entry, status) and not index.is_racily_clean(entry):
+            continue
+        elif entry.size != 0 and entry.size != status['size']:
             changed.append(('modified', path))
+        elif hash_file(abspath) != entry.object_id:
+            changed.append(('modified', path))
+        else:
+            # The file is unchanged: its new stat data saves hashing it next time.
+            index.add(entry._replace(**status))
+            refreshed = True
+
+    if refreshed:
+        write_index(index, skip_if_locked=True)
 
     changed.sort(key=lambda entry: entry[1])
 
@@ -3,6 +3,9 @@ import shutil
 
 import pytest
 
+from fudge.object import Object, store_object
+from fudge.parsing.builder import Builder
+from fudge.refs import write_ref
 from fudge.repository import create_repository, get_repository_path
 from fudge.utils import makedirs
 
@@ -36,3 +39,39 @@ def repo(request, tmpdir):
             shutil.copy(srcpath, destpath)
 
     yield tmpdir
+
+
+def write_history(num_commits, num_lines=200):
+    """Store a linear history modifying a single file, and point master to it.
+
+    Return the IDs of the commits, from the oldest to the newest.
+    """
+    lines = ['line {}\n'.format(i) for i in range(num_lines)]
+    commit_ids = []
+
+    for i in range(num_commits):
+        lines[i * 7 % num_lines] = 'changed in commit {}\n'.format(i)
+        contents = ''.join(lines)
+        blob = Object('blob', len(contents), contents)
+        store_object(blob)
+
+        builder = Builder(padding=False)
+        builder.set_utf8('100644 test.txt')
+        builder.set_sha1(blob.id)
+        tree = Object('tree', len(builder.data), bytes(builder.data))
+        store_object(tree)
+
+        contents = 'tree {}\n'.format(tree.id)
+        if commit_ids:
+            contents += 'parent {}\n'.format(commit_ids[-1])
+        contents += 'author Hatsune Miku <vocaloid@crypton.co.jp> 1506686400 +0000\n'
+        contents += 'committer Hatsune Miku <vocaloid@crypton.co.jp> 1506686400 +0000\n'
+        contents += '\nCommit {}\n'.format(i)
+        commit = Object('commit', len(contents), contents)
+        store_object(commit)
+
+        commit_ids.append(commit.id)
+
+    write_ref('refs/heads/master', commit_ids[-1])
+
+    return commit_ids
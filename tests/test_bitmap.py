@@ -0,0 +1,145 @@
+import hashlib
+import os
+import struct
+
+import pytest
+
+from fudge import packobjects
+from fudge.bitmap import (Bitmap, PackBitmapIndex, decode_ewah, encode_ewah, get_bitmap_index,
+                          get_bitmap_path, skip_ewah)
+from fudge.packfile import get_packs
+from fudge.packobjects import repack
+from fudge.revlist import get_tips, iter_reachable_object_ids, iter_reachable_objects
+
+from tests.conftest import write_history
+
+
+def make_bitmap(positions):
+    bitmap = Bitmap()
+    for position in positions:
+        bitmap.add(position)
+    return bitmap
+
+
+@pytest.mark.parametrize('positions', [
+    [],
+    [0],
+    [0, 200],
+    list(range(64, 640)),
+    list(range(3, 1000, 3)) + list(range(2000, 2100)),
+])
+def test_ewah(positions):
+    data = encode_ewah(make_bitmap(positions)) + b'trailing data'
+    bitmap, offset = decode_ewah(data, 0)
+    assert list(bitmap) == positions
+    assert data[offset:] == b'trailing data'
+    assert skip_ewah(data, 0) == offset
+
+
+def test_ewah_encoding():
+    # A literal word, then a run of two empty words followed by a literal word.
+    data = encode_ewah(make_bitmap([0, 200]))
+    bit_size, num_words = struct.unpack_from('!II', data)
+    assert (bit_size, num_words) == (201, 4)
+    assert struct.unpack_from('!4QI', data, 8) == (1 << 33, 1, (1 << 33) | (2 << 1), 1 << 8, 2)
+
+
+@pytest.fixture
+def interval(monkeypatch):
+    monkeypatch.setattr(packobjects, 'BITMAP_COMMIT_INTERVAL', 3)
+
+
+def test_write_bitmap_index(repo, interval):
+    commit_ids = write_history(10)
+    path, _ = repack(write_bitmap=True)
+
+    pack, = get_packs()
+    assert os.path.exists(get_bitmap_path(pack))
+
+    bitmap_index = PackBitmapIndex(pack)
+    assert len(bitmap_index) == 4
+    assert commit_ids[-1] in bitmap_index
+
+    for commit_id in commit_ids:
+        if commit_id in bitmap_index:
+            bitmap = bitmap_index.get(commit_id)
+            ids = set(bitmap_index.get_id(position) for position in bitmap)
+            assert ids == set(object_id for object_id, _ in iter_reachable_objects([commit_id]))
+
+    commits = make_bitmap(bitmap_index.find_position(commit_id) for commit_id in commit_ids)
+    assert list(bitmap_index.types['commit']) == list(commits)
+    assert len(bitmap_index.types['tree']) == len(bitmap_index.types['blob']) == 10
+    assert not list(bitmap_index.types['tag'])
+
+
+def test_read_xored_bitmaps(repo, interval):
+    commit_ids = write_history(10)
+    repack(write_bitmap=True)
+
+    pack, = get_packs()
+    bitmap_index = PackBitmapIndex(pack)
+    selected = [commit_id for commit_id in commit_ids if commit_id in bitmap_index]
+    expected = [bitmap_index.get(commit_id) for commit_id in selected]
+
+    # Rewrite the bitmap index like Git may: each bitmap is XORed with the previous one.
+    path = get_bitmap_path(pack)
+    data = bytearray(bitmap_index.data[:bitmap_index.entries[0][0] - 6])
+    for i, (commit_id, bitmap) in enumerate(zip(selected, expected)):
+        xor_offset = 1 if i else 0
+        if xor_offset:
+            bitmap = bitmap ^ expected[i - 1]
+        data += struct.pack('!IBB', pack.index.find(commit_id), xor_offset, 0)
+        data += encode_ewah(bitmap)
+    data += hashlib.sha1(data).digest()
+
+    os.remove(path)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    bitmap_index = PackBitmapIndex(pack)
+    assert len(bitmap_index) == len(selected) == 4
+    for commit_id, bitmap in zip(selected, expected):
+        assert list(bitmap_index.get(commit_id)) == list(bitmap)
+
+
+def test_iter_reachable_object_ids(repo, interval):
+    write_history(10)
+    repack(write_bitmap=True)
+    assert get_bitmap_index() is not None
+
+    # New loose commits are walked until a commit with a bitmap is found.
+    commit_ids = write_history(12)
+
+    expected = set(object_id for object_id, _ in iter_reachable_objects(get_tips()))
+    object_ids = list(iter_reachable_object_ids(get_tips()))
+    assert len(object_ids) == len(expected) == 36
+    assert set(object_ids) == expected
+
+    expected = set(object_id for object_id, _ in iter_reachable_objects([commit_ids[4]]))
+    assert set(iter_reachable_object_ids([commit_ids[4]])) == expected
+
+
+def test_repack_lists_objects_from_the_bitmap_index(monkeypatch, repo, interval):
+    write_history(10)
+    repack(write_bitmap=True)
+    write_history(12)
+
+    def walk_history(commit_ids):
+        raise AssertionError('the whole history is walked')
+
+    monkeypatch.setattr(packobjects, 'iter_reachable_objects', walk_history)
+    path, num_objects = repack(delete=True)
+    assert num_objects == 36
+    assert [pack.path for pack in get_packs()] == [path]
+
+
+def test_repack_removes_bitmap_index(repo):
+    write_history(3)
+    first, _ = repack(write_bitmap=True)
+
+    write_history(4)
+    second, _ = repack(delete=True)
+
+    assert not os.path.exists(os.path.splitext(first)[0] + '.bitmap')
+    assert get_bitmap_index() is None
+    assert len(list(iter_reachable_object_ids(get_tips()))) == 12
@@ -1,6 +1,10 @@
+import io
+
 import pytest
 
-from fudge.commands import cmd_cat_file, cmd_hash_object, cmd_ls_files
+from fudge.commands import cmd_add, cmd_cat_file, cmd_hash_object, cmd_ls_files, cmd_rm
+from fudge.index import read_index
+from fudge.utils import FudgeException
 
 
 def test_init(repo):
@@ -35,6 +39,12 @@ def test_cat_file(capsys, repo):
     out, err = capsys.readouterr()
     assert out == 'test content\n'
 
+    cmd_cat_file(digest, show_type=True)
+    cmd_cat_file(digest, show_size=True)
+
+    out, err = capsys.readouterr()
+    assert out == 'blob\n13\n'
+
 
 @pytest.mark.fudgefiles(['index/valid', 'index'])
 def test_ls_files(capsys, repo):
@@ -50,3 +60,38 @@ def test_ls_files(capsys, repo):
 
     out, err = capsys.readouterr()
     assert out.rstrip('\n').split('\n') == expected
+
+
+def test_add_paths_and_directories(monkeypatch, repo):
+    repo.join('.gitignore').write('*.pyc\nbuild\n')
+    for path in ['a.txt', 'src/b.py', 'src/b.pyc', 'src/lib/c.py', 'build/d.txt', 'e.txt']:
+        repo.join(path).write(path, ensure=True)
+
+    cmd_add(['a.txt', 'src'])
+    assert [entry.path for entry in read_index()] == ['a.txt', 'src/b.py', 'src/lib/c.py']
+
+    monkeypatch.setattr('sys.stdin', io.StringIO('e.txt\n.gitignore\n'))
+    cmd_add(stdin=True)
+    assert [entry.path for entry in read_index()] == [
+        '.gitignore', 'a.txt', 'e.txt', 'src/b.py', 'src/lib/c.py'
+    ]
+
+    cmd_rm(['a.txt', 'src/b.py'])
+    assert [entry.path for entry in read_index()] == ['.gitignore', 'e.txt', 'src/lib/c.py']
+
+    with pytest.raises(FudgeException) as exception:
+        cmd_add(['e.txt', 'missing.txt'])
+    assert "pathspec 'missing.txt' did not match any files" in str(exception.value)
+
+
+def test_add_nothing(monkeypatch, repo):
+    repo.join('empty').ensure(dir=True)
+
+    for paths in ([], ['empty']):
+        with pytest.raises(FudgeException) as exception:
+            cmd_add(paths)
+        assert 'nothing specified, nothing added' in str(exception.value)
+
+    # An empty list of paths from the standard input is not an error.
+    monkeypatch.setattr('sys.stdin', io.StringIO(''))
+    cmd_add(stdin=True)
@@ -2,7 +2,7 @@ import os
 import pytest
 import shutil
 
-from fudge.config import get_config_path, get_config_value
+from fudge.config import get_config_path, get_config_value, parse_size
 from fudge.utils import FudgeException
 
 from tests.conftest import get_data_path
@@ -35,3 +35,20 @@ def test_unsafe_value():
     with pytest.raises(FudgeException) as exception:
         get_config_value('user', 'name', path=path)
     assert 'invalid value' in str(exception.value)
+
+
+@pytest.mark.parametrize('value,size', [
+    ('0', 0),
+    ('512', 512),
+    ('16k', 16 * 1024),
+    ('512m', 512 * 1024 ** 2),
+    ('1G', 1024 ** 3),
+])
+def test_parse_size(value, size):
+    assert parse_size(value) == size
+
+
+def test_parse_invalid_size():
+    with pytest.raises(FudgeException) as exception:
+        parse_size('12 bytes')
+    assert 'invalid size' in str(exception.value)
@@ -0,0 +1,72 @@
+import pytest
+
+from fudge.delta import apply_delta, create_delta
+from fudge.utils import FudgeException
+
+
+def test_apply_delta():
+    source = b'0123456789abcdef'
+    delta = bytes([
+        16, 13,
+        0x91, 10, 6,     # Copy "abcdef" from offset 10.
+        3, 120, 121, 122,  # Insert "xyz".
+        0x90, 4,         # Copy "0123" from offset 0.
+    ])
+    assert apply_delta(source, delta) == b'abcdefxyz0123'
+
+
+def test_apply_delta_with_large_copies():
+    source = bytes(range(256)) * 512
+    header = bytes([0x80, 0x80, 0x08])  # 0x20000, the length of the source.
+
+    # Copy sizes are encoded on up to three bytes: copy 0x1ffff bytes from offset 1.
+    delta = header + bytes([0xff, 0xff, 0x07, 0xf1, 0x01, 0xff, 0xff, 0x01])
+    assert apply_delta(source, delta) == source[1:]
+
+    # A copy size of zero means 0x10000 bytes.
+    delta = header + bytes([0x80, 0x80, 0x04, 0x80])
+    assert apply_delta(source, delta) == source[:0x10000]
+
+
+def test_apply_delta_unsuccessfully():
+    with pytest.raises(FudgeException) as exception:
+        apply_delta(b'0123', bytes([5, 1, 0x90, 1]))
+    assert 'invalid base object length' in str(exception.value)
+
+    with pytest.raises(FudgeException) as exception:
+        apply_delta(b'0123', bytes([4, 8, 0x91, 2, 4]))
+    assert 'past the end of the base object' in str(exception.value)
+
+    with pytest.raises(FudgeException) as exception:
+        apply_delta(b'0123', bytes([4, 5, 0x90, 4]))
+    assert 'invalid result object length' in str(exception.value)
+
+    with pytest.raises(FudgeException) as exception:
+        apply_delta(b'0123', bytes([4, 1, 0]))
+    assert 'invalid delta opcode' in str(exception.value)
+
+
+@pytest.mark.parametrize('delta', [
+    bytes([3, 3, 0x91]),
+    bytes([3, 3, 0x81]),
+    bytes([0x80]),
+])
+def test_apply_truncated_delta(delta):
+    with pytest.raises(FudgeException) as exception:
+        apply_delta(b'abc', delta)
+    assert 'truncated delta' in str(exception.value)
+
+
+def test_create_delta():
+    source = b''.join(b'line %d\n' % i for i in range(1000))
+    target = source[:2000] + b'inserted\n' * 30 + source[2100:] + b'appended\n'
+
+    delta = create_delta(source, target)
+    assert len(delta) < 400
+    assert apply_delta(source, delta) == target
+
+    # Empty and unrelated objects still give a valid delta.
+    assert apply_delta(b'', create_delta(b'', target)) == target
+    assert apply_delta(source, create_delta(source, b'')) == b''
+
+    assert create_delta(source, target, max_size=100) is None
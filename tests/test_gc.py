@@ -0,0 +1,68 @@
+import os
+
+from fudge.gc import auto_gc, gc, too_many_loose_objects
+from fudge.object import Object, iter_loose_object_ids, load_object, store_object
+from fudge.multipackindex import get_multi_pack_index_path, write_multi_pack_index
+from fudge.packfile import get_packs
+from fudge.packobjects import repack
+
+from tests.conftest import write_history
+
+
+def test_gc(repo):
+    commit_ids = write_history(3)
+
+    # A multi-pack-index covering a replaced pack is removed along with it.
+    repack()
+    write_multi_pack_index()
+
+    contents = 'unreachable\n'
+    unreachable = Object('blob', len(contents), contents)
+    store_object(unreachable)
+
+    path, num_objects, num_pruned = gc()
+    assert num_objects == num_pruned == 10
+    assert [pack.path for pack in get_packs()] == [path]
+    assert not os.path.exists(get_multi_pack_index_path())
+
+    assert not list(iter_loose_object_ids())
+    objects_dir = repo.join('.fudge', 'objects')
+    assert sorted(objects_dir.listdir()) == [objects_dir.join('pack')]
+
+    for object_id in commit_ids + [unreachable.id]:
+        load_object(object_id)
+
+
+def test_gc_in_an_empty_repository(repo):
+    assert gc() == (None, 0, 0)
+
+
+def store_sampled_blobs(count):
+    """Store blobs until `count` of them are in the sampled fan-out directory."""
+    i = 0
+    while count:
+        contents = 'blob {}\n'.format(i)
+        obj = Object('blob', len(contents), contents)
+        store_object(obj)
+        if obj.id.startswith('17'):
+            count -= 1
+        i += 1
+
+
+def test_auto_gc(repo):
+    write_history(2)
+    assert not too_many_loose_objects(1)
+    assert not auto_gc(1)
+
+    store_sampled_blobs(2)
+    assert too_many_loose_objects(1)
+    assert not too_many_loose_objects(2 * 256)
+
+    # A threshold of 0 disables automatic garbage collection.
+    assert not auto_gc(0)
+    assert not get_packs()
+
+    assert auto_gc(1)
+    assert len(get_packs()) == 1
+    assert not list(iter_loose_object_ids())
+    assert not too_many_loose_objects(1)
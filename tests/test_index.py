@@ -1,6 +1,10 @@
+import hashlib
+
 import pytest
 
-from fudge.index import read_index, write_index
+from fudge import index as index_module
+from fudge.index import (CacheTree, Index, IndexEntry, ObjectType, add_file_to_index, add_files_to_index,
+                         checkout_index, read_index, remove_files_from_index, write_index)
 from fudge.utils import FudgeException, read_file
 
 from conftest import get_destination_path
@@ -50,3 +54,136 @@ def test_read_and_write_index_successfully(repo):
 
     after = read_file(path)
     assert before == after
+
+
+@pytest.mark.fudgefiles(['index/valid', 'index'])
+def test_write_locked_index(repo):
+    path = get_destination_path('index')
+    before = read_file(path)
+
+    repo.join('.fudge', 'index.lock').write('')
+    with pytest.raises(FudgeException) as exception:
+        write_index(read_index())
+    assert 'index.lock' in str(exception.value)
+
+    write_index(read_index(), skip_if_locked=True)
+    assert read_file(path) == before
+
+
+def test_write_index_with_long_paths(repo):
+    # Entries are padded to 8 bytes, and path lengths above 0xfff are not stored in the flags.
+    paths = ['a' * length for length in (1, 7, 8, 9, 4094, 4095, 4096, 5000)]
+    index = Index(IndexEntry(
+        1, 2, 3, 4, 5, 6, ObjectType.REGULAR_FILE, '100755', 7, 8, 9, '0' * 40, path
+    ) for path in paths)
+    write_index(index)
+
+    entries = list(read_index())
+    assert [entry.path for entry in entries] == paths
+    assert entries == list(index)
+
+
+def test_read_and_write_cache_tree(repo):
+    entry = IndexEntry(1, 2, 3, 4, 5, 6, ObjectType.REGULAR_FILE, '100644', 7, 8, 9, '0' * 40, 'a')
+
+    cache_tree = CacheTree('1' * 40, 3)
+    cache_tree.subtrees['dir'] = CacheTree('2' * 40, 2)
+    cache_tree.subtrees['dir'].subtrees['invalid'] = CacheTree()
+    cache_tree.subtrees['b'] = CacheTree('3' * 40, 1)
+    write_index(Index([entry], cache_tree=cache_tree))
+
+    # Like Git, sub-trees are sorted by name length first.
+    data = read_file(get_destination_path('index'))
+    assert data[data.index(b'TREE'):-20] == (
+        b'TREE\0\0\0\x5c' +
+        b'\x003 2\n' + b'\x11' * 20 +
+        b'b\x001 0\n' + b'\x33' * 20 +
+        b'dir\x002 1\n' + b'\x22' * 20 +
+        b'invalid\x00-1 0\n'
+    )
+
+    cache_tree = read_index().cache_tree
+    assert (cache_tree.object_id, cache_tree.entry_count) == ('1' * 40, 3)
+    assert sorted(cache_tree.subtrees) == ['b', 'dir']
+    assert not cache_tree.subtrees['dir'].subtrees['invalid'].is_valid
+
+    # Changing an entry invalidates the trees of its directories only.
+    index = read_index()
+    index.add(entry._replace(path='dir/new'))
+    assert not index.cache_tree.is_valid
+    assert not index.cache_tree.subtrees['dir'].is_valid
+    assert index.cache_tree.subtrees['b'].is_valid
+
+
+def test_read_index_with_an_unsupported_extension(repo):
+    write_index(Index())
+    path = get_destination_path('index')
+    data = read_file(path)[:-20] + b'link\0\0\0\0'
+
+    with open(path, 'wb') as f:
+        f.write(data + hashlib.sha1(data).digest())
+
+    with pytest.raises(FudgeException) as exception:
+        read_index()
+    assert 'unsupported index extension: link' in str(exception.value)
+
+
+def test_add_file_and_checkout_index(repo):
+    contents = bytes(range(256)) * 1024
+    path = repo.join('data.bin')
+    path.write_binary(contents)
+
+    add_file_to_index('data.bin')
+    path.remove()
+
+    checkout_index()
+    assert path.read_binary() == contents
+
+
+def test_failed_checkout_leaves_no_file(monkeypatch, repo):
+    contents = bytes(range(256)) * 1024
+    path = repo.join('data.bin')
+    path.write_binary(contents)
+
+    add_file_to_index('data.bin')
+    path.remove()
+
+    def failing_iter_object_contents(object_id):
+        yield contents[:1000]
+        raise FudgeException('truncated pack file')
+
+    monkeypatch.setattr(index_module, 'iter_object_contents', failing_iter_object_contents)
+    with pytest.raises(FudgeException):
+        checkout_index()
+    assert sorted(p.basename for p in repo.listdir()) == ['.fudge']
+
+    monkeypatch.undo()
+    checkout_index()
+    assert path.read_binary() == contents
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_add_files_to_index(monkeypatch, repo, workers):
+    paths = ['dir{}/file{}.txt'.format(i % 3, i) for i in range(20)]
+    for path in paths:
+        repo.join(path).write('contents of {}\n'.format(path), ensure=True)
+    repo.join(paths[0]).chmod(0o755)
+
+    writes = []
+
+    def counting_write_index(index):
+        writes.append(index)
+        write_index(index)
+
+    monkeypatch.setattr(index_module, 'write_index', counting_write_index)
+
+    add_files_to_index(paths, workers)
+    assert len(writes) == 1
+
+    index = read_index()
+    assert [entry.path for entry in index] == sorted(paths)
+    assert index.get(paths[0]).perms == '100755'
+    assert index.get(paths[1]).perms == '100644'
+
+    remove_files_from_index(paths[:10])
+    assert [entry.path for entry in read_index()] == sorted(paths[10:])
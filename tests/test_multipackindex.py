@@ -0,0 +1,124 @@
+import os
+
+import pytest
+
+from fudge.multipackindex import verify_multi_pack_index, write_multi_pack_index
+from fudge.object import Object, store_object
+from fudge.packfile import (MultiPackIndex, find_packed_entry, get_pack_directory,
+                            load_pack_directory)
+from fudge.packobjects import pack_objects
+from fudge.utils import FudgeException
+
+from tests.test_packfile import HEAD
+
+
+PACK_FILES = (
+    ['pack/ofs.pack', 'objects/pack/pack-ofs.pack'],
+    ['pack/ofs.idx', 'objects/pack/pack-ofs.idx'],
+)
+
+
+def store_blob_pack(count):
+    blobs = []
+    for i in range(count):
+        contents = 'packed blob {}\n'.format(i)
+        blob = Object('blob', len(contents), contents)
+        store_object(blob)
+        blobs.append(blob)
+
+    basepath = os.path.join(get_pack_directory(), 'pack')
+    path, _ = pack_objects([(blob.id, '') for blob in blobs], basepath)
+
+    return path, blobs
+
+
+@pytest.mark.fudgefiles(*PACK_FILES)
+def test_write_multi_pack_index(repo):
+    pack_path, blobs = store_blob_pack(10)
+
+    path, num_objects = write_multi_pack_index()
+    assert num_objects == 24
+    assert verify_multi_pack_index() == 24
+
+    multi_pack_index = MultiPackIndex(path)
+    assert multi_pack_index.pack_names == sorted([
+        'pack-ofs.idx', os.path.basename(pack_path)[:-len('.pack')] + '.idx'])
+
+    directory = load_pack_directory()
+    assert directory.multi_pack_index.checksum == multi_pack_index.checksum
+    assert directory.other_packs == []
+
+    for object_id in [HEAD] + [blob.id for blob in blobs]:
+        full_id, pack, offset = find_packed_entry(object_id[:7])
+        assert full_id == object_id
+        type_, contents = pack.read(offset)
+        assert Object(type_, len(contents), contents).id == object_id
+
+
+@pytest.mark.fudgefiles(*PACK_FILES)
+def test_write_multi_pack_index_within_a_clock_tick(repo):
+    dirpath = get_pack_directory()
+    assert load_pack_directory().multi_pack_index is None
+
+    # The pack directory keeps its modification time, as on coarse-grained file systems.
+    mtime = os.stat(dirpath).st_mtime_ns
+    write_multi_pack_index()
+    os.utime(dirpath, ns=(mtime, mtime))
+
+    assert load_pack_directory().multi_pack_index is not None
+
+
+@pytest.mark.fudgefiles(*PACK_FILES)
+def test_packs_not_covered_by_the_multi_pack_index(repo):
+    write_multi_pack_index()
+    pack_path, blobs = store_blob_pack(3)
+
+    directory = load_pack_directory()
+    assert directory.multi_pack_index is not None
+    assert [pack.path for pack in directory.other_packs] == [pack_path]
+
+    full_id, pack, _ = find_packed_entry(blobs[0].id)
+    assert pack.path == pack_path
+
+
+@pytest.mark.fudgefiles(*PACK_FILES)
+def test_stale_multi_pack_index(repo):
+    pack_path, blobs = store_blob_pack(3)
+    write_multi_pack_index()
+
+    os.remove(pack_path)
+    os.remove(pack_path[:-len('.pack')] + '.idx')
+
+    directory = load_pack_directory()
+    assert directory.multi_pack_index is None
+    assert find_packed_entry(HEAD) is not None
+    assert find_packed_entry(blobs[0].id) is None
+
+    with pytest.raises(FudgeException) as exception:
+        verify_multi_pack_index()
+    assert 'missing packs' in str(exception.value)
+
+
+@pytest.mark.fudgefiles(*PACK_FILES)
+def test_verify_corrupted_multi_pack_index(repo):
+    path, _ = write_multi_pack_index()
+
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    data[-30] ^= 0xff
+
+    os.chmod(path, 0o644)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    with pytest.raises(FudgeException) as exception:
+        verify_multi_pack_index()
+    assert 'checksum' in str(exception.value)
+
+
+def test_multi_pack_index_without_packs(repo):
+    assert write_multi_pack_index() == (None, 0)
+
+    with pytest.raises(FudgeException) as exception:
+        verify_multi_pack_index()
+    assert 'no multi-pack-index' in str(exception.value)
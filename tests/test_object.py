@@ -1,6 +1,17 @@
+import os
+import zlib
+
 import pytest
 
-from fudge.object import Object, load_object, store_object
+import fudge.object
+from fudge.commands import cmd_init
+from fudge.object import (FSYNC_BATCH, FSYNC_NONE, FSYNC_OBJECT, OBJECT_CACHE_SIZE,
+                          STREAM_CHUNK_SIZE, Object, ObjectWriter, abbreviate_object_id,
+                          get_fsync_policy, get_object_path, hash_file, iter_object_contents,
+                          load_object, object_cache, object_info, resolve_object_id,
+                          set_fsync_policy, set_object_cache_size, store_object, sync_objects)
+from fudge.packobjects import repack
+from fudge.repository import add_alternate
 from fudge.utils import FudgeException
 
 
@@ -10,6 +21,14 @@ def test_object_id_is_valid():
     assert obj.id == 'd670460b4b4aece5915caf5c68d12f560a9fe3e4'
 
 
+def test_object_id_is_computed_once():
+    contents = memoryview(b'xxtest content\n')[2:]
+    obj = Object('blob', len(contents), contents)
+    assert obj.id is obj.id
+    assert obj.id == 'd670460b4b4aece5915caf5c68d12f560a9fe3e4'
+    assert zlib.decompress(obj.compress()) == b'blob 13\0test content\n'
+
+
 def test_load_object_unsuccessfully(repo):
     with pytest.raises(FudgeException) as exception:
         load_object('not_a_valid_object_id')
@@ -30,3 +49,261 @@ def test_store_and_load_object_successfully(repo):
     assert obj.type == obj2.type
     assert obj.size == obj2.size
     assert obj.contents == obj2.contents
+
+
+def test_loose_and_packed_objects_have_the_same_contents(repo):
+    contents = 'test content\n'
+    obj = Object('blob', len(contents), contents)
+    store_object(obj)
+
+    object_cache.clear()
+    loose = load_object(obj.id)
+
+    repack()
+    os.remove(get_object_path(obj.id))
+
+    object_cache.clear()
+    packed = load_object(obj.id)
+
+    for loaded in (loose, packed):
+        assert type(loaded.contents) is bytes
+        assert loaded.contents == b'test content\n'
+        assert loaded.contents.decode() == contents
+        assert Object(loaded.type, loaded.size, loaded.contents).id == obj.id
+
+
+def test_load_object_is_cached(repo):
+    contents = 'test content\n'
+    obj = Object('blob', len(contents), contents)
+    store_object(obj)
+    object_cache.clear()
+
+    obj2 = load_object(obj.id)
+    assert object_cache.misses == 1 and object_cache.hits == 0
+
+    # Abbreviated IDs are resolved, then the object is found under its full ID.
+    obj3 = load_object(obj.id[:7])
+    assert obj3 is obj2
+    assert load_object(obj.id) is obj2
+    assert object_cache.hits == 2
+
+    os.remove(get_object_path(obj.id))
+    assert load_object(obj.id) is obj2
+
+
+def test_object_cache_is_bounded(repo):
+    object_cache.clear()
+    set_object_cache_size(10)
+
+    try:
+        first = Object('blob', 6, 'first\n')
+        second = Object('blob', 7, 'second\n')
+        store_object(first)
+        store_object(second)
+
+        assert len(object_cache) == 1
+        assert object_cache.size == 7
+        load_object(first.id)
+        assert object_cache.misses == 1
+    finally:
+        set_object_cache_size(OBJECT_CACHE_SIZE)
+
+
+def test_object_cache_is_per_repository(tmpdir, monkeypatch):
+    contents = 'test content\n'
+    obj = Object('blob', len(contents), contents)
+
+    for name in ('first', 'second'):
+        monkeypatch.chdir(tmpdir.mkdir(name))
+        cmd_init()
+
+    monkeypatch.chdir(tmpdir.join('first'))
+    store_object(obj)
+    assert load_object(obj.id) is not None
+
+    monkeypatch.chdir(tmpdir.join('second'))
+    with pytest.raises(FudgeException) as exception:
+        load_object(obj.id)
+    assert 'does not exist' in str(exception.value)
+
+
+def test_object_info(repo):
+    contents = os.urandom(1024 * 1024)
+    obj = Object('blob', len(contents), contents)
+    store_object(obj)
+    object_cache.clear()
+
+    info = object_info(obj.id[:7])
+    assert info == (obj.id, 'blob', len(contents))
+    assert len(object_cache) == 0
+
+    with pytest.raises(FudgeException) as exception:
+        object_info('abaddecaf')
+    assert 'does not exist' in str(exception.value)
+
+
+def test_hash_file(repo):
+    contents = os.urandom(3 * STREAM_CHUNK_SIZE + 10)
+    path = repo.join('large.bin')
+    path.write_binary(contents)
+
+    expected = Object('blob', len(contents), contents).id
+    assert hash_file(str(path)) == expected
+    assert not os.path.exists(get_object_path(expected))
+
+    assert hash_file(str(path), write=True) == expected
+    assert load_object(expected).contents == contents
+    assert not [name for name in os.listdir('.fudge/objects') if name.startswith('tmp_obj_')]
+
+    # Storing an existing object again leaves it untouched.
+    assert hash_file(str(path), write=True) == expected
+
+
+def test_iter_object_contents(repo):
+    contents = bytes(10 * STREAM_CHUNK_SIZE) + b'end\n'
+    obj = Object('blob', len(contents), contents)
+    store_object(obj)
+    object_cache.clear()
+
+    chunks = list(iter_object_contents(obj.id[:7]))
+    assert b''.join(chunks) == contents
+    assert max(len(chunk) for chunk in chunks) <= STREAM_CHUNK_SIZE
+
+    with pytest.raises(FudgeException) as exception:
+        iter_object_contents('abaddecaf')
+    assert 'does not exist' in str(exception.value)
+
+
+@pytest.mark.parametrize('policy', [FSYNC_NONE, FSYNC_OBJECT, FSYNC_BATCH])
+def test_store_object_fsync_policy(repo, monkeypatch, policy):
+    set_fsync_policy(policy)
+    try:
+        # Objects of an earlier batch are not synced again.
+        store_object(Object('blob', len('earlier\n'), 'earlier\n'))
+        sync_objects()
+
+        synced = []
+        monkeypatch.setattr(os, 'fsync', lambda fd: synced.append(os.fstat(fd).st_ino))
+
+        objects = [Object('blob', len(contents), contents) for contents in ('first\n', 'second\n')]
+        for obj in objects:
+            store_object(obj)
+        sync_objects()
+        sync_objects()
+    finally:
+        set_fsync_policy(FSYNC_NONE)
+
+    paths = [get_object_path(obj.id) for obj in objects]
+    expected = []
+    if policy != FSYNC_NONE:
+        expected.extend(os.stat(path).st_ino for path in paths)
+    if policy == FSYNC_BATCH and hasattr(os, 'O_DIRECTORY'):
+        # Then the fan-out directories of the batch, once each.
+        dirpaths = sorted(set(os.path.dirname(path) for path in paths))
+        expected.extend(os.stat(dirpath).st_ino for dirpath in dirpaths)
+
+    assert synced == expected
+    assert not [name for name in os.listdir('.fudge/objects') if name.startswith('tmp_obj_')]
+
+
+def test_invalid_fsync_policy():
+    with pytest.raises(FudgeException) as exception:
+        set_fsync_policy('sometimes')
+    assert 'invalid fsync policy' in str(exception.value)
+
+
+@pytest.mark.parametrize('config,policy', [
+    ('', FSYNC_NONE),
+    ('[core]\n\tfsyncObjectFiles = true\n', FSYNC_OBJECT),
+    ('[core]\n\tfsyncObjectFiles = true\n\tfsyncMethod = batch\n', FSYNC_BATCH),
+])
+def test_fsync_policy_from_config(tmpdir, monkeypatch, config, policy):
+    tmpdir.join('.gitconfig').write(config)
+    monkeypatch.setenv('HOME', str(tmpdir))
+    monkeypatch.setattr(fudge.object, '_fsync_policy', None)
+
+    assert get_fsync_policy() == policy
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_object_writer(repo, workers):
+    existing = Object('blob', 9, 'existing\n')
+    store_object(existing)
+
+    objects = [Object('blob', len(contents), contents)
+               for contents in ['blob {}\n'.format(i) for i in range(100)]]
+    objects += [existing, objects[0]]
+
+    ids = ObjectWriter(workers).write(objects)
+    assert ids == [obj.id for obj in objects]
+
+    object_cache.clear()
+    for obj in objects:
+        assert load_object(obj.id).contents == obj.contents
+
+    loose = [name for name in os.listdir('.fudge/objects') if len(name) == 2]
+    assert sum(len(os.listdir(os.path.join('.fudge/objects', name))) for name in loose) == 101
+
+
+def make_colliding_blobs(prefix_length):
+    """Return two blobs whose IDs share their first `prefix_length` characters."""
+    seen = {}
+    i = 0
+    while True:
+        contents = 'blob {}\n'.format(i)
+        obj = Object('blob', len(contents), contents)
+        other = seen.setdefault(obj.id[:prefix_length], obj)
+        if other is not obj:
+            return other, obj
+        i += 1
+
+
+def test_resolve_ambiguous_object_id(repo):
+    first, second = make_colliding_blobs(4)
+    store_object(first)
+    store_object(second)
+
+    with pytest.raises(FudgeException) as exception:
+        load_object(first.id[:4])
+    assert 'is ambiguous' in str(exception.value)
+
+    with pytest.raises(FudgeException) as exception:
+        load_object(first.id[:3])
+    assert 'invalid object name' in str(exception.value)
+
+    for obj in (first, second):
+        abbreviation = abbreviate_object_id(obj.id, min_length=4)
+        assert len(abbreviation) == len(os.path.commonprefix([first.id, second.id])) + 1
+        assert resolve_object_id(abbreviation) == obj.id
+        assert load_object(abbreviation).contents == obj.contents
+
+    assert abbreviate_object_id(first.id) == first.id[:7]
+
+
+def store_in_alternate(objects_path, obj):
+    dirpath = objects_path.ensure(obj.id[:2], dir=True)
+    dirpath.join(obj.id[2:]).write_binary(obj.compress())
+
+
+def test_objects_of_alternates(repo, tmpdir_factory):
+    alternate = tmpdir_factory.mktemp('objects')
+    add_alternate(str(alternate))
+
+    first, second = make_colliding_blobs(4)
+    store_in_alternate(alternate, first)
+    assert load_object(first.id[:7]).contents == first.contents
+    assert object_info(first.id) == (first.id, 'blob', first.size)
+
+    # Objects of alternates are not stored again.
+    store_object(first)
+    ObjectWriter().write([first])
+    repo.join('first.txt').write_binary(first.contents)
+    assert hash_file(str(repo.join('first.txt')), write=True) == first.id
+    assert not os.path.exists(get_object_path(first.id))
+
+    store_object(second)
+    assert os.path.exists(get_object_path(second.id))
+
+    with pytest.raises(FudgeException) as exception:
+        resolve_object_id(first.id[:4])
+    assert 'is ambiguous' in str(exception.value)
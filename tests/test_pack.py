@@ -0,0 +1,107 @@
+import io
+
+import pytest
+
+from fudge import pack
+from fudge.object import load_object
+from fudge.pack import index_pack, parse_pack, store_pack, write_pack_index
+from fudge.packfile import DeltaBaseCache, ObjectType, Pack, read_entry_header
+from fudge.utils import FudgeException, read_file
+
+from tests.conftest import get_data_path
+
+
+class TrickleReader(object):
+    """A file object returning at most a few bytes per read, like a slow socket."""
+
+    def __init__(self, data, size=7):
+        self.f = io.BytesIO(data)
+        self.size = size
+
+    def read(self, n):
+        return self.f.read(min(n, self.size))
+
+
+@pytest.mark.parametrize('name', ['ofs', 'ref'])
+@pytest.mark.parametrize('workers', [1, 2])
+def test_index_pack_matches_git(tmpdir, monkeypatch, name, workers):
+    # Split the delta forest into several batches, to use several workers.
+    monkeypatch.setattr(pack, 'RESOLVE_BATCH_SIZE', 2)
+
+    path = get_data_path('pack/{}.pack'.format(name))
+    destpath = str(tmpdir.join('pack.pack'))
+
+    with open(path, 'rb') as f:
+        entries, checksum = index_pack(f, destpath, workers)
+    assert len(entries) == 14
+    assert read_file(destpath) == read_file(path)
+
+    idxpath = str(tmpdir.join('pack.idx'))
+    write_pack_index(idxpath, entries, checksum)
+
+    assert read_file(idxpath) == read_file(get_data_path('pack/{}.idx'.format(name)))
+
+
+def test_index_pack_with_an_invalid_checksum(tmpdir):
+    data = bytearray(read_file(get_data_path('pack/ref.pack')))
+    data[-1] ^= 0xff
+
+    with pytest.raises(FudgeException) as exception:
+        index_pack(io.BytesIO(bytes(data)), str(tmpdir.join('pack.pack')))
+    assert 'bad pack file checksum' in str(exception.value)
+
+
+@pytest.mark.parametrize('name', ['ofs', 'ref'])
+def test_index_pack_truncated_inside_an_entry_header(tmpdir, name):
+    path = get_data_path('pack/{}.pack'.format(name))
+    data = read_file(path)
+
+    # Cut the pack inside the header of its first delta entry, after its type and size.
+    packfile = Pack(path)
+    offsets = sorted(packfile.index.get_offset(position) for position in range(len(packfile.index)))
+    offset = next(offset for offset in offsets if read_entry_header(packfile.data, offset)[0] in
+                  (ObjectType.DELTA_OFFSET, ObjectType.DELTA_BASE))
+
+    for end in (offset + 1, offset + 3):
+        with pytest.raises(FudgeException) as exception:
+            index_pack(io.BytesIO(data[:end]), str(tmpdir.join('pack.pack')))
+        assert 'truncated pack file' in str(exception.value)
+
+
+@pytest.mark.parametrize('name', ['ofs', 'ref'])
+@pytest.mark.parametrize('cache_size', [0, 1024 * 1024])
+def test_parse_pack(name, cache_size):
+    data = read_file(get_data_path('pack/{}.pack'.format(name)))
+    objects = list(parse_pack(TrickleReader(data), cache_size=cache_size))
+
+    ids = set(obj.id for obj in objects)
+    assert len(objects) == len(ids) == 14
+    assert 'a2d1be2794434c1378b07753d9781f3267776251' in ids
+
+
+def test_delta_base_cache_is_bounded():
+    cache = DeltaBaseCache(max_size=10)
+    cache.put(0, ObjectType.BLOB, b'1234')
+    cache.put(1, ObjectType.BLOB, b'5678')
+    assert cache.get(0) == (ObjectType.BLOB, b'1234')
+
+    # The least recently used entry is evicted first.
+    cache.put(2, ObjectType.BLOB, b'9abc')
+    assert 0 in cache and 1 not in cache and 2 in cache
+    assert cache.size == 8
+
+    # Entries larger than the cache are not cached at all.
+    cache.put(3, ObjectType.BLOB, b'x' * 11)
+    assert 3 not in cache and len(cache) == 2
+
+
+def test_store_pack(repo):
+    data = read_file(get_data_path('pack/ref.pack'))
+    path, num_objects = store_pack(TrickleReader(data))
+
+    assert num_objects == 14
+    assert read_file(path) == data
+    assert repo.join('.fudge', 'objects', 'pack').listdir()
+
+    obj = load_object('a2d1be2794434c1378b07753d9781f3267776251')
+    assert obj.type == 'blob'
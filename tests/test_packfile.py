@@ -0,0 +1,122 @@
+import os
+import shutil
+import zlib
+
+import pytest
+
+from fudge.object import (Object, abbreviate_object_id, load_object, object_info,
+                          resolve_object_id, store_object)
+from fudge.packfile import Pack, PackIndex, get_packs, iter_inflate
+from fudge.repository import add_alternate
+from fudge.utils import FudgeException
+
+from tests.conftest import get_data_path
+
+
+HEAD = '5a7f97f5d6d79edffa3c55b35a7c6753766d3cb5'
+
+
+def test_read_pack_index():
+    index = PackIndex(get_data_path('pack/ofs.idx'))
+    assert len(index) == 14
+
+    ids = list(index)
+    assert ids == sorted(ids)
+
+    assert index.find(HEAD) is not None
+    assert index.get_id(index.find(HEAD[:7])) == HEAD
+    assert index.find('0000000') is None
+    assert index.find('ffffffff') is None
+
+
+@pytest.mark.parametrize('name', ['ofs', 'ref'])
+def test_read_packed_objects(name):
+    pack = Pack(get_data_path('pack/{}.pack'.format(name)))
+
+    for position, object_id in enumerate(pack.index):
+        type_, contents = pack.read(pack.index.get_offset(position))
+        assert Object(type_, len(contents), contents).id == object_id
+
+
+@pytest.mark.parametrize('name', ['ofs', 'ref'])
+def test_read_packed_object_info(name):
+    pack = Pack(get_data_path('pack/{}.pack'.format(name)))
+
+    for position in range(len(pack.index)):
+        offset = pack.index.get_offset(position)
+        type_, contents = pack.read(offset)
+        assert pack.read_info(offset) == (type_, len(contents))
+        assert b''.join(pack.iter_contents(offset)) == contents
+
+
+def test_iter_inflate():
+    data = zlib.compress(bytes(100000)) + b'trailing data'
+    chunks = [data[i:i+10] for i in range(0, len(data), 10)]
+
+    inflated = list(iter_inflate(chunks, max_size=4096))
+    assert b''.join(inflated) == bytes(100000)
+    assert max(len(chunk) for chunk in inflated) == 4096
+
+    with pytest.raises(FudgeException) as exception:
+        list(iter_inflate([data[:20]]))
+    assert 'truncated' in str(exception.value)
+
+
+@pytest.mark.fudgefiles(
+    ['pack/ofs.pack', 'objects/pack/pack-ofs.pack'],
+    ['pack/ofs.idx', 'objects/pack/pack-ofs.idx'],
+)
+def test_load_packed_object(repo):
+    assert len(get_packs()) == 1
+
+    obj = load_object(HEAD)
+    assert obj.type == 'commit'
+    assert obj.contents.startswith(b'tree ')
+
+    obj = load_object('a2d1be2')
+    assert obj.type == 'blob'
+    assert b'line 10 of' in obj.contents
+    assert b'line 50 of' in obj.contents
+
+    assert object_info('a2d1be2') == (obj.id, 'blob', obj.size)
+
+
+@pytest.mark.fudgefiles(
+    ['pack/ofs.pack', 'objects/pack/pack-ofs.pack'],
+    ['pack/ofs.idx', 'objects/pack/pack-ofs.idx'],
+)
+def test_resolve_object_id_across_packs_and_loose_objects(repo):
+    assert resolve_object_id(HEAD[:7]) == HEAD
+    assert abbreviate_object_id(HEAD, min_length=4) == HEAD[:4]
+
+    # Store a loose blob whose ID shares its first 4 characters with HEAD.
+    i = 0
+    while True:
+        contents = 'blob {}\n'.format(i)
+        obj = Object('blob', len(contents), contents)
+        if obj.id[:4] == HEAD[:4]:
+            break
+        i += 1
+    store_object(obj)
+
+    with pytest.raises(FudgeException) as exception:
+        resolve_object_id(HEAD[:4])
+    assert 'is ambiguous' in str(exception.value)
+
+    length = len(os.path.commonprefix([HEAD, obj.id])) + 1
+    assert abbreviate_object_id(HEAD, min_length=4) == HEAD[:length]
+    assert abbreviate_object_id(obj.id, min_length=4) == obj.id[:length]
+
+
+def test_load_object_packed_in_alternates(repo, tmpdir_factory):
+    alternate = tmpdir_factory.mktemp('objects')
+    pack_dir = alternate.mkdir('pack')
+    for extension in ('pack', 'idx'):
+        destpath = str(pack_dir.join('pack-ofs.' + extension))
+        shutil.copy(get_data_path('pack/ofs.' + extension), destpath)
+    add_alternate(str(alternate))
+
+    assert get_packs() == []
+    assert resolve_object_id(HEAD[:7]) == HEAD
+    assert load_object(HEAD).type == 'commit'
+    assert object_info('a2d1be2').type == 'blob'
@@ -0,0 +1,151 @@
+import os
+
+from fudge import packobjects
+from fudge.object import Object, iter_loose_object_ids, store_object
+from fudge.pack import index_pack, write_pack_index
+from fudge.packfile import ObjectType, Pack, get_pack_directory, get_packs, read_entry_header
+from fudge.packobjects import name_hash, pack_objects, repack
+from fudge.repository import add_alternate
+from fudge.revlist import get_tips, iter_reachable_objects
+from fudge.utils import read_file
+
+from tests.conftest import write_history
+
+
+def read_pack(path):
+    pack = Pack(path)
+    objects = {}
+    for position, object_id in enumerate(pack.index):
+        offset = pack.index.get_offset(position)
+        objects[object_id] = (read_entry_header(pack.data, offset)[0], pack.read(offset))
+    return objects
+
+
+def test_name_hash():
+    assert name_hash('') == 0
+    assert name_hash('a b') == name_hash('ab')
+    # Hashes mostly depend on the end of the path.
+    assert name_hash('src/main.py') >> 24 == name_hash('test/main.py') >> 24
+
+
+def test_pack_objects(repo):
+    write_history(5)
+    objects = list(iter_reachable_objects(get_tips()))
+    assert len(objects) == 15
+
+    basepath = str(repo.join('test'))
+    path, num_objects = pack_objects(objects, basepath)
+    assert num_objects == 15
+    assert os.path.basename(path).startswith('test-')
+
+    packed = read_pack(path)
+    assert set(packed) == set(object_id for object_id, _ in objects)
+
+    # Blobs are stored as deltas against each other.
+    types = [object_type for object_type, _ in packed.values()]
+    assert types.count(ObjectType.DELTA_OFFSET) >= 4
+
+    for object_id, (_, (type_, contents)) in packed.items():
+        assert Object(type_, len(contents), contents).id == object_id
+
+    # Indexing the pack from scratch gives the same pack index.
+    with open(path, 'rb') as f:
+        entries, checksum = index_pack(f, str(repo.join('copy.pack')))
+
+    idxpath = str(repo.join('copy.idx'))
+    write_pack_index(idxpath, entries, checksum)
+    assert read_file(idxpath) == read_file(os.path.splitext(path)[0] + '.idx')
+
+
+def test_pack_objects_loads_objects_once(monkeypatch, repo):
+    write_history(5)
+    objects = list(iter_reachable_objects(get_tips()))
+
+    loaded = []
+    load_object = packobjects.load_object
+    monkeypatch.setattr(packobjects, 'load_object',
+                        lambda object_id: loaded.append(object_id) or load_object(object_id))
+
+    pack_objects(objects, str(repo.join('test')))
+    assert sorted(loaded) == sorted(object_id for object_id, _ in objects)
+
+
+def test_pack_objects_without_deltas(repo):
+    write_history(3)
+    objects = iter_reachable_objects(get_tips())
+
+    path, _ = pack_objects(objects, str(repo.join('test')), window=0)
+
+    types = [object_type for object_type, _ in read_pack(path).values()]
+    assert ObjectType.DELTA_OFFSET not in types
+
+
+def test_pack_objects_stores_big_objects_whole(repo):
+    write_history(5)
+    objects = iter_reachable_objects(get_tips())
+
+    path, _ = pack_objects(objects, str(repo.join('test')), big_file_threshold=1000)
+
+    blob_types = [object_type for object_type, (type_, _) in read_pack(path).values()
+                  if type_ == 'blob']
+    assert len(blob_types) == 5
+    assert ObjectType.DELTA_OFFSET not in blob_types
+
+
+def test_repack(repo):
+    write_history(3)
+    # An unreachable object is packed too.
+    contents = 'unreachable\n'
+    unreachable = Object('blob', len(contents), contents)
+    store_object(unreachable)
+
+    first, num_objects = repack()
+    assert num_objects == 10
+    assert len(get_packs()) == 1
+
+    write_history(4)
+    second, num_objects = repack(delete=True)
+    assert num_objects == 13
+    assert [pack.path for pack in get_packs()] == [second]
+    assert not os.path.exists(first)
+
+    assert unreachable.id in read_pack(second)
+    assert len(list(iter_loose_object_ids())) == 13
+
+
+def test_repack_within_a_clock_tick(repo):
+    write_history(3)
+    repack()
+    assert len(get_packs()) == 1
+
+    # The pack directory keeps its modification time, as on coarse-grained file systems.
+    dirpath = get_pack_directory()
+    mtime = os.stat(dirpath).st_mtime_ns
+    write_history(4)
+    path, _ = repack(delete=True)
+    os.utime(dirpath, ns=(mtime, mtime))
+
+    assert [pack.path for pack in get_packs()] == [path]
+
+
+def test_repack_leaves_out_objects_of_alternates(repo, tmpdir_factory):
+    write_history(3)
+
+    # Move every loose object to an alternate object directory.
+    alternate = tmpdir_factory.mktemp('objects')
+    objects_dir = repo.join('.fudge', 'objects')
+    for dirpath in objects_dir.listdir():
+        if len(dirpath.basename) == 2:
+            dirpath.move(alternate.join(dirpath.basename))
+    add_alternate(str(alternate))
+
+    commit_ids = write_history(4)
+    assert len(list(iter_loose_object_ids())) == 3
+
+    path, num_objects = repack(delete=True, write_bitmap=True)
+    assert num_objects == 3
+    assert not os.path.exists(os.path.splitext(path)[0] + '.bitmap')
+
+    packed = read_pack(path)
+    assert commit_ids[-1] in packed
+    assert commit_ids[0] not in packed
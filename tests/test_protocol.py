@@ -1,7 +1,7 @@
 import pytest
 import responses
 
-from fudge.protocol import discover_refs
+from fudge.protocol import discover_refs, upload_pack
 from fudge.utils import FudgeException, read_file
 
 from tests.conftest import get_data_path
@@ -41,3 +41,56 @@ def test_discover_refs():
 
         head_commit_id = discover_refs(repo_url, 'git-upload-pack')
         assert head_commit_id == '5adb9f329fe0bc8a882e886923f6bffcb77c986e'
+
+
+@responses.activate
+def test_upload_pack_streams_the_pack_file():
+    repo_url = 'https://github.com/bovarysme/fudge.git'
+    service = 'git-upload-pack'
+
+    url = '{}/info/refs?service={}'.format(repo_url, service)
+    body = read_file(get_data_path('protocol/advertisement'))
+    responses.add(
+        responses.GET, url, match_querystring=True,
+        status=200, content_type='application/x-{}-advertisement'.format(service), body=body
+    )
+
+    data = read_file(get_data_path('pack/ref.pack'))
+    responses.add(
+        responses.POST, '{}/{}'.format(repo_url, service),
+        status=200, content_type='application/x-{}-result'.format(service), body=b'0008NAK\n' + data
+    )
+
+    with upload_pack(repo_url) as (pack, head_object_id):
+        assert head_object_id == '5adb9f329fe0bc8a882e886923f6bffcb77c986e'
+        assert pack.read() == data
+
+    # The connection is released once the pack file is read.
+    assert pack.closed
+
+
+@responses.activate
+def test_upload_pack_with_haves():
+    repo_url = 'https://github.com/bovarysme/fudge.git'
+    service = 'git-upload-pack'
+
+    url = '{}/info/refs?service={}'.format(repo_url, service)
+    body = read_file(get_data_path('protocol/advertisement'))
+    responses.add(
+        responses.GET, url, match_querystring=True,
+        status=200, content_type='application/x-{}-advertisement'.format(service), body=body
+    )
+
+    have = '5a7f97f5d6d79edffa3c55b35a7c6753766d3cb5'
+    data = read_file(get_data_path('pack/ref.pack'))
+    responses.add(
+        responses.POST, '{}/{}'.format(repo_url, service),
+        status=200, content_type='application/x-{}-result'.format(service),
+        body=bytes('0031ACK {}\n'.format(have), 'utf-8') + data
+    )
+
+    with upload_pack(repo_url, [have]) as (pack, _):
+        assert pack.read() == data
+
+    request = responses.calls[1].request.body
+    assert request.endswith('0000' + '0032have {}\n'.format(have) + '0009done\n')
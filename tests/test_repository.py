@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from fudge.repository import (add_alternate, create_repository, find_alternates, get_repository,
+                              read_alternates)
+from fudge.utils import FudgeException
+
+
+def test_get_repository_from_a_subdirectory(repo):
+    repository = get_repository()
+    assert repository.path == str(repo.join('.fudge'))
+    assert repository.working_tree_path == str(repo)
+    assert repository.objects_path == str(repo.join('.fudge', 'objects'))
+
+    os.chdir(str(repo.mkdir('a').mkdir('b')))
+    assert get_repository().path == repository.path
+    assert get_repository() is get_repository()
+
+
+def test_get_repository_after_creating_a_nested_one(repo):
+    subdir = repo.mkdir('nested')
+    os.chdir(str(subdir))
+    assert get_repository().path == str(repo.join('.fudge'))
+
+    create_repository()
+    assert get_repository().path == str(subdir.join('.fudge'))
+
+
+def test_repository_not_found(tmpdir):
+    os.chdir(str(tmpdir))
+    if os.path.exists('/.fudge'):
+        pytest.skip('a repository exists at the root of the file system')
+
+    with pytest.raises(FudgeException) as exception:
+        get_repository()
+    assert 'repository not found' in str(exception.value)
+
+
+def test_find_alternates(tmpdir):
+    first, second, third = tmpdir.mkdir('first'), tmpdir.mkdir('second'), tmpdir.mkdir('third')
+
+    first.mkdir('info').join('alternates').write(
+        '# comment\n\n../second\n{}\n/nonexistent/objects\n'.format(third))
+    # Loops and duplicates are ignored.
+    second.mkdir('info').join('alternates').write('{}\n{}\n'.format(first, third))
+
+    assert read_alternates(str(first)) == [str(second), str(third), '/nonexistent/objects']
+    assert find_alternates(str(first)) == [str(second), str(third)]
+
+
+def test_add_alternate(repo, tmpdir_factory):
+    alternate = tmpdir_factory.mktemp('objects')
+    assert get_repository().alternates == []
+
+    add_alternate(str(alternate))
+    add_alternate(str(alternate))
+    assert get_repository().alternates == [str(alternate)]
+    assert repo.join('.fudge', 'objects', 'info', 'alternates').read() == str(alternate) + '\n'
+
+    with pytest.raises(FudgeException) as exception:
+        add_alternate(str(alternate.join('missing')))
+    assert 'does not exist' in str(exception.value)
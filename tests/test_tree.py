@@ -0,0 +1,86 @@
+from fudge import tree as tree_module
+from fudge.index import CacheTree, Index, IndexEntry, ObjectType, read_index, write_index
+from fudge.object import Object
+from fudge.tree import read_tree, write_tree
+
+
+PATHS = ['a.txt', 'a/b/c.txt', 'a/d.txt', 'e/f.txt', 'top.txt']
+
+
+def make_entry(path, contents=None):
+    contents = contents or 'contents of {}\n'.format(path)
+    object_id = Object('blob', len(contents), contents).id
+    return IndexEntry(0, 0, 0, 0, 0, 0, ObjectType.REGULAR_FILE, '100644', 0, 0,
+                      len(contents), object_id, path)
+
+
+def count_trees(monkeypatch):
+    written = []
+    object_writer = tree_module.ObjectWriter
+
+    class CountingObjectWriter(object_writer):
+        def write(self, objects):
+            written.extend(objects)
+            return super().write(objects)
+
+    monkeypatch.setattr(tree_module, 'ObjectWriter', CountingObjectWriter)
+    return written
+
+
+def write_tree_without_cache():
+    index = read_index()
+    index.cache_tree = None
+    write_index(index)
+    return write_tree()
+
+
+def test_write_tree_only_builds_changed_directories(monkeypatch, repo):
+    write_index(Index(make_entry(path) for path in PATHS))
+    written = count_trees(monkeypatch)
+
+    tree_id = write_tree()
+    assert len(written) == 4
+
+    cache_tree = read_index().cache_tree
+    assert (cache_tree.object_id, cache_tree.entry_count) == (tree_id, 5)
+    assert cache_tree.subtrees['a'].entry_count == 2
+
+    # Refreshing stat data does not invalidate trees.
+    index = read_index()
+    index.add(index.get('e/f.txt')._replace(mtime_s=1))
+    index.add(make_entry('a/b/c.txt', 'changed\n'))
+    write_index(index)
+
+    del written[:]
+    tree_id = write_tree()
+    assert len(written) == 3
+    assert write_tree() == tree_id
+    assert len(written) == 3
+
+    assert write_tree_without_cache() == tree_id
+
+
+def test_write_tree_after_removing_a_directory(repo):
+    write_index(Index(make_entry(path) for path in PATHS))
+    write_tree()
+
+    index = read_index()
+    index.remove('e/f.txt')
+    write_index(index)
+
+    tree_id = write_tree()
+    assert sorted(read_index().cache_tree.subtrees) == ['a']
+    assert write_tree_without_cache() == tree_id
+
+
+def test_read_tree_primes_the_cache_tree(repo):
+    write_index(Index(make_entry(path) for path in PATHS))
+    tree_id = write_tree()
+
+    write_index(Index())
+    read_tree(tree_id)
+
+    cache_tree = read_index().cache_tree
+    assert (cache_tree.object_id, cache_tree.entry_count) == (tree_id, 5)
+    assert isinstance(cache_tree.subtrees['a'].subtrees['b'], CacheTree)
+    assert write_tree() == tree_id
@@ -20,7 +20,10 @@ def test_stat_bounds(monkeypatch):
             result.st_atime,
             result.st_mtime,
             result.st_ctime,
-        ))
+        ), {
+            'st_ctime_ns': result.st_ctime_ns,
+            'st_mtime_ns': result.st_mtime_ns,
+        })
     monkeypatch.setattr(os, 'stat', mockstat)
 
     path = get_data_path('stat')
@@ -28,3 +31,12 @@ def test_stat_bounds(monkeypatch):
 
     for key, value in result.items():
         assert value < 2 ** 32, 'expected {} to have value less than 2 ** 32'.format(key)
+
+
+def test_stat_nanoseconds(tmpdir):
+    path = tmpdir.join('file')
+    path.write('')
+    os.utime(str(path), ns=(1500000000123456789, 1500000000987654321))
+
+    result = stat(str(path))
+    assert (result['mtime_s'], result['mtime_n']) == (1500000000, 987654321)
@@ -0,0 +1,106 @@
+import os
+import time
+
+import pytest
+
+from fudge import working
+from fudge.index import Index, add_files_to_index, read_index
+from fudge.working import compute_changed_and_untracked
+
+
+def write_files(repo, paths, mtime):
+    for path in paths:
+        repo.join(path).write('contents of {}\n'.format(path), ensure=True)
+        os.utime(str(repo.join(path)), (mtime, mtime))
+
+
+def count_hashes(monkeypatch):
+    hashed = []
+    hash_file = working.hash_file
+
+    def counting_hash_file(path):
+        hashed.append(os.path.basename(path))
+        return hash_file(path)
+
+    monkeypatch.setattr(working, 'hash_file', counting_hash_file)
+    return hashed
+
+
+def test_status_only_hashes_files_with_new_stat_data(monkeypatch, repo):
+    paths = ['a.txt', 'b.txt', 'dir/c.txt']
+    write_files(repo, paths, time.time() - 100)
+    add_files_to_index(paths)
+
+    hashed = count_hashes(monkeypatch)
+    assert compute_changed_and_untracked() == ([], [])
+    assert hashed == []
+
+    # A touched file is hashed once, then its stat data is refreshed in the index.
+    os.utime(str(repo.join('a.txt')), (time.time() - 50, time.time() - 50))
+    assert compute_changed_and_untracked() == ([], [])
+    assert compute_changed_and_untracked() == ([], [])
+    assert hashed == ['a.txt']
+
+    repo.join('b.txt').write('changed contents of b.txt\n')
+    assert compute_changed_and_untracked() == ([('modified', 'b.txt')], [])
+    assert 'b.txt' not in hashed
+
+
+def test_racily_clean_entries(repo):
+    paths = ['old.txt', 'new.txt']
+    write_files(repo, paths, time.time() - 100)
+    os.utime(str(repo.join('new.txt')), None)
+    add_files_to_index(paths)
+
+    # The size of entries written in the same second as their file is zeroed.
+    index = read_index()
+    assert index.get('old.txt').size == len('contents of old.txt\n')
+    assert index.get('new.txt').size == 0
+    assert compute_changed_and_untracked() == ([], [])
+
+    # Entries are racily clean if their file was not modified before the index was written.
+    entry = index.get('old.txt')
+    mtime = entry.mtime_s * 10 ** 9 + entry.mtime_n
+    assert Index(mtime=mtime).is_racily_clean(entry)
+    assert not Index(mtime=mtime + 1).is_racily_clean(entry)
+
+
+def touch_indexed_file(repo, paths):
+    write_files(repo, paths, time.time() - 100)
+    add_files_to_index(paths)
+
+    # The touched file makes status refresh its index entry.
+    os.utime(str(repo.join(paths[0])), (time.time() - 50, time.time() - 50))
+
+
+def test_status_leaves_a_valid_index_when_the_write_fails(monkeypatch, repo):
+    touch_indexed_file(repo, ['a.txt', 'b.txt'])
+    index_path = str(repo.join('.fudge', 'index'))
+    contents = repo.join('.fudge', 'index').read_binary()
+
+    def failing_replace(src, dst):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    with pytest.raises(OSError):
+        compute_changed_and_untracked()
+    monkeypatch.undo()
+
+    assert repo.join('.fudge', 'index').read_binary() == contents
+    assert not os.path.exists(index_path + '.lock')
+    assert [entry.path for entry in read_index()] == ['a.txt', 'b.txt']
+
+
+def test_status_skips_the_refresh_when_the_index_is_locked(repo):
+    touch_indexed_file(repo, ['a.txt', 'b.txt'])
+    contents = repo.join('.fudge', 'index').read_binary()
+
+    lock = repo.join('.fudge', 'index.lock')
+    lock.write('')
+    assert compute_changed_and_untracked() == ([], [])
+    assert repo.join('.fudge', 'index').read_binary() == contents
+    assert lock.exists()
+
+    lock.remove()
+    assert compute_changed_and_untracked() == ([], [])
+    assert repo.join('.fudge', 'index').read_binary() != contents